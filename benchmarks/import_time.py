@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# Import-time benchmark: runs each snippet in fresh interpreters and
+# reports the best wall-clock time, minus the bare interpreter startup.
+#
+#   python benchmarks/import_time.py [runs]
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPETS = [
+    ('import bitcoin', 'import bitcoin'),
+    ('import bitcoin + privtopub', 'import bitcoin; bitcoin.privtopub(1)'),
+    ('import bitcoin + mnemonic', 'import bitcoin; bitcoin.entropy_to_words(b"0" * 16)'),
+    ('from bitcoin import *', 'from bitcoin import *'),
+]
+
+
+def best_time(code, runs):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    base = best_time('pass', runs)
+    print('interpreter startup: %.1f ms' % (base * 1000))
+    for label, code in SNIPPETS:
+        print('%-30s %7.1f ms' % (label, (best_time(code, runs) - base) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,98 @@
+import sys
+
+# The core modules are imported eagerly. bci (block explorer access),
+# composite (built on bci), mnemonic (the BIP39 wordlist) and blockfiles
+# (the block file index, built on sqlite3) are loaded on first use of one
+# of their names through the module __getattr__ below (PEP 562), so that
+# `import bitcoin` stays cheap for the CLI and for worker processes.
+# `from bitcoin import *` still exports every name: the star import asks
+# for __all__, which loads everything. Pythons without module __getattr__
+# import everything up front, in the original order.
+
+_EAGER = sys.version_info < (3, 7)
+
 from bitcoin.py2specials import *
 from bitcoin.py3specials import *
 from bitcoin.main import *
 from bitcoin.transaction import *
 from bitcoin.deterministic import *
-from bitcoin.bci import *
-from bitcoin.composite import *
+if _EAGER:
+    from bitcoin.bci import *
+    from bitcoin.composite import *
 from bitcoin.stealth import *
 from bitcoin.blocks import *
-from bitcoin.mnemonic import *
-from bitcoin.segwit import *
\ No newline at end of file
+if _EAGER:
+    from bitcoin.mnemonic import *
+from bitcoin.segwit import *
+from bitcoin.signing import *
+from bitcoin.script import *
+if _EAGER:
+    from bitcoin.blockfiles import *
+
+_MODULES = ['py2specials', 'py3specials', 'main', 'transaction', 'deterministic',
+            'bci', 'composite', 'stealth', 'blocks', 'mnemonic', 'segwit', 'signing',
+            'script', 'blockfiles']
+
+# Public names defined by each lazily loaded module; kept in step with the
+# modules by test_import.TestLazyImport
+_LAZY_NAMES = {
+    'bci': [
+        'make_request', 'is_testnet', 'set_network', 'parse_addr_args',
+        'bci_unspent', 'blockinfo_unspent', 'blockr_unspent',
+        'helloblock_unspent', 'unspent_getters', 'unspent', 'history',
+        'bci_pushtx', 'testnet_pushtx', 'eligius_pushtx', 'blockr_pushtx',
+        'helloblock_pushtx', 'pushtx_getters', 'pushtx', 'last_block_height',
+        'bci_fetchtx', 'testnet_fetchtx', 'blockr_fetchtx',
+        'helloblock_fetchtx', 'fetchtx_getters', 'fetchtx', 'firstbits',
+        'get_block_at_height', 'bci_get_block_header_data',
+        'blockr_get_block_header_data', 'get_block_timestamp',
+        'block_header_data_getters', 'get_block_header_data',
+        'get_txs_in_block', 'get_block_height', 'get_tx_composite',
+        'blockcypher_mktx'],
+    'composite': [
+        'send', 'sendmultitx', 'preparetx', 'preparemultitx',
+        'bip32_hdm_script', 'bip32_hdm_addr', 'setup_coinvault_tx',
+        'sign_coinvault_tx', 'inspect', 'merkle_prove'],
+    'mnemonic': [
+        'wordlist_english', 'eint_to_bytes', 'mnemonic_int_to_words',
+        'entropy_cs', 'entropy_to_words', 'words_bisect', 'words_split',
+        'words_to_mnemonic_int', 'words_verify', 'mnemonic_to_seed',
+        'words_mine'],
+    'blockfiles': [
+        'BLOCKFILE_MAGIC', 'BlockFiles'],
+}
+_LAZY_INDEX = dict((name, module) for module in ['bci', 'composite', 'mnemonic', 'blockfiles']
+                   for name in _LAZY_NAMES[module])
+
+
+def _import(module):
+    __import__('bitcoin.' + module)
+    return sys.modules['bitcoin.' + module]
+
+
+def _load_all():
+    # Bind every name exactly as star-importing each module in order would
+    g = globals()
+    for module in _MODULES:
+        for name, value in list(vars(_import(module)).items()):
+            if not name.startswith('_'):
+                g[name] = value
+    g['__all__'] = sorted(set(n for n in g if not n.startswith('_')) | set(_LAZY_INDEX))
+    return g['__all__']
+
+
+def __getattr__(name):
+    if name == '__all__':
+        return _load_all()
+    if name in _LAZY_NAMES:
+        return _import(name)
+    if name in _LAZY_INDEX:
+        value = getattr(_import(_LAZY_INDEX[name]), name)
+        if name != 'wordlist_english':
+            globals()[name] = value
+        return value
+    raise AttributeError("module 'bitcoin' has no attribute %r" % name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_INDEX))
@@ -3,7 +3,6 @@ import json, re
 import random
 import sys
 import binascii
-import requests
 from bitcoin import safe_hexlify
 
 try:
@@ -305,6 +304,7 @@ def testnet_pushtx(tx):
     
     # blockchain.info doesn't support testnet
     # return make_request('https://testnet.blockchain.info/pushtx', 'tx='+tx)    
+    import requests
     return requests.post(url, json = {'tx':tx})
 
 def eligius_pushtx(tx):
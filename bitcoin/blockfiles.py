@@ -0,0 +1,285 @@
+import glob
+import mmap
+import os
+import sqlite3
+import struct
+
+from bitcoin.main import *
+from bitcoin.blocks import read_block, TxView, _header
+from bitcoin.transaction import _tx_extent
+
+# Block files
+#
+# Bitcoin Core stores blocks as they arrive in blocks/blk00000.dat,
+# blk00001.dat..., each block written as network magic, a 4-byte little
+# endian length and the serialized block, in no particular order, with
+# the unused tail of a file preallocated as zeros. BlockFiles memory-maps
+# these files and keeps an index of them in an SQLite database:
+#
+#   blocks  hash -> file, offset, length, previous hash, height, chain work
+#   chain   height -> hash of the block at that height on the best chain
+#   txs     txid -> file, offset, length of the transaction
+#   files   file -> bytes indexed so far
+#
+# update() scans only what was appended since the last scan, links new
+# blocks to their parents and moves the best chain (the chain with the
+# most work) to its new tip. Every lookup is then an index query and a
+# read of the mapped file at a known offset. Hashes are hex in the usual
+# (reversed) display order. Blocks written with Bitcoin Core's block file
+# obfuscation (blocksxor) have to be de-obfuscated first.
+
+BLOCKFILE_MAGIC = {
+    'btc': b'\xf9\xbe\xb4\xd9',
+    'testnet': b'\x0b\x11\x09\x07',
+    'regtest': b'\xfa\xbf\xb5\xda',
+}
+
+_SCHEMA_VERSION = 1
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    file INTEGER PRIMARY KEY, indexed INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS blocks (
+    hash BLOB PRIMARY KEY, prevhash BLOB NOT NULL, file INTEGER NOT NULL,
+    offset INTEGER NOT NULL, length INTEGER NOT NULL, bits INTEGER NOT NULL,
+    height INTEGER, work BLOB);
+CREATE INDEX IF NOT EXISTS blocks_prevhash ON blocks (prevhash);
+CREATE INDEX IF NOT EXISTS blocks_work ON blocks (work);
+CREATE TABLE IF NOT EXISTS chain (
+    height INTEGER PRIMARY KEY, hash BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS txs (
+    txid BLOB PRIMARY KEY, file INTEGER NOT NULL, offset INTEGER NOT NULL,
+    length INTEGER NOT NULL, block BLOB NOT NULL) WITHOUT ROWID;
+'''
+
+_NULL_HASH = b'\x00' * 32
+
+
+def _block_work(bits):
+    # Expected number of hashes for a block at the target encoded in bits
+    size, mantissa = bits >> 24, bits & 0x7fffff
+    if size <= 3:
+        target = mantissa >> (8 * (3 - size))
+    else:
+        target = mantissa << (8 * (size - 3))
+    return (1 << 256) // (target + 1)
+
+
+class BlockFiles(object):
+    """Bitcoin Core block files in blocksdir, indexed in the SQLite
+    database at index (by default blockindex.sqlite in blocksdir).
+
+    network selects the magic of BLOCKFILE_MAGIC; with txindex the
+    transactions are indexed too, which get_transaction needs. The index
+    is brought up to date on opening unless update is False."""
+
+    def __init__(self, blocksdir, index=None, network='btc', txindex=True, update=True):
+        self.blocksdir = blocksdir
+        self.magic = BLOCKFILE_MAGIC[network]
+        self.txindex = txindex
+        self._maps = {}
+        self._db = sqlite3.connect(index or os.path.join(blocksdir, 'blockindex.sqlite'))
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, _SCHEMA_VERSION):
+            raise Exception("Unsupported block index version %d" % version)
+        self._db.executescript(_SCHEMA)
+        self._db.execute('PRAGMA user_version = %d' % _SCHEMA_VERSION)
+        if update:
+            self.update()
+
+    def close(self):
+        for mm in self._maps.values():
+            try:
+                mm.close()
+            except BufferError:
+                # Still viewed by TxViews; unmapped once they are gone
+                pass
+        self._maps.clear()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Scanning
+
+    def _path(self, n):
+        return os.path.join(self.blocksdir, 'blk%05d.dat' % n)
+
+    def _map(self, n):
+        mm = self._maps.get(n)
+        if mm is None:
+            with open(self._path(n), 'rb') as f:
+                mm = self._maps[n] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
+    def update(self):
+        """Index the blocks written since the last update; returns how many
+        were added"""
+        db = self._db
+        indexed = dict(db.execute('SELECT file, indexed FROM files'))
+        added = 0
+        # One transaction: a scan that fails leaves the index as it was
+        try:
+            for path in sorted(glob.glob(os.path.join(self.blocksdir, 'blk[0-9][0-9][0-9][0-9][0-9].dat'))):
+                n = int(os.path.basename(path)[3:8])
+                start = indexed.get(n, 0)
+                if os.path.getsize(path) <= start:
+                    continue
+                # Map the file again, it has grown
+                self._maps.pop(n, None)
+                end, count = self._scan(n, start)
+                db.execute('INSERT OR REPLACE INTO files VALUES (?, ?)', (n, end))
+                added += count
+            if added:
+                self._connect()
+                self._move_tip()
+        except BaseException:
+            db.rollback()
+            raise
+        db.commit()
+        return added
+
+    def _scan(self, n, pos):
+        # Index the blocks of file n from pos on; returns the position
+        # after the last complete block and the number of blocks
+        db, magic = self._db, self.magic
+        buf = memoryview(self._map(n))
+        size, count = len(buf), 0
+        while pos + 8 <= size:
+            if buf[pos:pos + 4] != magic:
+                if buf[pos:pos + 4] == b'\x00' * 4:
+                    # Preallocated space, not written yet
+                    break
+                raise Exception("Bad magic in %s at offset %d" % (self._path(n), pos))
+            length = struct.unpack_from('<I', buf, pos + 4)[0]
+            start = pos + 8
+            if start + length > size:
+                break
+            header = _header(buf[start:start + 80])
+            blockhash = binascii.unhexlify(header['hash'])
+            db.execute('INSERT OR IGNORE INTO blocks VALUES (?, ?, ?, ?, ?, ?, NULL, NULL)',
+                       (blockhash, binascii.unhexlify(header['prevhash']), n, start, length,
+                        header['bits']))
+            if self.txindex:
+                header, txs = read_block(buf, start)
+                db.executemany('INSERT OR REPLACE INTO txs VALUES (?, ?, ?, ?, ?)',
+                               [(binascii.unhexlify(tx.txid()), n, tx.offset, tx.size, blockhash)
+                                for tx in txs])
+            pos = start + length
+            count += 1
+        del buf
+        return pos, count
+
+    def _connect(self):
+        # Give heights and chain work to the new blocks that descend from a
+        # genesis block (one with a null previous hash)
+        db = self._db
+        queue = []
+        for blockhash, prevhash, bits in db.execute(
+                'SELECT b.hash, b.prevhash, b.bits FROM blocks b LEFT JOIN blocks p '
+                'ON p.hash = b.prevhash WHERE b.height IS NULL '
+                'AND (p.height IS NOT NULL OR b.prevhash = ?)', (_NULL_HASH,)).fetchall():
+            if prevhash == _NULL_HASH:
+                height, work = 0, 0
+            else:
+                height, work = db.execute('SELECT height + 1, work FROM blocks WHERE hash = ?',
+                                          (prevhash,)).fetchone()
+                work = decode(work, 256)
+            queue.append((blockhash, bits, height, work))
+        while queue:
+            blockhash, bits, height, work = queue.pop()
+            work += _block_work(bits)
+            db.execute('UPDATE blocks SET height = ?, work = ? WHERE hash = ?',
+                       (height, encode(work, 256, 32), blockhash))
+            for child, bits in db.execute('SELECT hash, bits FROM blocks WHERE prevhash = ? '
+                                          'AND height IS NULL', (blockhash,)).fetchall():
+                queue.append((child, bits, height + 1, work))
+
+    def _move_tip(self):
+        # Point the chain table at the blocks of the chain with the most
+        # work, walking back from its tip to where it meets the old chain
+        db = self._db
+        row = db.execute('SELECT hash, height FROM blocks WHERE work IS NOT NULL '
+                         'ORDER BY work DESC, rowid LIMIT 1').fetchone()
+        if row is None:
+            return
+        blockhash, height = row
+        db.execute('DELETE FROM chain WHERE height > ?', (height,))
+        while height >= 0:
+            row = db.execute('SELECT hash FROM chain WHERE height = ?', (height,)).fetchone()
+            if row is not None and row[0] == blockhash:
+                break
+            db.execute('INSERT OR REPLACE INTO chain VALUES (?, ?)', (height, blockhash))
+            blockhash = db.execute('SELECT prevhash FROM blocks WHERE hash = ?',
+                                   (blockhash,)).fetchone()[0]
+            height -= 1
+
+    # Lookups
+
+    def _locate(self, blockhash):
+        if isinstance(blockhash, int_types):
+            blockhash = self.get_block_hash(blockhash)
+        row = self._db.execute('SELECT file, offset, length FROM blocks WHERE hash = ?',
+                               (binascii.unhexlify(blockhash),)).fetchone()
+        if row is None:
+            raise KeyError(blockhash)
+        return row
+
+    def get_block_hash(self, height):
+        row = self._db.execute('SELECT hash FROM chain WHERE height = ?', (height,)).fetchone()
+        if row is None:
+            raise KeyError(height)
+        return safe_hexlify(row[0])
+
+    def get_block_height(self, blockhash):
+        """Height of a block, on the best chain or not; None when its
+        ancestry is incomplete"""
+        row = self._db.execute('SELECT height FROM blocks WHERE hash = ?',
+                               (binascii.unhexlify(blockhash),)).fetchone()
+        if row is None:
+            raise KeyError(blockhash)
+        return row[0]
+
+    def last_block_height(self):
+        row = self._db.execute('SELECT MAX(height) FROM chain').fetchone()
+        return -1 if row[0] is None else row[0]
+
+    def get_header(self, block):
+        """Header of a block given by hash or best chain height, as
+        deserialize_header returns it"""
+        n, offset, length = self._locate(block)
+        return _header(memoryview(self._map(n))[offset:offset + 80])
+
+    def get_block(self, block, formt='bin'):
+        """Serialized block, given by hash or best chain height"""
+        n, offset, length = self._locate(block)
+        raw = self._map(n)[offset:offset + length]
+        return safe_hexlify(raw) if formt == 'hex' else raw
+
+    def read_block(self, block):
+        """(header, txs) of a block as read_block returns them, the views
+        pointing into the mapped file"""
+        n, offset, length = self._locate(block)
+        return read_block(self._map(n), offset)
+
+    def get_txs_in_block(self, block):
+        return [tx.txid() for tx in self.read_block(block)[1]]
+
+    def get_transaction(self, txid):
+        """A TxView of the transaction"""
+        if not self.txindex:
+            raise Exception("Transaction index disabled, open BlockFiles with txindex=True")
+        row = self._db.execute('SELECT file, offset, length FROM txs WHERE txid = ?',
+                               (binascii.unhexlify(txid),)).fetchone()
+        if row is None:
+            raise KeyError(txid)
+        n, offset, length = row
+        buf = memoryview(self._map(n))
+        witness = _tx_extent(buf, offset)[1]
+        return TxView(buf, offset, offset + length, witness, offset)
+
+    def fetchtx(self, txid):
+        """The serialized transaction, in hex"""
+        return safe_hexlify(self.get_transaction(txid).raw())
@@ -1,33 +1,45 @@
+import hashlib
+import mmap
+import struct
+
 from bitcoin.main import *
+from bitcoin.transaction import Transaction, _deserialize, _read_var_int, _tx_extent, \
+    _is_hex_tx
 
 
 def serialize_header(inp):
     o = encode(inp['version'], 256, 4)[::-1] + \
-        inp['prevhash'].decode('hex')[::-1] + \
-        inp['merkle_root'].decode('hex')[::-1] + \
+        binascii.unhexlify(inp['prevhash'])[::-1] + \
+        binascii.unhexlify(inp['merkle_root'])[::-1] + \
         encode(inp['timestamp'], 256, 4)[::-1] + \
         encode(inp['bits'], 256, 4)[::-1] + \
         encode(inp['nonce'], 256, 4)[::-1]
-    h = bin_sha256(bin_sha256(o))[::-1].encode('hex')
+    h = safe_hexlify(bin_sha256(bin_sha256(o))[::-1])
     assert h == inp['hash'], (sha256(o), inp['hash'])
-    return o.encode('hex')
+    return safe_hexlify(o)
 
 
 def deserialize_header(inp):
-    inp = inp.decode('hex')
+    if _is_hex_tx(inp):
+        inp = binascii.unhexlify(inp)
+    return _header(memoryview(inp)[:80])
+
+
+def _header(buf):
+    version, timestamp, bits, nonce = struct.unpack_from('<I64xIII', buf)
     return {
-        "version": decode(inp[:4][::-1], 256),
-        "prevhash": inp[4:36][::-1].encode('hex'),
-        "merkle_root": inp[36:68][::-1].encode('hex'),
-        "timestamp": decode(inp[68:72][::-1], 256),
-        "bits": decode(inp[72:76][::-1], 256),
-        "nonce": decode(inp[76:80][::-1], 256),
-        "hash": bin_sha256(bin_sha256(inp))[::-1].encode('hex')
+        "version": version,
+        "prevhash": safe_hexlify(buf[4:36].tobytes()[::-1]),
+        "merkle_root": safe_hexlify(buf[36:68].tobytes()[::-1]),
+        "timestamp": timestamp,
+        "bits": bits,
+        "nonce": nonce,
+        "hash": safe_hexlify(bin_dbl_sha256(buf.tobytes())[::-1])
     }
 
 
 def mk_merkle_proof(header, hashes, index):
-    nodes = [h.decode('hex')[::-1] for h in hashes]
+    nodes = [binascii.unhexlify(h)[::-1] for h in hashes]
     if len(nodes) % 2 and len(nodes) > 2:
         nodes.append(nodes[-1])
     layers = [nodes]
@@ -40,11 +52,141 @@ def mk_merkle_proof(header, hashes, index):
         nodes = newnodes
         layers.append(nodes)
     # Sanity check, make sure merkle root is valid
-    assert nodes[0][::-1].encode('hex') == header['merkle_root']
+    assert safe_hexlify(nodes[0][::-1]) == header['merkle_root']
     merkle_siblings = \
         [layers[i][(index >> i) ^ 1] for i in range(len(layers)-1)]
     return {
         "hash": hashes[index],
-        "siblings": [x[::-1].encode('hex') for x in merkle_siblings],
+        "siblings": [safe_hexlify(x[::-1]) for x in merkle_siblings],
         "header": header
     }
+
+# Raw blocks
+#
+# read_block reads a serialized block from bytes, an mmap or any buffer,
+# or from a file object, and returns its header (as deserialize_header)
+# and an iterator over its transactions. The transactions come out as
+# TxViews: the offset and size of the transaction, parsed only when asked
+# for. From a buffer the views point into it, so a block is walked without
+# copying; from a file each transaction is read on its own, so memory
+# stays at one transaction plus the read size whatever the block size.
+# Txids are hashed straight from the byte ranges of the transaction,
+# leaving out the witness.
+
+_READ_SIZE = 1 << 16
+
+
+class TxView(object):
+    """A serialized transaction inside a block, parsed on access"""
+    __slots__ = ('offset', 'size', '_buf', '_start', '_witness', '_txid')
+
+    def __init__(self, buf, start, end, witness, offset):
+        # buf[start:end] holds the transaction, found at offset in the
+        # source; witness is the offset of its witness data in buf, or None
+        self.offset = offset
+        self.size = end - start
+        self._buf = buf
+        self._start = start
+        self._witness = witness
+        self._txid = None
+
+    @property
+    def segwit(self):
+        return self._witness is not None
+
+    def raw(self):
+        return self._buf[self._start:self._start + self.size].tobytes()
+
+    def _hash(self, *ranges):
+        h = hashlib.sha256()
+        for a, b in ranges:
+            h.update(self._buf[a:b])
+        return safe_hexlify(hashlib.sha256(h.digest()).digest()[::-1])
+
+    def txid(self):
+        if self._txid is None:
+            start, end = self._start, self._start + self.size
+            if self._witness is None:
+                self._txid = self._hash((start, end))
+            else:
+                # version, ins and outs without marker and flag, locktime
+                self._txid = self._hash((start, start + 4), (start + 6, self._witness),
+                                        (end - 4, end))
+        return self._txid
+
+    def wtxid(self):
+        if self._witness is None:
+            return self.txid()
+        return self._hash((self._start, self._start + self.size))
+
+    def weight(self):
+        if self._witness is None:
+            return 4 * self.size
+        base = self.size - 2 - (self._start + self.size - 4 - self._witness)
+        return 3 * base + self.size
+
+    def vsize(self):
+        return (self.weight() + 3) // 4
+
+    def to_dict(self, formt='hex'):
+        """The transaction as deserialize would return it"""
+        return _deserialize(self._buf, self._start, formt == 'hex')[0]
+
+    def transaction(self):
+        return Transaction(self.raw())
+
+    def __repr__(self):
+        return 'TxView(%s)' % self.txid()
+
+
+def _buffer_txs(buf, pos, count):
+    for i in range(count):
+        end, witness = _tx_extent(buf, pos)
+        if end > len(buf):
+            raise Exception("Truncated block")
+        yield TxView(buf, pos, end, witness, pos)
+        pos = end
+
+
+def _file_txs(f, data, offset, count):
+    # data holds what has been read from f past the transaction count,
+    # starting at offset in the file
+    pos = 0
+    for i in range(count):
+        while True:
+            try:
+                end, witness = _tx_extent(data, pos)
+                if end <= len(data):
+                    break
+            except struct.error:
+                pass
+            more = f.read(max(_READ_SIZE, len(data) - pos))
+            if not more:
+                raise Exception("Truncated block")
+            data, offset, pos = data[pos:] + more, offset + pos, 0
+        raw = memoryview(data[pos:end])
+        yield TxView(raw, 0, end - pos, None if witness is None else witness - pos, offset + pos)
+        pos = end
+
+
+def read_block(source, offset=0):
+    """Read the block at offset in source: bytes, an mmap or another buffer,
+    or a file object, read from its current position unless offset is given.
+
+    Returns (header, txs), txs being an iterator of TxViews."""
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        buf = memoryview(source)
+        count, pos = _read_var_int(buf, offset + 80)
+        return _header(buf[offset:offset + 80]), _buffer_txs(buf, pos, count)
+    if offset:
+        source.seek(offset)
+    try:
+        start = source.tell()
+    except (AttributeError, IOError, OSError):
+        # Not seekable; offsets count from where reading started
+        start = 0
+    data = source.read(89)
+    if len(data) < 81:
+        raise Exception("Truncated block")
+    count, pos = _read_var_int(data, 80)
+    return _header(memoryview(data)[:80]), _file_txs(source, data[pos:], start + pos, count)
@@ -95,6 +95,13 @@ def sign_coinvault_tx(tx, priv):
     return serialize(txobj)
 
 
+def _address(script):
+    # None for outputs without a base58 address
+    if classify_script(script) in ('p2pkh', 'p2sh'):
+        return script_to_address(script)
+    return None
+
+
 # Inspects a transaction
 def inspect(tx, **kwargs):
     d = deserialize(tx)
@@ -105,12 +112,12 @@ def inspect(tx, **kwargs):
         i = _in['outpoint']['index']
         prevout = deserialize(fetchtx(h, **kwargs))['outs'][i]
         isum += prevout['value']
-        a = script_to_address(prevout['script'])
+        a = _address(prevout['script'])
         ins[a] = ins.get(a, 0) + prevout['value']
     outs = []
     osum = 0
     for _out in d['outs']:
-        outs.append({'address': script_to_address(_out['script']),
+        outs.append({'address': _address(_out['script']),
                      'value': _out['value']})
         osum += _out['value']
     return {
@@ -11,6 +11,7 @@ import time
 import random
 import hmac
 from bitcoin.ripemd import *
+from bitcoin.cache import LRUCache
 
 # Hashing transactions for signing
 
@@ -32,11 +33,28 @@ Gx = 550662630222773436695787188951685343262506034537775941755001873603891167292
 Gy = 32670510020758816978083085130507043184471273380659243275938904335757337482424
 G = (Gx, Gy)
 
+# GLV endomorphism of secp256k1: lambda * (x, y) = (beta * x, y). The basis
+# vectors (a1, b1), (a2, b2) split a scalar into two ~128-bit halves.
+
+GLV_ENABLED = True
+GLV_BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+GLV_LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+_GLV_A1 = 0x3086d221a7d46bcde86c90e49284eb15
+_GLV_B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+_GLV_A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+_GLV_B2 = _GLV_A1
+_SECP256K1 = (P, N, A, B, Gx, Gy)
+_GLV_CURVE = True
+
 
 def change_curve(p, n, a, b, gx, gy):
-    global P, N, A, B, Gx, Gy, G
+    global P, N, A, B, Gx, Gy, G, _G_TABLE, _G_ODD_MULTIPLES, _GLV_CURVE
     P, N, A, B, Gx, Gy = p, n, a, b, gx, gy
     G = (Gx, Gy)
+    _G_TABLE = _G_ODD_MULTIPLES = None
+    _GLV_CURVE = (P, N, A, B, Gx, Gy) == _SECP256K1
+    _DECOMPRESSION_CACHE.clear()
+    _SIGNATURE_CACHE.clear()
 
 
 def getG():
@@ -105,7 +123,7 @@ def jacobian_double(p):
         return (0, 0, 0)
     ysq = (p[1] ** 2) % P
     S = (4 * p[0] * ysq) % P
-    M = (3 * p[0] ** 2 + A * p[2] ** 4) % P
+    M = (3 * p[0] ** 2 + A * p[2] ** 4) % P if A else (3 * p[0] ** 2) % P
     nx = (M**2 - 2 * S) % P
     ny = (M * (S - nx) - 8 * ysq ** 2) % P
     nz = (2 * p[1] * p[2]) % P
@@ -136,25 +154,315 @@ def jacobian_add(p, q):
     return (nx, ny, nz)
 
 
+def jacobian_add_affine(p, q):
+    # Mixed addition: p is Jacobian, q is an affine point (implicit z = 1)
+    if not p[1]:
+        return (q[0], q[1], 1)
+    Z2 = (p[2] * p[2]) % P
+    U2 = (q[0] * Z2) % P
+    S2 = (q[1] * Z2 * p[2]) % P
+    if U2 == p[0]:
+        if S2 != p[1]:
+            return (0, 0, 1)
+        return jacobian_double(p)
+    H = U2 - p[0]
+    R = S2 - p[1]
+    H2 = (H * H) % P
+    H3 = (H * H2) % P
+    U1H2 = (p[0] * H2) % P
+    nx = (R ** 2 - H3 - 2 * U1H2) % P
+    ny = (R * (U1H2 - nx) - p[1] * H3) % P
+    nz = (H * p[2]) % P
+    return (nx, ny, nz)
+
+
 def from_jacobian(p):
     z = inv(p[2], P)
     return ((p[0] * z**2) % P, (p[1] * z**3) % P)
 
 
-def jacobian_multiply(a, n):
+def batch_from_jacobian(points):
+    # Montgomery's trick: normalizes all points with a single inversion
+    # and about 3 multiplications per point
+    prefix, acc = [], 1
+    for p in points:
+        prefix.append(acc)
+        if p[1]:
+            acc = (acc * p[2]) % P
+    acc = inv(acc, P)
+    o = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        p = points[i]
+        if not p[1]:
+            o[i] = (0, 0)
+            continue
+        z = (acc * prefix[i]) % P
+        acc = (acc * p[2]) % P
+        z2 = (z * z) % P
+        o[i] = ((p[0] * z2) % P, (p[1] * z2 * z) % P)
+    return o
+
+
+# Fixed-base multiplication of G. The table holds the affine multiples
+# j * 2**(w*i) * G (0 < j < 2**w) for every w-bit window of a scalar, so
+# n * G costs one mixed addition per non-zero window and no doublings.
+# It is built on first use and thrown away by change_curve.
+
+_G_TABLE_WINDOW = 4
+_G_TABLE = None
+
+
+def _build_g_table():
+    w = _G_TABLE_WINDOW
+    points = []
+    base = (Gx, Gy, 1)
+    for i in range((N.bit_length() + w - 1) // w):
+        row = [base]
+        for j in range(2, 2 ** w):
+            row.append(jacobian_add(row[-1], base))
+        points.extend(row)
+        for j in range(w):
+            base = jacobian_double(base)
+    points = batch_from_jacobian(points)
+    size = 2 ** w - 1
+    return (G, [points[i:i + size] for i in range(0, len(points), size)])
+
+
+def fixed_base_multiply(n):
+    # n * G in Jacobian coordinates using the precomputed window table
+    global _G_TABLE
+    table = _G_TABLE
+    if table is None or table[0] != G:
+        table = _G_TABLE = _build_g_table()
+    n %= N
+    w, mask = _G_TABLE_WINDOW, 2 ** _G_TABLE_WINDOW - 1
+    o = (0, 0, 1)
+    for row in table[1]:
+        if not n:
+            break
+        d = n & mask
+        if d:
+            o = jacobian_add_affine(o, row[d - 1])
+        n >>= w
+    return o
+
+
+# Variable-base multiplication: iterative width-w NAF with a table of the
+# odd multiples a, 3a, ..., (2**(w-1) - 1)a normalized to affine, so every
+# addition in the main loop is a mixed one.
+
+WNAF_WINDOW = 4
+
+
+def wnaf(n, w=WNAF_WINDOW):
+    # Width-w non-adjacent form of n, least significant digit first
+    digits = []
+    full, half = 2 ** w, 2 ** (w - 1)
+    while n:
+        if n & 1:
+            d = n & (full - 1)
+            if d >= half:
+                d -= full
+            n -= d
+        else:
+            d = 0
+        digits.append(d)
+        n >>= 1
+    return digits
+
+
+def _jacobian_odd_multiples(a, w):
+    a2 = jacobian_double(a)
+    multiples = [a]
+    for i in range(1, 2 ** (w - 2)):
+        multiples.append(jacobian_add(multiples[-1], a2))
+    return multiples
+
+
+def _odd_multiples(a, w):
+    return batch_from_jacobian(_jacobian_odd_multiples(a, w))
+
+
+def jacobian_multiply(a, n, w=WNAF_WINDOW):
     if a[1] == 0 or n == 0:
         return (0, 0, 1)
+    if a[2] == 1 and a[0] == Gx and a[1] == Gy:
+        return fixed_base_multiply(n)
+    n %= N
+    if n == 0:
+        return (0, 0, 1)
     if n == 1:
         return a
-    if n < 0 or n >= N:
-        return jacobian_multiply(a, n % N)
-    if (n % 2) == 0:
-        return jacobian_double(jacobian_multiply(a, n//2))
-    if (n % 2) == 1:
-        return jacobian_add(jacobian_double(jacobian_multiply(a, n//2)), a)
+    if glv_active():
+        return _jacobian_strauss([a], [n], w)
+    pos = _odd_multiples(a, w)
+    neg = [(x, P - y) for x, y in pos]
+    o = (0, 0, 1)
+    for d in reversed(wnaf(n, w)):
+        if o[1]:
+            o = jacobian_double(o)
+        if d > 0:
+            o = jacobian_add_affine(o, pos[d >> 1])
+        elif d < 0:
+            o = jacobian_add_affine(o, neg[-d >> 1])
+    return o
+
+
+# Simultaneous multiplication (Strauss/Shamir): the wNAF digits of every
+# scalar are interleaved over one shared doubling chain. G gets a wider,
+# cached table since it shows up in every verification and recovery.
+
+_G_WNAF_WINDOW = 7
+_G_ODD_MULTIPLES = None
+
+
+def _g_wnaf_tables():
+    global _G_ODD_MULTIPLES
+    table = _G_ODD_MULTIPLES
+    if table is None or table[0] != G:
+        pos = _odd_multiples((Gx, Gy, 1), _G_WNAF_WINDOW)
+        table = _G_ODD_MULTIPLES = \
+            (G, _G_WNAF_WINDOW, pos, [(x, P - y) for x, y in pos])
+    return table[1:]
+
+
+def glv_active():
+    return GLV_ENABLED and _GLV_CURVE
+
+
+def glv_split(k):
+    # k = k1 + k2 * GLV_LAMBDA (mod N) with |k1|, |k2| < 2**129
+    c1 = (_GLV_B2 * k + N // 2) // N
+    c2 = (-_GLV_B1 * k + N // 2) // N
+    return k - c1 * _GLV_A1 - c2 * _GLV_A2, -c1 * _GLV_B1 - c2 * _GLV_B2
+
+
+def _jacobian_strauss(points, scalars, w=WNAF_WINDOW):
+    # The odd multiples of every point but G are normalized together, so
+    # the tables cost a single inversion however many points there are
+    entries, pending = [], []
+    for a, n in zip(points, scalars):
+        n %= N
+        if a[1] == 0 or n == 0:
+            continue
+        if a[2] == 1 and a[0] == Gx and a[1] == Gy:
+            entries.append((n,) + _g_wnaf_tables())
+        else:
+            entries.append((n, w, None, None))
+            pending.extend(_jacobian_odd_multiples(a, w))
+    normalized = batch_from_jacobian(pending)
+    size = 2 ** (w - 2)
+    terms = []
+    glv = glv_active()
+    for n, aw, pos, neg in entries:
+        if pos is None:
+            pos, normalized = normalized[:size], normalized[size:]
+            neg = [(x, P - y) for x, y in pos]
+        if not glv:
+            terms.append((wnaf(n, aw), pos, neg))
+            continue
+        # n * a = k1 * a + k2 * phi(a); the tables of phi(a) are those of a
+        # with every x multiplied by beta, and a negative half swaps the
+        # positive and negative tables
+        k1, k2 = glv_split(n)
+        phi_pos = [((GLV_BETA * x) % P, y) for x, y in pos]
+        phi_neg = [((GLV_BETA * x) % P, y) for x, y in neg]
+        for k, kpos, kneg in [(k1, pos, neg), (k2, phi_pos, phi_neg)]:
+            if k > 0:
+                terms.append((wnaf(k, aw), kpos, kneg))
+            elif k < 0:
+                terms.append((wnaf(-k, aw), kneg, kpos))
+    o = (0, 0, 1)
+    for i in range(max([len(t[0]) for t in terms] or [0]) - 1, -1, -1):
+        if o[1]:
+            o = jacobian_double(o)
+        for digits, pos, neg in terms:
+            if i < len(digits):
+                d = digits[i]
+                if d > 0:
+                    o = jacobian_add_affine(o, pos[d >> 1])
+                elif d < 0:
+                    o = jacobian_add_affine(o, neg[-d >> 1])
+    return o
+
+
+def jacobian_shamir_multiply(a, n, b, m):
+    # n * a + m * b for Jacobian a and b
+    return _jacobian_strauss([a, b], [n, m])
+
+
+def shamir_multiply(a, n, b, m):
+    # n * a + m * b for affine a and b, with a single final inversion
+    return from_jacobian(jacobian_shamir_multiply(to_jacobian(a), n, to_jacobian(b), m))
+
+
+# Multi-scalar multiplication sum(k_i * P_i): Strauss for a handful of
+# points, Pippenger's bucket method once the per-point tables stop paying
+# for themselves. Only the final result is converted back to affine.
+
+PIPPENGER_THRESHOLD = 64
+
+
+def _jacobian_pippenger(points, scalars):
+    # points are affine; each c-bit window sorts the points into buckets by
+    # digit, and sum(j * bucket_j) comes out of two running sums
+    pairs = []
+    glv = glv_active()
+    for a, n in zip(points, scalars):
+        n %= N
+        if a[1] == 0 or n == 0:
+            continue
+        if not glv:
+            pairs.append((a, n))
+            continue
+        k1, k2 = glv_split(n)
+        for k, pt in [(k1, a), (k2, ((GLV_BETA * a[0]) % P, a[1]))]:
+            if k:
+                pairs.append((pt, k) if k > 0 else ((pt[0], P - pt[1]), -k))
+    o = (0, 0, 1)
+    if not pairs:
+        return o
+    c = max(2, len(pairs).bit_length() - 3)
+    mask = 2 ** c - 1
+    bits = max([n.bit_length() for a, n in pairs])
+    for shift in range(((bits + c - 1) // c - 1) * c, -1, -c):
+        for j in range(c):
+            if o[1]:
+                o = jacobian_double(o)
+        buckets = [(0, 0, 1)] * mask
+        for a, n in pairs:
+            d = (n >> shift) & mask
+            if d:
+                buckets[d - 1] = jacobian_add_affine(buckets[d - 1], a)
+        running = total = (0, 0, 1)
+        for bucket in reversed(buckets):
+            running = jacobian_add(running, bucket)
+            total = jacobian_add(total, running)
+        o = jacobian_add(o, total)
+    return o
+
+
+def jacobian_multi_scalar_multiply(points, scalars):
+    # sum(scalars[i] * points[i]) for Jacobian points
+    if len(points) != len(scalars):
+        raise Exception("Need exactly one scalar per point")
+    if len(points) < PIPPENGER_THRESHOLD:
+        return _jacobian_strauss(points, scalars)
+    if any(p[2] != 1 for p in points):
+        return _jacobian_pippenger(batch_from_jacobian(points), scalars)
+    return _jacobian_pippenger(points, scalars)
+
+
+def multi_scalar_multiply(points, scalars):
+    # points may be decoded (x, y) tuples or pubkeys in any format
+    points = [to_jacobian(p if isinstance(p, (tuple, list)) else decode_pubkey(p))
+              for p in points]
+    return from_jacobian(jacobian_multi_scalar_multiply(points, scalars))
 
 
 def fast_multiply(a, n):
+    if a[0] == Gx and a[1] == Gy:
+        return from_jacobian(fixed_base_multiply(n))
     return from_jacobian(jacobian_multiply(to_jacobian(a), n))
 
 
@@ -164,6 +472,22 @@ def fast_add(a, b):
 # Functions for handling pubkey and privkey formats
 
 
+# Decompressing a pubkey costs a modular square root, and the same keys tend
+# to come back (cosigners, change addresses), so decoded points are kept in
+# a bounded LRU cache keyed on the 33-byte encoding
+
+DECOMPRESSION_CACHE_SIZE = 4096
+_DECOMPRESSION_CACHE = LRUCache(DECOMPRESSION_CACHE_SIZE)
+
+
+def set_decompression_cache_size(size):
+    _DECOMPRESSION_CACHE.resize(size)
+
+
+def decompression_cache_info():
+    return _DECOMPRESSION_CACHE.info()
+
+
 def get_pubkey_format(pub):
     if is_python2:
         two = '\x02'
@@ -175,6 +499,8 @@ def get_pubkey_format(pub):
         four = 4
 
     if isinstance(pub, (tuple, list)): return 'decimal'
+    elif isinstance(pub, PublicKey):
+        return 'object_compressed' if pub.compressed else 'object'
     elif len(pub) == 65 and pub[0] == four: return 'bin'
     elif len(pub) == 130 and pub[0:2] == '04': return 'hex'
     elif len(pub) == 33 and pub[0] in [two, three]: return 'bin_compressed'
@@ -185,7 +511,11 @@ def get_pubkey_format(pub):
 
 
 def encode_pubkey(pub, formt):
-    if not isinstance(pub, (tuple, list)):
+    if isinstance(pub, PublicKey):
+        if 'object' not in formt: return pub.encode(formt)
+        elif pub.compressed == (formt == 'object_compressed'): return pub
+        pub = pub.point
+    elif not isinstance(pub, (tuple, list)):
         pub = decode_pubkey(pub)
     if formt == 'decimal': return pub
     elif formt == 'bin': return b'\x04' + encode(pub[0], 256, 32) + encode(pub[1], 256, 32)
@@ -196,18 +526,26 @@ def encode_pubkey(pub, formt):
         return '0'+str(2+(pub[1] % 2)) + encode(pub[0], 16, 64)
     elif formt == 'bin_electrum': return encode(pub[0], 256, 32) + encode(pub[1], 256, 32)
     elif formt == 'hex_electrum': return encode(pub[0], 16, 64) + encode(pub[1], 16, 64)
+    elif formt == 'object': return PublicKey(pub, False)
+    elif formt == 'object_compressed': return PublicKey(pub, True)
     else: raise Exception("Invalid format!")
 
 
 def decode_pubkey(pub, formt=None):
     if not formt: formt = get_pubkey_format(pub)
     if formt == 'decimal': return pub
+    elif formt in ['object', 'object_compressed']: return pub.point
     elif formt == 'bin': return (decode(pub[1:33], 256), decode(pub[33:65], 256))
     elif formt == 'bin_compressed':
-        x = decode(pub[1:33], 256)
-        beta = pow(int(x*x*x+A*x+B), int((P+1)//4), int(P))
-        y = (P-beta) if ((beta + from_byte_to_int(pub[0])) % 2) else beta
-        return (x, y)
+        key = bytes(pub)
+        point = _DECOMPRESSION_CACHE.get(key)
+        if point is None:
+            x = decode(pub[1:33], 256)
+            beta = pow(int(x*x*x+A*x+B), int((P+1)//4), int(P))
+            y = (P-beta) if ((beta + from_byte_to_int(pub[0])) % 2) else beta
+            point = (x, y)
+            _DECOMPRESSION_CACHE.put(key, point)
+        return point
     elif formt == 'hex': return (decode(pub[2:66], 16), decode(pub[66:130], 16))
     elif formt == 'hex_compressed':
         return decode_pubkey(safe_from_hex(pub), 'bin_compressed')
@@ -219,6 +557,8 @@ def decode_pubkey(pub, formt=None):
 
 def get_privkey_format(priv):
     if isinstance(priv, int_types): return 'decimal'
+    elif isinstance(priv, PrivateKey):
+        return 'object_compressed' if priv.compressed else 'object'
     elif len(priv) == 32: return 'bin'
     elif len(priv) == 33: return 'bin_compressed'
     elif len(priv) == 64: return 'hex'
@@ -230,7 +570,11 @@ def get_privkey_format(priv):
         else: raise Exception("WIF does not represent privkey")
 
 def encode_privkey(priv, formt, vbyte=0):
-    if not isinstance(priv, int_types):
+    if isinstance(priv, PrivateKey):
+        if 'object' not in formt: return priv.encode(formt, vbyte)
+        elif priv.compressed == (formt == 'object_compressed'): return priv
+        priv = priv.secret
+    elif not isinstance(priv, int_types):
         return encode_privkey(decode_privkey(priv), formt, vbyte)
     if formt == 'decimal': return priv
     elif formt == 'bin': return encode(priv, 256, 32)
@@ -241,11 +585,14 @@ def encode_privkey(priv, formt, vbyte=0):
         return bin_to_b58check(encode(priv, 256, 32), 128+int(vbyte))
     elif formt == 'wif_compressed':
         return bin_to_b58check(encode(priv, 256, 32)+b'\x01', 128+int(vbyte))
+    elif formt == 'object': return PrivateKey(priv, False, vbyte)
+    elif formt == 'object_compressed': return PrivateKey(priv, True, vbyte)
     else: raise Exception("Invalid format!")
 
 def decode_privkey(priv,formt=None):
     if not formt: formt = get_privkey_format(priv)
     if formt == 'decimal': return priv
+    elif formt in ['object', 'object_compressed']: return priv.secret
     elif formt == 'bin': return decode(priv, 256)
     elif formt == 'bin_compressed': return decode(priv[:32], 256)
     elif formt == 'hex': return decode(priv, 16)
@@ -287,6 +634,7 @@ def compress(pubkey):
     elif f == 'bin': return encode_pubkey(decode_pubkey(pubkey, f), 'bin_compressed')
     elif f == 'hex' or f == 'decimal':
         return encode_pubkey(decode_pubkey(pubkey, f), 'hex_compressed')
+    elif f == 'object': return encode_pubkey(pubkey, 'object_compressed')
 
 
 def decompress(pubkey):
@@ -295,9 +643,12 @@ def decompress(pubkey):
     elif f == 'bin_compressed': return encode_pubkey(decode_pubkey(pubkey, f), 'bin')
     elif f == 'hex_compressed' or f == 'decimal':
         return encode_pubkey(decode_pubkey(pubkey, f), 'hex')
+    elif f == 'object_compressed': return encode_pubkey(pubkey, 'object')
 
 
 def privkey_to_pubkey(privkey):
+    if isinstance(privkey, PrivateKey):
+        return privkey.public_key()
     f = get_privkey_format(privkey)
     privkey = decode_privkey(privkey, f)
     if privkey >= N:
@@ -310,6 +661,18 @@ def privkey_to_pubkey(privkey):
 privtopub = privkey_to_pubkey
 
 
+def batch_privkey_to_pubkey(privkeys):
+    formats, points = [], []
+    for privkey in privkeys:
+        f = get_privkey_format(privkey)
+        privkey = decode_privkey(privkey, f)
+        if privkey >= N:
+            raise Exception("Invalid privkey")
+        formats.append(f if 'wif' not in f else f.replace('wif', 'hex'))
+        points.append(fixed_base_multiply(privkey))
+    return [encode_pubkey(p, f) for p, f in zip(batch_from_jacobian(points), formats)]
+
+
 def privkey_to_address(priv, magicbyte=0):
     return pubkey_to_address(privkey_to_pubkey(priv), magicbyte)
 privtoaddr = privkey_to_address
@@ -337,17 +700,165 @@ def subtract_privkeys(p1, p2):
     k2 = decode_privkey(p2, f2)
     return encode_privkey((decode_privkey(p1, f1) - k2) % N, f1)
 
+# Key objects: the integer or point form is decoded and validated once, and
+# every encoding is memoized on first use, so the same keys can be passed
+# through the functions above without being re-parsed each time
+
+
+class PrivateKey(object):
+    __slots__ = ('secret', 'compressed', 'vbyte', '_encodings', '_pubkey')
+
+    def __init__(self, priv, compressed=None, vbyte=None):
+        f = get_privkey_format(priv)
+        secret = decode_privkey(priv, f)
+        if not 0 < secret < N:
+            raise Exception("Invalid privkey")
+        # The network of a WIF key (or of a key object) is kept, and used
+        # for its WIF encodings and addresses
+        if 'wif' in f:
+            own = get_version_byte(priv) - 128
+        elif isinstance(priv, PrivateKey):
+            own = priv.vbyte
+        else:
+            own = None
+        if own is None:
+            own = 0 if vbyte is None else int(vbyte)
+        elif vbyte is not None and int(vbyte) != own:
+            raise Exception("Version byte %d does not match the key's %d" % (int(vbyte), own))
+        self.secret = secret
+        self.compressed = 'compressed' in f if compressed is None else compressed
+        self.vbyte = own
+        self._encodings = {}
+        self._pubkey = None
+
+    def encode(self, formt=None, vbyte=None):
+        if formt is None:
+            formt = 'hex_compressed' if self.compressed else 'hex'
+        if vbyte is None:
+            vbyte = self.vbyte
+        key = (formt, int(vbyte)) if 'wif' in formt else formt
+        try:
+            return self._encodings[key]
+        except KeyError:
+            encoded = self._encodings[key] = encode_privkey(self.secret, formt, vbyte)
+            return encoded
+
+    def wif(self, vbyte=None):
+        return self.encode('wif_compressed' if self.compressed else 'wif', vbyte)
+
+    def public_key(self):
+        if self._pubkey is None:
+            self._pubkey = PublicKey(fast_multiply(G, self.secret), self.compressed)
+        return self._pubkey
+
+    def address(self, magicbyte=None):
+        return self.public_key().address(self.vbyte if magicbyte is None else magicbyte)
+
+    def __eq__(self, other):
+        return isinstance(other, PrivateKey) and \
+            (self.secret, self.compressed) == (other.secret, other.compressed)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.secret, self.compressed))
+
+
+class PublicKey(object):
+    __slots__ = ('point', 'compressed', '_encodings')
+
+    def __init__(self, pub, compressed=None):
+        f = get_pubkey_format(pub)
+        x, y = decode_pubkey(pub, f)
+        if isinf((x, y)) or (x**3 + A*x + B - y*y) % P != 0:
+            raise Exception("Point not on curve")
+        self.point = (x, y)
+        self.compressed = 'compressed' in f if compressed is None else compressed
+        self._encodings = {}
+
+    def encode(self, formt=None):
+        if formt is None:
+            formt = 'hex_compressed' if self.compressed else 'hex'
+        try:
+            return self._encodings[formt]
+        except KeyError:
+            encoded = self._encodings[formt] = encode_pubkey(self.point, formt)
+            return encoded
+
+    def bin_hash160(self):
+        try:
+            return self._encodings['hash160']
+        except KeyError:
+            h = self._encodings['hash160'] = bin_hash160(
+                self.encode('bin_compressed' if self.compressed else 'bin'))
+            return h
+
+    def hash160(self):
+        return safe_hexlify(self.bin_hash160())
+
+    def address(self, magicbyte=0):
+        key = ('address', magicbyte)
+        try:
+            return self._encodings[key]
+        except KeyError:
+            addr = self._encodings[key] = bin_to_b58check(self.bin_hash160(), magicbyte)
+            return addr
+
+    def __eq__(self, other):
+        return isinstance(other, PublicKey) and \
+            (self.point, self.compressed) == (other.point, other.compressed)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.point, self.compressed))
+
+    def __repr__(self):
+        return 'PublicKey(%r)' % self.encode()
+
 # Hashes
 
 
+# Whether hashlib (OpenSSL) provides RIPEMD-160; OpenSSL 3 builds often
+# do not, and the pure Python version in bitcoin.ripemd is used instead
+
+try:
+    hashlib.new('ripemd160', b'')
+    HASHLIB_RIPEMD160 = True
+except ValueError:
+    HASHLIB_RIPEMD160 = False
+
+
 def bin_hash160(string):
     intermed = hashlib.sha256(string).digest()
-    digest = ''
-    try:
-        digest = hashlib.new('ripemd160', intermed).digest()
-    except:
-        digest = RIPEMD160(intermed).digest()
-    return digest
+    if HASHLIB_RIPEMD160:
+        return hashlib.new('ripemd160', intermed).digest()
+    return rmd160(intermed)
+
+
+# Without the C RIPEMD-160, batches of at least this many inputs are hashed
+# in NumPy lanes (bitcoin.ripemd_numpy) when NumPy is installed
+
+NUMPY_HASH160_THRESHOLD = 64
+
+
+def bin_hash160_many(strings):
+    sha256 = hashlib.sha256
+    if HASHLIB_RIPEMD160:
+        new = hashlib.new
+        return [new('ripemd160', sha256(s).digest()).digest() for s in strings]
+    digests = [sha256(s).digest() for s in strings]
+    if len(digests) >= NUMPY_HASH160_THRESHOLD:
+        from bitcoin import ripemd_numpy
+        if ripemd_numpy.available():
+            return ripemd_numpy.rmd160_many(digests)
+    return [rmd160(d) for d in digests]
+
+
+def hash160_many(strings):
+    return [safe_hexlify(h) for h in bin_hash160_many(strings)]
 
 
 def hash160(string):
@@ -363,11 +874,9 @@ def sha256(string):
 
 
 def bin_ripemd160(string):
-    try:
-        digest = hashlib.new('ripemd160', string).digest()
-    except:
-        digest = RIPEMD160(string).digest()
-    return digest
+    if HASHLIB_RIPEMD160:
+        return hashlib.new('ripemd160', string).digest()
+    return rmd160(string)
 
 
 def ripemd160(string):
@@ -431,18 +940,57 @@ def random_electrum_seed():
 
 # Encodings
 
-def b58check_to_bin(inp):
-    leadingzbytes = len(re.match('^1*', inp).group(0))
+def _b58check_data(inp):
+    # Version byte + payload + checksum, or None if the checksum is wrong
+    leadingzbytes = len(inp) - len(inp.lstrip('1'))
     data = b'\x00' * leadingzbytes + changebase(inp, 58, 256)
-    assert bin_dbl_sha256(data[:-4])[:4] == data[-4:]
+    return data if bin_dbl_sha256(data[:-4])[:4] == data[-4:] else None
+
+
+def b58check_to_bin(inp):
+    data = _b58check_data(inp)
+    assert data is not None
     return data[1:-4]
 
 
 def get_version_byte(inp):
-    leadingzbytes = len(re.match('^1*', inp).group(0))
-    data = b'\x00' * leadingzbytes + changebase(inp, 58, 256)
-    assert bin_dbl_sha256(data[:-4])[:4] == data[-4:]
-    return ord(data[0])
+    data = _b58check_data(inp)
+    assert data is not None
+    return from_byte_to_int(data[0])
+
+
+def b58check_encode_many(payloads, magicbyte=0):
+    # Same output as [bin_to_b58check(p, magicbyte) for p in payloads]
+    prefix = from_int_to_byte(int(magicbyte))
+    sha256 = hashlib.sha256
+    out = []
+    for payload in payloads:
+        data = prefix + payload
+        zeros = len(data) - len(data.lstrip(b'\x00'))
+        checksum = sha256(sha256(data).digest()).digest()[:4]
+        out.append('1' * zeros + encode(decode(data + checksum, 256), 58))
+    return out
+
+
+def b58check_decode_many(inps, strict=True):
+    # (version byte, payload) for every base58check string; an invalid
+    # string raises when strict, and gives None otherwise
+    sha256 = hashlib.sha256
+    out = []
+    for inp in inps:
+        try:
+            zeros = len(inp) - len(inp.lstrip('1'))
+            data = b'\x00' * zeros + encode(decode(inp, 58), 256)
+        except ValueError:
+            data = b''
+        if len(data) < 5 or \
+                sha256(sha256(data[:-4]).digest()).digest()[:4] != data[-4:]:
+            if strict:
+                raise Exception("Invalid base58check string: %r" % (inp,))
+            out.append(None)
+        else:
+            out.append((from_byte_to_int(data[0]), data[1:-4]))
+    return out
 
 
 def hex_to_b58check(inp, magicbyte=0):
@@ -454,6 +1002,8 @@ def b58check_to_hex(inp):
 
 
 def pubkey_to_address(pubkey, magicbyte=0):
+    if isinstance(pubkey, PublicKey):
+        return pubkey.address(magicbyte)
     if isinstance(pubkey, (list, tuple)):
         pubkey = encode_pubkey(pubkey, 'bin')
     if len(pubkey) in [66, 130]:
@@ -464,6 +1014,25 @@ def pubkey_to_address(pubkey, magicbyte=0):
 pubtoaddr = pubkey_to_address
 
 
+def batch_pubkey_to_address(pubkeys, magicbyte=0):
+    # Same output as [pubkey_to_address(p, magicbyte) for p in pubkeys],
+    # with the hash160s and the base58check encodings done as batches
+    keys = []
+    for pub in pubkeys:
+        if isinstance(pub, PublicKey):
+            pub = pub.encode('bin_compressed' if pub.compressed else 'bin')
+        elif isinstance(pub, (list, tuple)):
+            pub = encode_pubkey(pub, 'bin')
+        elif len(pub) in [66, 130]:
+            pub = binascii.unhexlify(pub)
+        keys.append(pub)
+    return b58check_encode_many(bin_hash160_many(keys), magicbyte)
+
+
+def batch_privkey_to_address(privkeys, magicbyte=0):
+    return batch_pubkey_to_address(batch_privkey_to_pubkey(privkeys), magicbyte)
+
+
 def is_privkey(priv):
     try:
         get_privkey_format(priv)
@@ -534,19 +1103,131 @@ def ecdsa_sign(msg, priv):
     return sig
 
 
+# Signature cache
+#
+# Valid signatures are remembered under a salted hash of the message hash,
+# public key, r and s, so that checking a signature again (revalidating
+# mempool transactions, re-checking a multisig transaction as cosigners
+# add signatures) skips the curve arithmetic. Only successes are stored.
+# The salt is random per process, so cache keys cannot be chosen by
+# whoever supplies the signatures. The size is a memory ceiling in bytes.
+
+SIGNATURE_CACHE_BYTES = 32 << 20
+# Measured footprint of one entry: 32-byte key plus the LRU bookkeeping
+_SIGNATURE_CACHE_ENTRY_BYTES = 176
+_SIGNATURE_CACHE_SALT = os.urandom(32)
+_SIGNATURE_CACHE = LRUCache(SIGNATURE_CACHE_BYTES // _SIGNATURE_CACHE_ENTRY_BYTES)
+
+
+def set_signature_cache_size(nbytes):
+    _SIGNATURE_CACHE.resize(nbytes // _SIGNATURE_CACHE_ENTRY_BYTES)
+
+
+def signature_cache_info():
+    return _SIGNATURE_CACHE.info()
+
+
+def _signature_cache_key(z, r, s, Q):
+    return hashlib.sha256(b''.join([_SIGNATURE_CACHE_SALT, encode(z % N, 256, 32),
+                                    encode(Q[0], 256, 32), encode(Q[1], 256, 32),
+                                    encode(r, 256, 32), encode(s, 256, 32)])).digest()
+
+
 def ecdsa_raw_verify(msghash, vrs, pub):
-    vr, r, vs, s = vrs
-    if not (27 <= vr <= 34):
-        return False
-    if not (27 <= vs <= 34):
-        return False
+    # vrs is (v, r, s) as from ecdsa_raw_sign/decode_sig, the
+    # (rlen, r, slen, s) tuple returned by der_decode_sig, or just (r, s)
+    if len(vrs) == 2:
+        r, s = vrs
+    else:
+        if len(vrs) == 3:
+            vr, r, s = vrs
+            vs = vr
+        else:
+            vr, r, vs, s = vrs
+        if not (27 <= vr <= 34):
+            return False
+        if not (27 <= vs <= 34):
+            return False
 
-    w = inv(s, N)
     z = hash_to_int(msghash)
+    Q = decode_pubkey(pub)
+    key = _signature_cache_key(z, r, s, Q)
+    if _SIGNATURE_CACHE.get(key):
+        return True
 
+    w = inv(s, N)
     u1, u2 = z*w % N, r*w % N
-    x, y = fast_add(fast_multiply(G, u1), fast_multiply(decode_pubkey(pub), u2))
-    return bool(r == x and (r % N) and (s % N))
+    x, y = shamir_multiply(G, u1, Q, u2)
+    valid = bool(r == x and (r % N) and (s % N))
+    if valid:
+        _SIGNATURE_CACHE.put(key, True)
+    return valid
+
+
+def _lift_x(x, parity):
+    # Point with the given x coordinate and y parity, or None
+    if x >= P:
+        return None
+    xcubedaxb = (x*x*x+A*x+B) % P
+    y = pow(xcubedaxb, (P+1)//4, P)
+    if (y*y - xcubedaxb) % P:
+        return None
+    return (x, y if y % 2 == parity else P - y)
+
+
+def ecdsa_batch_verify(items):
+    # items are (msghash, vrs, pub) triples as taken by ecdsa_raw_verify,
+    # and the result is the list of what ecdsa_raw_verify returns for each.
+    # Signatures that carry a recovery id, i.e. (v, r, s), fix R and are
+    # checked together through one random linear combination
+    #   sum(a_i*u1_i) * G + sum(a_i*u2_i * Q_i) - sum(a_i * R_i) == 0
+    # which is bisected when it fails. (r, s) pairs and DER-decoded
+    # signatures say nothing about the parity of R, and trying both
+    # parities would double the combinations with every signature, so
+    # those are verified one at a time.
+    # Signatures found in the signature cache are not checked again.
+    results = [None] * len(items)
+    batch = []
+    for i, (msghash, vrs, pub) in enumerate(items):
+        if len(vrs) != 3:
+            results[i] = ecdsa_raw_verify(msghash, vrs, pub)
+            continue
+        v, r, s = vrs
+        R = _lift_x(r, (v - 27) & 1) if 27 <= v <= 34 and r % N and s % N else None
+        if R is None:
+            results[i] = False
+            continue
+        z, Q = hash_to_int(msghash), decode_pubkey(pub)
+        key = _signature_cache_key(z, r, s, Q)
+        if _SIGNATURE_CACHE.get(key):
+            results[i] = True
+            continue
+        w = inv(s, N)
+        batch.append((i, z * w % N, r * w % N, to_jacobian(Q), to_jacobian(R), key))
+
+    def check(entries):
+        if len(entries) == 1:
+            i = entries[0][0]
+            results[i] = ecdsa_raw_verify(*items[i])
+            return
+        points, scalars, g = [(Gx, Gy, 1)], [0], 0
+        for i, u1, u2, Q, R, key in entries:
+            a = decode(os.urandom(16), 256) | 1
+            g += a * u1
+            points.extend([Q, R])
+            scalars.extend([a * u2, N - a])
+        scalars[0] = g
+        if not jacobian_multi_scalar_multiply(points, scalars)[1]:
+            for entry in entries:
+                results[entry[0]] = True
+                _SIGNATURE_CACHE.put(entry[5], True)
+        else:
+            check(entries[:len(entries) // 2])
+            check(entries[len(entries) // 2:])
+
+    if batch:
+        check(batch)
+    return results
 
 
 # For BitcoinCore, (msg = addr or msg = "") be default
@@ -575,11 +1256,9 @@ def ecdsa_raw_recover(msghash, vrs):
     if (xcubedaxb - y*y) % P != 0 or not (r % N) or not (s % N):
         return False
     z = hash_to_int(msghash)
-    Gz = jacobian_multiply((Gx, Gy, 1), (N - z) % N)
-    XY = jacobian_multiply((x, y, 1), s)
-    Qr = jacobian_add(Gz, XY)
-    Q = jacobian_multiply(Qr, inv(r, N))
-    Q = from_jacobian(Q)
+    rinv = inv(r, N)
+    # Q = r^-1 * (s * R - z * G)
+    Q = shamir_multiply((x, y), s * rinv, G, (N - z) * rinv)
 
     # if ecdsa_raw_verify(msghash, vrs, Q):
     return Q
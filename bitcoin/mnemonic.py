@@ -2,15 +2,35 @@ import hashlib
 import os.path
 import binascii
 import random
+import sys
 from bisect import bisect_left
 
-wordlist_english=list(open(os.path.join(os.path.dirname(os.path.realpath(__file__)),'english.txt'),'r'))
+_wordlist_english=None
+
+def _english_wordlist():
+	global _wordlist_english
+	if(_wordlist_english is None):
+		with open(os.path.join(os.path.dirname(os.path.realpath(__file__)),'english.txt'),'r') as f:
+			_wordlist_english=list(f)
+	return _wordlist_english
+
+# wordlist_english is read on first use through the module __getattr__
+# (PEP 562); Pythons without it read the file at import
+if(sys.version_info < (3,7)):
+	wordlist_english=_english_wordlist()
+else:
+	def __getattr__(name):
+		if(name == 'wordlist_english'):
+			return _english_wordlist()
+		raise AttributeError("module %r has no attribute %r" % (__name__,name))
 
 def eint_to_bytes(entint,entbits):
 	a=hex(entint)[2:].rstrip('L').zfill(32)
 	return binascii.unhexlify(a)
 
-def mnemonic_int_to_words(mint,mint_num_words,wordlist=wordlist_english):
+def mnemonic_int_to_words(mint,mint_num_words,wordlist=None):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	backwords=[wordlist[(mint >> (11*x)) & 0x7FF].strip() for x in range(mint_num_words)]	
 	return backwords[::-1]
 	
@@ -21,7 +41,9 @@ def entropy_cs(entbytes):
 	csint=int(hd,16) >> (256-checksum_size)
 	return csint,checksum_size
 	
-def entropy_to_words(entbytes,wordlist=wordlist_english):
+def entropy_to_words(entbytes,wordlist=None):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	if(len(entbytes) < 4 or len(entbytes) % 4 != 0):
 		raise ValueError("The size of the entropy must be a multiple of 4 bytes (multiple of 32 bits)")
 	entropy_size=8*len(entbytes)
@@ -32,13 +54,17 @@ def entropy_to_words(entbytes,wordlist=wordlist_english):
 	
 	return mnemonic_int_to_words(mint,mint_num_words,wordlist)
 
-def words_bisect(word,wordlist=wordlist_english):
+def words_bisect(word,wordlist=None):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	lo=bisect_left(wordlist,word)
 	hi=len(wordlist)-bisect_left(wordlist[:lo:-1],word)
 	
 	return lo,hi
 
-def words_split(wordstr,wordlist=wordlist_english):
+def words_split(wordstr,wordlist=None):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	def popword(wordstr,wordlist):
 		for fwl in range(1,9):
 			w=wordstr[:fwl].strip()
@@ -55,12 +81,16 @@ def words_split(wordstr,wordlist=wordlist_english):
 		words.append(head)
 	return words
 
-def words_to_mnemonic_int(words,wordlist=wordlist_english):
+def words_to_mnemonic_int(words,wordlist=None):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	if(instance(words,str)):
 		words=words_split(words,wordlist)
 	return sum([wordlist.index(w) << (11*x) for x,w in enumerate(words[::-1])])
 
-def words_verify(words,wordlist=wordlist_english):
+def words_verify(words,wordlist=None):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	if(isinstance(words,str)):
 		words=words_split(words,wordlist)
 	
@@ -97,7 +127,9 @@ def mnemonic_to_seed(mnemonic_phrase,passphrase=u''):
 
 	return pbkdf2_hmac_sha256(password=mnemonic_phrase,salt='mnemonic'+passphrase)
 
-def words_mine(prefix,entbits,satisfunction,wordlist=wordlist_english,randombits=random.getrandbits):
+def words_mine(prefix,entbits,satisfunction,wordlist=None,randombits=random.getrandbits):
+	if(wordlist is None):
+		wordlist=_english_wordlist()
 	prefix_bits=len(prefix)*11
 	mine_bits=entbits-prefix_bits
 	pint=words_to_mnemonic_int(prefix,wordlist)
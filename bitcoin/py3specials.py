@@ -3,6 +3,7 @@ import os
 import re
 import binascii
 import hashlib
+import math
 
 
 if sys.version_info.major == 3:
@@ -55,7 +56,7 @@ if sys.version_info.major == 3:
         if isinstance(b, str):
             return b
 
-        return ''.join('{:02x}'.format(y) for y in b)
+        return bytes(b).hex()
 
     def safe_from_hex(s):
         return bytes.fromhex(s)
@@ -75,47 +76,138 @@ if sys.version_info.major == 3:
     def safe_hexlify(a):
         return str(binascii.hexlify(a), 'utf-8')
 
+    # Codec layer. Bases 2, 10, 16 and 256 map onto the native integer
+    # formatters and int.to_bytes/int.from_bytes (base 10 only below the
+    # interpreter's int/str conversion limit). Bases 32 and 58 are
+    # converted in chunks of digits that fit in a machine word; values
+    # longer than _SPLIT_DIGITS digits are split in half first, so the
+    # work stays in a few balanced big-integer divisions
+
+    _SPLIT_DIGITS = 512
+    _NATIVE_DECIMAL_BITS = 13000
+    _powers = {}
+    _chunk_sizes = {}
+    # Strings int() may be given: nothing but digits of the base, as int()
+    # also takes a 0x prefix, underscores, whitespace and a sign
+    _native_digits = {2: '[01]*', 10: '[0-9]*', 16: '[0-9a-fA-F]*'}
+    _native_digits = {base: (re.compile(p), re.compile(p.encode()))
+                      for base, p in _native_digits.items()}
+    _digit_pairs = {}
+    _digit_values = {}
+
+    def _power(base, exp):
+        try:
+            return _powers[base, exp]
+        except KeyError:
+            result = _powers[base, exp] = base ** exp
+            return result
+
+    def _chunk_size(base):
+        # Largest even number of digits whose value fits in 63 bits
+        if base not in _chunk_sizes:
+            k = 2
+            while base ** (k + 2) < 2 ** 63:
+                k += 2
+            _chunk_sizes[base] = k
+        return _chunk_sizes[base]
+
+    def _pairs(base):
+        # Two-digit strings for every value below base ** 2
+        if base not in _digit_pairs:
+            cs = get_code_string(base)
+            _digit_pairs[base] = [a + b for a in cs for b in cs]
+        return _digit_pairs[base]
+
+    def _values(base):
+        # Digit value of every character, keyed on both the str character
+        # and its code point so bytes input needs no conversion
+        if base not in _digit_values:
+            table = {}
+            for i, c in enumerate(get_code_string(base)):
+                table[c] = table[ord(c)] = i
+            _digit_values[base] = table
+        return _digit_values[base]
+
+    def _encode_digits(val, base):
+        # Digits of val > 0, most significant first, without padding
+        ndigits = int(val.bit_length() / math.log(base, 2)) + 1
+        if ndigits > _SPLIT_DIGITS:
+            half = ndigits // 2
+            hi, lo = divmod(val, _power(base, half))
+            lo = _encode_digits(lo, base) if lo else ''
+            lo = lo.rjust(half, get_code_string(base)[0])
+            return (_encode_digits(hi, base) if hi else '') + lo
+        k = _chunk_size(base)
+        chunk, square, pairs = _power(base, k), base * base, _pairs(base)
+        out = []
+        while val:
+            val, c = divmod(val, chunk)
+            for i in range(k // 2):
+                c, d = divmod(c, square)
+                out.append(pairs[d])
+        return ''.join(reversed(out)).lstrip(get_code_string(base)[0])
+
+    def _decode_digits(string, base):
+        n = len(string)
+        if n > _SPLIT_DIGITS:
+            half = n // 2
+            return _decode_digits(string[:-half], base) * _power(base, half) + \
+                _decode_digits(string[-half:], base)
+        table = _values(base)
+        k = _chunk_size(base)
+        chunk = _power(base, k)
+        result = 0
+        try:
+            for i in range(0, n - n % k, k):
+                c = 0
+                for d in string[i:i + k]:
+                    c = c * base + table[d]
+                result = result * chunk + c
+            rest = n % k
+            if rest:
+                c = 0
+                for d in string[n - rest:]:
+                    c = c * base + table[d]
+                result = result * _power(base, rest) + c
+        except KeyError:
+            raise ValueError("Invalid character for base %d" % base)
+        return result
+
     def encode(val, base, minlen=0):
         base, minlen = int(base), int(minlen)
-        code_string = get_code_string(base)
-        result_bytes = bytes()
-        while val > 0:
-            curcode = code_string[val % base]
-            result_bytes = bytes([ord(curcode)]) + result_bytes
-            val //= base
-
-        pad_size = minlen - len(result_bytes)
-
-        padding_element = b'\x00' if base == 256 else b'1' \
-            if base == 58 else b'0'
-        if (pad_size > 0):
-            result_bytes = padding_element*pad_size + result_bytes
-
-        result_string = ''.join([chr(y) for y in result_bytes])
-        result = result_bytes if base == 256 else result_string
-
-        return result
+        get_code_string(base)
+        if base == 256:
+            if val > 0:
+                result = val.to_bytes((val.bit_length() + 7) // 8, 'big')
+            else:
+                result = b''
+            return result.rjust(minlen, b'\x00')
+        if val <= 0:
+            result = ''
+        elif base == 16:
+            result = '%x' % val
+        elif base == 10 and val.bit_length() < _NATIVE_DECIMAL_BITS:
+            result = '%d' % val
+        elif base == 2:
+            result = format(val, 'b')
+        else:
+            result = _encode_digits(val, base)
+        return result.rjust(minlen, '1' if base == 58 else '0')
 
     def decode(string, base):
         if base == 256 and isinstance(string, str):
-            string = bytes(bytearray.fromhex(string))
+            string = bytes.fromhex(string)
         base = int(base)
-        code_string = get_code_string(base)
-        result = 0
+        get_code_string(base)
         if base == 256:
-            def extract(d, cs):
-                return d
-        else:
-            def extract(d, cs):
-                return cs.find(d if isinstance(d, str) else chr(d))
-
-        if base == 16:
-            string = string.lower()
-        while len(string) > 0:
-            result *= base
-            result += extract(string[0], code_string)
-            string = string[1:]
-        return result
+            return int.from_bytes(string, 'big')
+        if not string:
+            return 0
+        if base in (2, 16) or (base == 10 and len(string) < 4000):
+            if not _native_digits[base][not isinstance(string, str)].fullmatch(string):
+                raise ValueError("Invalid character for base %d" % base)
+            return int(string, base)
+        return _decode_digits(string, base)
 
     def random_string(x):
         return str(os.urandom(x))
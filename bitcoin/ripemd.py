@@ -1,414 +1,641 @@
-## ripemd.py - pure Python implementation of the RIPEMD-160 algorithm.
-## Bjorn Edstrom <be@bjrn.se> 16 december 2007.
-##
-## Copyrights
-## ==========
-##
-## This code is a derived from an implementation by Markus Friedl which is
-## subject to the following license. This Python implementation is not
-## subject to any other license.
-##
-##/*
-## * Copyright (c) 2001 Markus Friedl.  All rights reserved.
-## *
-## * Redistribution and use in source and binary forms, with or without
-## * modification, are permitted provided that the following conditions
-## * are met:
-## * 1. Redistributions of source code must retain the above copyright
-## *    notice, this list of conditions and the following disclaimer.
-## * 2. Redistributions in binary form must reproduce the above copyright
-## *    notice, this list of conditions and the following disclaimer in the
-## *    documentation and/or other materials provided with the distribution.
-## *
-## * THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
-## * IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
-## * OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
-## * IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
-## * INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
-## * NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
-## * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
-## * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
-## * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
-## * THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
-## */
-##/*
-## * Preneel, Bosselaers, Dobbertin, "The Cryptographic Hash Function RIPEMD-160",
-## * RSA Laboratories, CryptoBytes, Volume 3, Number 2, Autumn 1997,
-## * ftp://ftp.rsasecurity.com/pub/cryptobytes/crypto3n2.pdf
-## */
-
-try:
-    import psyco
-    psyco.full()
-except ImportError:
-    pass
-
-import sys
-
-is_python2 = sys.version_info.major == 2
-#block_size = 1
-digest_size = 20
-digestsize = 20
-
-try:
-    range = xrange
-except:
-    pass
-
-class RIPEMD160:
-    """Return a new RIPEMD160 object. An optional string argument
-    may be provided; if present, this string will be automatically
-    hashed."""
-    
-    def __init__(self, arg=None):
-        self.ctx = RMDContext()
-        if arg:
-            self.update(arg)
-        self.dig = None
-        
-    def update(self, arg):
-        """update(arg)"""        
-        RMD160Update(self.ctx, arg, len(arg))
-        self.dig = None
-        
-    def digest(self):
-        """digest()"""        
-        if self.dig:
-            return self.dig
-        ctx = self.ctx.copy()
-        self.dig = RMD160Final(self.ctx)
-        self.ctx = ctx
-        return self.dig
-    
-    def hexdigest(self):
-        """hexdigest()"""
-        dig = self.digest()
-        hex_digest = ''
-        for d in dig:
-            if (is_python2):
-                hex_digest += '%02x' % ord(d)
-            else:
-                hex_digest += '%02x' % d
-        return hex_digest
-    
-    def copy(self):
-        """copy()"""        
-        import copy
-        return copy.deepcopy(self)
-
-
-
-def new(arg=None):
-    """Return a new RIPEMD160 object. An optional string argument
-    may be provided; if present, this string will be automatically
-    hashed."""    
-    return RIPEMD160(arg)
-
-
-
-#
-# Private.
-#
-
-class RMDContext:
-    def __init__(self):
-        self.state = [0x67452301, 0xEFCDAB89, 0x98BADCFE,
-                      0x10325476, 0xC3D2E1F0] # uint32
-        self.count = 0 # uint64
-        self.buffer = [0]*64 # uchar
-    def copy(self):
-        ctx = RMDContext()
-        ctx.state = self.state[:]
-        ctx.count = self.count
-        ctx.buffer = self.buffer[:]
-        return ctx
-
-K0 = 0x00000000
-K1 = 0x5A827999
-K2 = 0x6ED9EBA1
-K3 = 0x8F1BBCDC
-K4 = 0xA953FD4E
-
-KK0 = 0x50A28BE6
-KK1 = 0x5C4DD124
-KK2 = 0x6D703EF3
-KK3 = 0x7A6D76E9
-KK4 = 0x00000000
-
-def ROL(n, x):
-    return ((x << n) & 0xffffffff) | (x >> (32 - n))
-
-def F0(x, y, z):
-    return x ^ y ^ z
-
-def F1(x, y, z):
-    return (x & y) | (((~x) % 0x100000000) & z)
-
-def F2(x, y, z):
-    return (x | ((~y) % 0x100000000)) ^ z
-
-def F3(x, y, z):
-    return (x & z) | (((~z) % 0x100000000) & y)
-
-def F4(x, y, z):
-    return x ^ (y | ((~z) % 0x100000000))
-
-def R(a, b, c, d, e, Fj, Kj, sj, rj, X):
-    a = ROL(sj, (a + Fj(b, c, d) + X[rj] + Kj) % 0x100000000) + e
-    c = ROL(10, c)
-    return a % 0x100000000, c
-
-PADDING = [0x80] + [0]*63
-
-import sys
-import struct
-
-def RMD160Transform(state, block): #uint32 state[5], uchar block[64]
-    x = [0]*16
-    if sys.byteorder == 'little':
-        if is_python2:
-            x = struct.unpack('<16L', ''.join([chr(x) for x in block[0:64]]))
-        else:
-            x = struct.unpack('<16L', bytes(block[0:64]))
-    else:
-        raise "Error!!"
-    a = state[0]
-    b = state[1]
-    c = state[2]
-    d = state[3]
-    e = state[4]
-
-    #/* Round 1 */
-    a, c = R(a, b, c, d, e, F0, K0, 11,  0, x);
-    e, b = R(e, a, b, c, d, F0, K0, 14,  1, x);
-    d, a = R(d, e, a, b, c, F0, K0, 15,  2, x);
-    c, e = R(c, d, e, a, b, F0, K0, 12,  3, x);
-    b, d = R(b, c, d, e, a, F0, K0,  5,  4, x);
-    a, c = R(a, b, c, d, e, F0, K0,  8,  5, x);
-    e, b = R(e, a, b, c, d, F0, K0,  7,  6, x);
-    d, a = R(d, e, a, b, c, F0, K0,  9,  7, x);
-    c, e = R(c, d, e, a, b, F0, K0, 11,  8, x);
-    b, d = R(b, c, d, e, a, F0, K0, 13,  9, x);
-    a, c = R(a, b, c, d, e, F0, K0, 14, 10, x);
-    e, b = R(e, a, b, c, d, F0, K0, 15, 11, x);
-    d, a = R(d, e, a, b, c, F0, K0,  6, 12, x);
-    c, e = R(c, d, e, a, b, F0, K0,  7, 13, x);
-    b, d = R(b, c, d, e, a, F0, K0,  9, 14, x);
-    a, c = R(a, b, c, d, e, F0, K0,  8, 15, x); #/* #15 */
-    #/* Round 2 */
-    e, b = R(e, a, b, c, d, F1, K1,  7,  7, x);
-    d, a = R(d, e, a, b, c, F1, K1,  6,  4, x);
-    c, e = R(c, d, e, a, b, F1, K1,  8, 13, x);
-    b, d = R(b, c, d, e, a, F1, K1, 13,  1, x);
-    a, c = R(a, b, c, d, e, F1, K1, 11, 10, x);
-    e, b = R(e, a, b, c, d, F1, K1,  9,  6, x);
-    d, a = R(d, e, a, b, c, F1, K1,  7, 15, x);
-    c, e = R(c, d, e, a, b, F1, K1, 15,  3, x);
-    b, d = R(b, c, d, e, a, F1, K1,  7, 12, x);
-    a, c = R(a, b, c, d, e, F1, K1, 12,  0, x);
-    e, b = R(e, a, b, c, d, F1, K1, 15,  9, x);
-    d, a = R(d, e, a, b, c, F1, K1,  9,  5, x);
-    c, e = R(c, d, e, a, b, F1, K1, 11,  2, x);
-    b, d = R(b, c, d, e, a, F1, K1,  7, 14, x);
-    a, c = R(a, b, c, d, e, F1, K1, 13, 11, x);
-    e, b = R(e, a, b, c, d, F1, K1, 12,  8, x); #/* #31 */
-    #/* Round 3 */
-    d, a = R(d, e, a, b, c, F2, K2, 11,  3, x);
-    c, e = R(c, d, e, a, b, F2, K2, 13, 10, x);
-    b, d = R(b, c, d, e, a, F2, K2,  6, 14, x);
-    a, c = R(a, b, c, d, e, F2, K2,  7,  4, x);
-    e, b = R(e, a, b, c, d, F2, K2, 14,  9, x);
-    d, a = R(d, e, a, b, c, F2, K2,  9, 15, x);
-    c, e = R(c, d, e, a, b, F2, K2, 13,  8, x);
-    b, d = R(b, c, d, e, a, F2, K2, 15,  1, x);
-    a, c = R(a, b, c, d, e, F2, K2, 14,  2, x);
-    e, b = R(e, a, b, c, d, F2, K2,  8,  7, x);
-    d, a = R(d, e, a, b, c, F2, K2, 13,  0, x);
-    c, e = R(c, d, e, a, b, F2, K2,  6,  6, x);
-    b, d = R(b, c, d, e, a, F2, K2,  5, 13, x);
-    a, c = R(a, b, c, d, e, F2, K2, 12, 11, x);
-    e, b = R(e, a, b, c, d, F2, K2,  7,  5, x);
-    d, a = R(d, e, a, b, c, F2, K2,  5, 12, x); #/* #47 */
-    #/* Round 4 */
-    c, e = R(c, d, e, a, b, F3, K3, 11,  1, x);
-    b, d = R(b, c, d, e, a, F3, K3, 12,  9, x);
-    a, c = R(a, b, c, d, e, F3, K3, 14, 11, x);
-    e, b = R(e, a, b, c, d, F3, K3, 15, 10, x);
-    d, a = R(d, e, a, b, c, F3, K3, 14,  0, x);
-    c, e = R(c, d, e, a, b, F3, K3, 15,  8, x);
-    b, d = R(b, c, d, e, a, F3, K3,  9, 12, x);
-    a, c = R(a, b, c, d, e, F3, K3,  8,  4, x);
-    e, b = R(e, a, b, c, d, F3, K3,  9, 13, x);
-    d, a = R(d, e, a, b, c, F3, K3, 14,  3, x);
-    c, e = R(c, d, e, a, b, F3, K3,  5,  7, x);
-    b, d = R(b, c, d, e, a, F3, K3,  6, 15, x);
-    a, c = R(a, b, c, d, e, F3, K3,  8, 14, x);
-    e, b = R(e, a, b, c, d, F3, K3,  6,  5, x);
-    d, a = R(d, e, a, b, c, F3, K3,  5,  6, x);
-    c, e = R(c, d, e, a, b, F3, K3, 12,  2, x); #/* #63 */
-    #/* Round 5 */
-    b, d = R(b, c, d, e, a, F4, K4,  9,  4, x);
-    a, c = R(a, b, c, d, e, F4, K4, 15,  0, x);
-    e, b = R(e, a, b, c, d, F4, K4,  5,  5, x);
-    d, a = R(d, e, a, b, c, F4, K4, 11,  9, x);
-    c, e = R(c, d, e, a, b, F4, K4,  6,  7, x);
-    b, d = R(b, c, d, e, a, F4, K4,  8, 12, x);
-    a, c = R(a, b, c, d, e, F4, K4, 13,  2, x);
-    e, b = R(e, a, b, c, d, F4, K4, 12, 10, x);
-    d, a = R(d, e, a, b, c, F4, K4,  5, 14, x);
-    c, e = R(c, d, e, a, b, F4, K4, 12,  1, x);
-    b, d = R(b, c, d, e, a, F4, K4, 13,  3, x);
-    a, c = R(a, b, c, d, e, F4, K4, 14,  8, x);
-    e, b = R(e, a, b, c, d, F4, K4, 11, 11, x);
-    d, a = R(d, e, a, b, c, F4, K4,  8,  6, x);
-    c, e = R(c, d, e, a, b, F4, K4,  5, 15, x);
-    b, d = R(b, c, d, e, a, F4, K4,  6, 13, x); #/* #79 */
-
-    aa = a;
-    bb = b;
-    cc = c;
-    dd = d;
-    ee = e;
-
-    a = state[0]
-    b = state[1]
-    c = state[2]
-    d = state[3]
-    e = state[4]    
-
-    #/* Parallel round 1 */
-    a, c = R(a, b, c, d, e, F4, KK0,  8,  5, x)
-    e, b = R(e, a, b, c, d, F4, KK0,  9, 14, x)
-    d, a = R(d, e, a, b, c, F4, KK0,  9,  7, x)
-    c, e = R(c, d, e, a, b, F4, KK0, 11,  0, x)
-    b, d = R(b, c, d, e, a, F4, KK0, 13,  9, x)
-    a, c = R(a, b, c, d, e, F4, KK0, 15,  2, x)
-    e, b = R(e, a, b, c, d, F4, KK0, 15, 11, x)
-    d, a = R(d, e, a, b, c, F4, KK0,  5,  4, x)
-    c, e = R(c, d, e, a, b, F4, KK0,  7, 13, x)
-    b, d = R(b, c, d, e, a, F4, KK0,  7,  6, x)
-    a, c = R(a, b, c, d, e, F4, KK0,  8, 15, x)
-    e, b = R(e, a, b, c, d, F4, KK0, 11,  8, x)
-    d, a = R(d, e, a, b, c, F4, KK0, 14,  1, x)
-    c, e = R(c, d, e, a, b, F4, KK0, 14, 10, x)
-    b, d = R(b, c, d, e, a, F4, KK0, 12,  3, x)
-    a, c = R(a, b, c, d, e, F4, KK0,  6, 12, x) #/* #15 */
-    #/* Parallel round 2 */
-    e, b = R(e, a, b, c, d, F3, KK1,  9,  6, x)
-    d, a = R(d, e, a, b, c, F3, KK1, 13, 11, x)
-    c, e = R(c, d, e, a, b, F3, KK1, 15,  3, x)
-    b, d = R(b, c, d, e, a, F3, KK1,  7,  7, x)
-    a, c = R(a, b, c, d, e, F3, KK1, 12,  0, x)
-    e, b = R(e, a, b, c, d, F3, KK1,  8, 13, x)
-    d, a = R(d, e, a, b, c, F3, KK1,  9,  5, x)
-    c, e = R(c, d, e, a, b, F3, KK1, 11, 10, x)
-    b, d = R(b, c, d, e, a, F3, KK1,  7, 14, x)
-    a, c = R(a, b, c, d, e, F3, KK1,  7, 15, x)
-    e, b = R(e, a, b, c, d, F3, KK1, 12,  8, x)
-    d, a = R(d, e, a, b, c, F3, KK1,  7, 12, x)
-    c, e = R(c, d, e, a, b, F3, KK1,  6,  4, x)
-    b, d = R(b, c, d, e, a, F3, KK1, 15,  9, x)
-    a, c = R(a, b, c, d, e, F3, KK1, 13,  1, x)
-    e, b = R(e, a, b, c, d, F3, KK1, 11,  2, x) #/* #31 */
-    #/* Parallel round 3 */
-    d, a = R(d, e, a, b, c, F2, KK2,  9, 15, x)
-    c, e = R(c, d, e, a, b, F2, KK2,  7,  5, x)
-    b, d = R(b, c, d, e, a, F2, KK2, 15,  1, x)
-    a, c = R(a, b, c, d, e, F2, KK2, 11,  3, x)
-    e, b = R(e, a, b, c, d, F2, KK2,  8,  7, x)
-    d, a = R(d, e, a, b, c, F2, KK2,  6, 14, x)
-    c, e = R(c, d, e, a, b, F2, KK2,  6,  6, x)
-    b, d = R(b, c, d, e, a, F2, KK2, 14,  9, x)
-    a, c = R(a, b, c, d, e, F2, KK2, 12, 11, x)
-    e, b = R(e, a, b, c, d, F2, KK2, 13,  8, x)
-    d, a = R(d, e, a, b, c, F2, KK2,  5, 12, x)
-    c, e = R(c, d, e, a, b, F2, KK2, 14,  2, x)
-    b, d = R(b, c, d, e, a, F2, KK2, 13, 10, x)
-    a, c = R(a, b, c, d, e, F2, KK2, 13,  0, x)
-    e, b = R(e, a, b, c, d, F2, KK2,  7,  4, x)
-    d, a = R(d, e, a, b, c, F2, KK2,  5, 13, x) #/* #47 */
-    #/* Parallel round 4 */
-    c, e = R(c, d, e, a, b, F1, KK3, 15,  8, x)
-    b, d = R(b, c, d, e, a, F1, KK3,  5,  6, x)
-    a, c = R(a, b, c, d, e, F1, KK3,  8,  4, x)
-    e, b = R(e, a, b, c, d, F1, KK3, 11,  1, x)
-    d, a = R(d, e, a, b, c, F1, KK3, 14,  3, x)
-    c, e = R(c, d, e, a, b, F1, KK3, 14, 11, x)
-    b, d = R(b, c, d, e, a, F1, KK3,  6, 15, x)
-    a, c = R(a, b, c, d, e, F1, KK3, 14,  0, x)
-    e, b = R(e, a, b, c, d, F1, KK3,  6,  5, x)
-    d, a = R(d, e, a, b, c, F1, KK3,  9, 12, x)
-    c, e = R(c, d, e, a, b, F1, KK3, 12,  2, x)
-    b, d = R(b, c, d, e, a, F1, KK3,  9, 13, x)
-    a, c = R(a, b, c, d, e, F1, KK3, 12,  9, x)
-    e, b = R(e, a, b, c, d, F1, KK3,  5,  7, x)
-    d, a = R(d, e, a, b, c, F1, KK3, 15, 10, x)
-    c, e = R(c, d, e, a, b, F1, KK3,  8, 14, x) #/* #63 */
-    #/* Parallel round 5 */
-    b, d = R(b, c, d, e, a, F0, KK4,  8, 12, x)
-    a, c = R(a, b, c, d, e, F0, KK4,  5, 15, x)
-    e, b = R(e, a, b, c, d, F0, KK4, 12, 10, x)
-    d, a = R(d, e, a, b, c, F0, KK4,  9,  4, x)
-    c, e = R(c, d, e, a, b, F0, KK4, 12,  1, x)
-    b, d = R(b, c, d, e, a, F0, KK4,  5,  5, x)
-    a, c = R(a, b, c, d, e, F0, KK4, 14,  8, x)
-    e, b = R(e, a, b, c, d, F0, KK4,  6,  7, x)
-    d, a = R(d, e, a, b, c, F0, KK4,  8,  6, x)
-    c, e = R(c, d, e, a, b, F0, KK4, 13,  2, x)
-    b, d = R(b, c, d, e, a, F0, KK4,  6, 13, x)
-    a, c = R(a, b, c, d, e, F0, KK4,  5, 14, x)
-    e, b = R(e, a, b, c, d, F0, KK4, 15,  0, x)
-    d, a = R(d, e, a, b, c, F0, KK4, 13,  3, x)
-    c, e = R(c, d, e, a, b, F0, KK4, 11,  9, x)
-    b, d = R(b, c, d, e, a, F0, KK4, 11, 11, x) #/* #79 */
-
-    t = (state[1] + cc + d) % 0x100000000;
-    state[1] = (state[2] + dd + e) % 0x100000000;
-    state[2] = (state[3] + ee + a) % 0x100000000;
-    state[3] = (state[4] + aa + b) % 0x100000000;
-    state[4] = (state[0] + bb + c) % 0x100000000;
-    state[0] = t % 0x100000000;
-
-    pass
-
-
-def RMD160Update(ctx, inp, inplen):
-    if isinstance(inp, str):
-        inp = [ord(i)&0xff for i in inp]
-    
-    have = int((ctx.count // 8) % 64)
-    inplen = int(inplen)
-    need = 64 - have
-    ctx.count += 8 * inplen
-    off = 0
-    if inplen >= need:
-        if have:
-            for i in range(need):
-                ctx.buffer[have+i] = inp[i]
-            RMD160Transform(ctx.state, ctx.buffer)
-            off = need
-            have = 0
-        while off + 64 <= inplen:
-            RMD160Transform(ctx.state, inp[off:]) #<---
-            off += 64
-    if off < inplen:
-        # memcpy(ctx->buffer + have, input+off, len-off);
-        for i in range(inplen - off):
-            ctx.buffer[have+i] = inp[off+i]
-
-def RMD160Final(ctx):
-    size = struct.pack("<Q", ctx.count)
-    padlen = 64 - ((ctx.count // 8) % 64)
-    if padlen < 1+8:
-        padlen += 64
-    RMD160Update(ctx, PADDING, padlen-8)
-    RMD160Update(ctx, size, 8)
-    return struct.pack("<5L", *ctx.state)
-
-
-assert '37f332f68db77bd9d7edd4969571ad671cf9dd3b' == \
-       new('The quick brown fox jumps over the lazy dog').hexdigest()
-assert '132072df690933835eb8b6ad0b77e7b6f14acad7' == \
-       new('The quick brown fox jumps over the lazy cog').hexdigest()
-assert '9c1185a5c5e9fc54612808977ee8f548b2258d31' == \
-       new('').hexdigest()
+## ripemd.py - pure Python implementation of the RIPEMD-160 algorithm.
+## Bjorn Edstrom <be@bjrn.se> 16 december 2007.
+##
+## Copyrights
+## ==========
+##
+## This code is a derived from an implementation by Markus Friedl which is
+## subject to the following license. This Python implementation is not
+## subject to any other license.
+##
+##/*
+## * Copyright (c) 2001 Markus Friedl.  All rights reserved.
+## *
+## * Redistribution and use in source and binary forms, with or without
+## * modification, are permitted provided that the following conditions
+## * are met:
+## * 1. Redistributions of source code must retain the above copyright
+## *    notice, this list of conditions and the following disclaimer.
+## * 2. Redistributions in binary form must reproduce the above copyright
+## *    notice, this list of conditions and the following disclaimer in the
+## *    documentation and/or other materials provided with the distribution.
+## *
+## * THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+## * IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES
+## * OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+## * IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY DIRECT, INDIRECT,
+## * INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+## * NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## * DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## * THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## * (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+## * THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+## */
+##/*
+## * Preneel, Bosselaers, Dobbertin, "The Cryptographic Hash Function RIPEMD-160",
+## * RSA Laboratories, CryptoBytes, Volume 3, Number 2, Autumn 1997,
+## * ftp://ftp.rsasecurity.com/pub/cryptobytes/crypto3n2.pdf
+## */
+
+import struct
+import sys
+
+is_python2 = sys.version_info.major == 2
+#block_size = 1
+digest_size = 20
+digestsize = 20
+
+try:
+    range = xrange
+except:
+    pass
+
+
+class RIPEMD160:
+    """Return a new RIPEMD160 object. An optional string argument
+    may be provided; if present, this string will be automatically
+    hashed."""
+
+    def __init__(self, arg=None):
+        self.state = _IV
+        self.count = 0
+        self.buffer = b''
+        if arg:
+            self.update(arg)
+
+    def update(self, arg):
+        """update(arg)"""
+        data = self.buffer + _to_bytes(arg)
+        self.count += len(data) - len(self.buffer)
+        end = len(data) - len(data) % 64
+        state = self.state
+        for off in range(0, end, 64):
+            state = _compress(state, struct.unpack_from('<16L', data, off))
+        self.state = state
+        self.buffer = data[end:]
+
+    def digest(self):
+        """digest()"""
+        padding = b'\x80' + b'\x00' * ((55 - self.count) % 64) + \
+            struct.pack('<Q', (8 * self.count) % 2**64)
+        data = self.buffer + padding
+        state = self.state
+        for off in range(0, len(data), 64):
+            state = _compress(state, struct.unpack_from('<16L', data, off))
+        return struct.pack('<5L', *state)
+
+    def hexdigest(self):
+        """hexdigest()"""
+        return ''.join(['%02x' % d for d in bytearray(self.digest())])
+
+    def copy(self):
+        """copy()"""
+        other = RIPEMD160()
+        other.state, other.count, other.buffer = self.state, self.count, self.buffer
+        return other
+
+
+def new(arg=None):
+    """Return a new RIPEMD160 object. An optional string argument
+    may be provided; if present, this string will be automatically
+    hashed."""
+    return RIPEMD160(arg)
+
+
+def rmd160(data):
+    """Return the RIPEMD-160 digest of data in one call. 32-byte inputs
+    (SHA-256 digests, as in hash160) fit a single block whose padding is
+    known in advance and skip the buffering entirely."""
+    if len(data) == 32 and isinstance(data, bytes):
+        return struct.pack('<5L', *_compress(_IV, struct.unpack('<8L', data) + _TAIL32))
+    return RIPEMD160(data).digest()
+
+
+#
+# Private.
+#
+
+_IV = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0)
+
+# Message words 8..15 of a padded 32-byte input: the 0x80 marker, zeros
+# and the bit length (256)
+_TAIL32 = (0x80, 0, 0, 0, 0, 0, 256, 0)
+
+
+def _to_bytes(arg):
+    # Text is hashed as the low byte of each character, like the original
+    # list-of-ints implementation did
+    if isinstance(arg, bytes):
+        return arg
+    if not is_python2 and isinstance(arg, str):
+        return bytes(bytearray([ord(c) & 0xff for c in arg]))
+    return bytes(arg)
+
+
+def _compress(state, x):
+    # One compression of the 16 little-endian words x into the 5-word
+    # state. Both lines are unrolled over local variables; the step order,
+    # shifts and message indices follow Preneel et al., Table 3/4
+    x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14, x15 = x
+    a, b, c, d, e = state
+    # Round 1
+    t = (a + (b ^ c ^ d) + x0) & 0xffffffff
+    a = ((t << 11 | t >> 21) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ b ^ c) + x1) & 0xffffffff
+    e = ((t << 14 | t >> 18) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ a ^ b) + x2) & 0xffffffff
+    d = ((t << 15 | t >> 17) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ e ^ a) + x3) & 0xffffffff
+    c = ((t << 12 | t >> 20) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ d ^ e) + x4) & 0xffffffff
+    b = ((t << 5 | t >> 27) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ c ^ d) + x5) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ b ^ c) + x6) & 0xffffffff
+    e = ((t << 7 | t >> 25) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ a ^ b) + x7) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ e ^ a) + x8) & 0xffffffff
+    c = ((t << 11 | t >> 21) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ d ^ e) + x9) & 0xffffffff
+    b = ((t << 13 | t >> 19) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ c ^ d) + x10) & 0xffffffff
+    a = ((t << 14 | t >> 18) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ b ^ c) + x11) & 0xffffffff
+    e = ((t << 15 | t >> 17) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ a ^ b) + x12) & 0xffffffff
+    d = ((t << 6 | t >> 26) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ e ^ a) + x13) & 0xffffffff
+    c = ((t << 7 | t >> 25) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ d ^ e) + x14) & 0xffffffff
+    b = ((t << 9 | t >> 23) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ c ^ d) + x15) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    # Round 2
+    t = (e + (c ^ (a & (b ^ c))) + x7 + 0x5a827999) & 0xffffffff
+    e = ((t << 7 | t >> 25) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (b ^ (e & (a ^ b))) + x4 + 0x5a827999) & 0xffffffff
+    d = ((t << 6 | t >> 26) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (a ^ (d & (e ^ a))) + x13 + 0x5a827999) & 0xffffffff
+    c = ((t << 8 | t >> 24) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (e ^ (c & (d ^ e))) + x1 + 0x5a827999) & 0xffffffff
+    b = ((t << 13 | t >> 19) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (d ^ (b & (c ^ d))) + x10 + 0x5a827999) & 0xffffffff
+    a = ((t << 11 | t >> 21) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (c ^ (a & (b ^ c))) + x6 + 0x5a827999) & 0xffffffff
+    e = ((t << 9 | t >> 23) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (b ^ (e & (a ^ b))) + x15 + 0x5a827999) & 0xffffffff
+    d = ((t << 7 | t >> 25) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (a ^ (d & (e ^ a))) + x3 + 0x5a827999) & 0xffffffff
+    c = ((t << 15 | t >> 17) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (e ^ (c & (d ^ e))) + x12 + 0x5a827999) & 0xffffffff
+    b = ((t << 7 | t >> 25) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (d ^ (b & (c ^ d))) + x0 + 0x5a827999) & 0xffffffff
+    a = ((t << 12 | t >> 20) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (c ^ (a & (b ^ c))) + x9 + 0x5a827999) & 0xffffffff
+    e = ((t << 15 | t >> 17) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (b ^ (e & (a ^ b))) + x5 + 0x5a827999) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (a ^ (d & (e ^ a))) + x2 + 0x5a827999) & 0xffffffff
+    c = ((t << 11 | t >> 21) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (e ^ (c & (d ^ e))) + x14 + 0x5a827999) & 0xffffffff
+    b = ((t << 7 | t >> 25) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (d ^ (b & (c ^ d))) + x11 + 0x5a827999) & 0xffffffff
+    a = ((t << 13 | t >> 19) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (c ^ (a & (b ^ c))) + x8 + 0x5a827999) & 0xffffffff
+    e = ((t << 12 | t >> 20) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    # Round 3
+    t = (d + ((e | ~a) ^ b) + x3 + 0x6ed9eba1) & 0xffffffff
+    d = ((t << 11 | t >> 21) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + ((d | ~e) ^ a) + x10 + 0x6ed9eba1) & 0xffffffff
+    c = ((t << 13 | t >> 19) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + ((c | ~d) ^ e) + x14 + 0x6ed9eba1) & 0xffffffff
+    b = ((t << 6 | t >> 26) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + ((b | ~c) ^ d) + x4 + 0x6ed9eba1) & 0xffffffff
+    a = ((t << 7 | t >> 25) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + ((a | ~b) ^ c) + x9 + 0x6ed9eba1) & 0xffffffff
+    e = ((t << 14 | t >> 18) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + ((e | ~a) ^ b) + x15 + 0x6ed9eba1) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + ((d | ~e) ^ a) + x8 + 0x6ed9eba1) & 0xffffffff
+    c = ((t << 13 | t >> 19) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + ((c | ~d) ^ e) + x1 + 0x6ed9eba1) & 0xffffffff
+    b = ((t << 15 | t >> 17) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + ((b | ~c) ^ d) + x2 + 0x6ed9eba1) & 0xffffffff
+    a = ((t << 14 | t >> 18) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + ((a | ~b) ^ c) + x7 + 0x6ed9eba1) & 0xffffffff
+    e = ((t << 8 | t >> 24) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + ((e | ~a) ^ b) + x0 + 0x6ed9eba1) & 0xffffffff
+    d = ((t << 13 | t >> 19) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + ((d | ~e) ^ a) + x6 + 0x6ed9eba1) & 0xffffffff
+    c = ((t << 6 | t >> 26) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + ((c | ~d) ^ e) + x13 + 0x6ed9eba1) & 0xffffffff
+    b = ((t << 5 | t >> 27) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + ((b | ~c) ^ d) + x11 + 0x6ed9eba1) & 0xffffffff
+    a = ((t << 12 | t >> 20) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + ((a | ~b) ^ c) + x5 + 0x6ed9eba1) & 0xffffffff
+    e = ((t << 7 | t >> 25) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + ((e | ~a) ^ b) + x12 + 0x6ed9eba1) & 0xffffffff
+    d = ((t << 5 | t >> 27) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    # Round 4
+    t = (c + (e ^ (a & (d ^ e))) + x1 + 0x8f1bbcdc) & 0xffffffff
+    c = ((t << 11 | t >> 21) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (d ^ (e & (c ^ d))) + x9 + 0x8f1bbcdc) & 0xffffffff
+    b = ((t << 12 | t >> 20) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (c ^ (d & (b ^ c))) + x11 + 0x8f1bbcdc) & 0xffffffff
+    a = ((t << 14 | t >> 18) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (b ^ (c & (a ^ b))) + x10 + 0x8f1bbcdc) & 0xffffffff
+    e = ((t << 15 | t >> 17) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (a ^ (b & (e ^ a))) + x0 + 0x8f1bbcdc) & 0xffffffff
+    d = ((t << 14 | t >> 18) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (e ^ (a & (d ^ e))) + x8 + 0x8f1bbcdc) & 0xffffffff
+    c = ((t << 15 | t >> 17) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (d ^ (e & (c ^ d))) + x12 + 0x8f1bbcdc) & 0xffffffff
+    b = ((t << 9 | t >> 23) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (c ^ (d & (b ^ c))) + x4 + 0x8f1bbcdc) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (b ^ (c & (a ^ b))) + x13 + 0x8f1bbcdc) & 0xffffffff
+    e = ((t << 9 | t >> 23) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (a ^ (b & (e ^ a))) + x3 + 0x8f1bbcdc) & 0xffffffff
+    d = ((t << 14 | t >> 18) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (e ^ (a & (d ^ e))) + x7 + 0x8f1bbcdc) & 0xffffffff
+    c = ((t << 5 | t >> 27) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (d ^ (e & (c ^ d))) + x15 + 0x8f1bbcdc) & 0xffffffff
+    b = ((t << 6 | t >> 26) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (c ^ (d & (b ^ c))) + x14 + 0x8f1bbcdc) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (b ^ (c & (a ^ b))) + x5 + 0x8f1bbcdc) & 0xffffffff
+    e = ((t << 6 | t >> 26) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (a ^ (b & (e ^ a))) + x6 + 0x8f1bbcdc) & 0xffffffff
+    d = ((t << 5 | t >> 27) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (e ^ (a & (d ^ e))) + x2 + 0x8f1bbcdc) & 0xffffffff
+    c = ((t << 12 | t >> 20) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    # Round 5
+    t = (b + (c ^ (d | ~e)) + x4 + 0xa953fd4e) & 0xffffffff
+    b = ((t << 9 | t >> 23) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ (c | ~d)) + x0 + 0xa953fd4e) & 0xffffffff
+    a = ((t << 15 | t >> 17) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ (b | ~c)) + x5 + 0xa953fd4e) & 0xffffffff
+    e = ((t << 5 | t >> 27) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ (a | ~b)) + x9 + 0xa953fd4e) & 0xffffffff
+    d = ((t << 11 | t >> 21) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ (e | ~a)) + x7 + 0xa953fd4e) & 0xffffffff
+    c = ((t << 6 | t >> 26) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ (d | ~e)) + x12 + 0xa953fd4e) & 0xffffffff
+    b = ((t << 8 | t >> 24) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ (c | ~d)) + x2 + 0xa953fd4e) & 0xffffffff
+    a = ((t << 13 | t >> 19) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ (b | ~c)) + x10 + 0xa953fd4e) & 0xffffffff
+    e = ((t << 12 | t >> 20) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ (a | ~b)) + x14 + 0xa953fd4e) & 0xffffffff
+    d = ((t << 5 | t >> 27) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ (e | ~a)) + x1 + 0xa953fd4e) & 0xffffffff
+    c = ((t << 12 | t >> 20) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ (d | ~e)) + x3 + 0xa953fd4e) & 0xffffffff
+    b = ((t << 13 | t >> 19) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ (c | ~d)) + x8 + 0xa953fd4e) & 0xffffffff
+    a = ((t << 14 | t >> 18) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ (b | ~c)) + x11 + 0xa953fd4e) & 0xffffffff
+    e = ((t << 11 | t >> 21) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ (a | ~b)) + x6 + 0xa953fd4e) & 0xffffffff
+    d = ((t << 8 | t >> 24) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ (e | ~a)) + x15 + 0xa953fd4e) & 0xffffffff
+    c = ((t << 5 | t >> 27) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ (d | ~e)) + x13 + 0xa953fd4e) & 0xffffffff
+    b = ((t << 6 | t >> 26) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+
+    aa, bb, cc, dd, ee = a, b, c, d, e
+    a, b, c, d, e = state
+    # Parallel round 1
+    t = (a + (b ^ (c | ~d)) + x5 + 0x50a28be6) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ (b | ~c)) + x14 + 0x50a28be6) & 0xffffffff
+    e = ((t << 9 | t >> 23) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ (a | ~b)) + x7 + 0x50a28be6) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ (e | ~a)) + x0 + 0x50a28be6) & 0xffffffff
+    c = ((t << 11 | t >> 21) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ (d | ~e)) + x9 + 0x50a28be6) & 0xffffffff
+    b = ((t << 13 | t >> 19) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ (c | ~d)) + x2 + 0x50a28be6) & 0xffffffff
+    a = ((t << 15 | t >> 17) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ (b | ~c)) + x11 + 0x50a28be6) & 0xffffffff
+    e = ((t << 15 | t >> 17) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ (a | ~b)) + x4 + 0x50a28be6) & 0xffffffff
+    d = ((t << 5 | t >> 27) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ (e | ~a)) + x13 + 0x50a28be6) & 0xffffffff
+    c = ((t << 7 | t >> 25) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ (d | ~e)) + x6 + 0x50a28be6) & 0xffffffff
+    b = ((t << 7 | t >> 25) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ (c | ~d)) + x15 + 0x50a28be6) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ (b | ~c)) + x8 + 0x50a28be6) & 0xffffffff
+    e = ((t << 11 | t >> 21) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ (a | ~b)) + x1 + 0x50a28be6) & 0xffffffff
+    d = ((t << 14 | t >> 18) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ (e | ~a)) + x10 + 0x50a28be6) & 0xffffffff
+    c = ((t << 14 | t >> 18) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ (d | ~e)) + x3 + 0x50a28be6) & 0xffffffff
+    b = ((t << 12 | t >> 20) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ (c | ~d)) + x12 + 0x50a28be6) & 0xffffffff
+    a = ((t << 6 | t >> 26) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    # Parallel round 2
+    t = (e + (b ^ (c & (a ^ b))) + x6 + 0x5c4dd124) & 0xffffffff
+    e = ((t << 9 | t >> 23) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (a ^ (b & (e ^ a))) + x11 + 0x5c4dd124) & 0xffffffff
+    d = ((t << 13 | t >> 19) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (e ^ (a & (d ^ e))) + x3 + 0x5c4dd124) & 0xffffffff
+    c = ((t << 15 | t >> 17) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (d ^ (e & (c ^ d))) + x7 + 0x5c4dd124) & 0xffffffff
+    b = ((t << 7 | t >> 25) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (c ^ (d & (b ^ c))) + x0 + 0x5c4dd124) & 0xffffffff
+    a = ((t << 12 | t >> 20) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (b ^ (c & (a ^ b))) + x13 + 0x5c4dd124) & 0xffffffff
+    e = ((t << 8 | t >> 24) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (a ^ (b & (e ^ a))) + x5 + 0x5c4dd124) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (e ^ (a & (d ^ e))) + x10 + 0x5c4dd124) & 0xffffffff
+    c = ((t << 11 | t >> 21) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (d ^ (e & (c ^ d))) + x14 + 0x5c4dd124) & 0xffffffff
+    b = ((t << 7 | t >> 25) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (c ^ (d & (b ^ c))) + x15 + 0x5c4dd124) & 0xffffffff
+    a = ((t << 7 | t >> 25) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (b ^ (c & (a ^ b))) + x8 + 0x5c4dd124) & 0xffffffff
+    e = ((t << 12 | t >> 20) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (a ^ (b & (e ^ a))) + x12 + 0x5c4dd124) & 0xffffffff
+    d = ((t << 7 | t >> 25) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (e ^ (a & (d ^ e))) + x4 + 0x5c4dd124) & 0xffffffff
+    c = ((t << 6 | t >> 26) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (d ^ (e & (c ^ d))) + x9 + 0x5c4dd124) & 0xffffffff
+    b = ((t << 15 | t >> 17) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (c ^ (d & (b ^ c))) + x1 + 0x5c4dd124) & 0xffffffff
+    a = ((t << 13 | t >> 19) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (b ^ (c & (a ^ b))) + x2 + 0x5c4dd124) & 0xffffffff
+    e = ((t << 11 | t >> 21) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    # Parallel round 3
+    t = (d + ((e | ~a) ^ b) + x15 + 0x6d703ef3) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + ((d | ~e) ^ a) + x5 + 0x6d703ef3) & 0xffffffff
+    c = ((t << 7 | t >> 25) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + ((c | ~d) ^ e) + x1 + 0x6d703ef3) & 0xffffffff
+    b = ((t << 15 | t >> 17) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + ((b | ~c) ^ d) + x3 + 0x6d703ef3) & 0xffffffff
+    a = ((t << 11 | t >> 21) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + ((a | ~b) ^ c) + x7 + 0x6d703ef3) & 0xffffffff
+    e = ((t << 8 | t >> 24) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + ((e | ~a) ^ b) + x14 + 0x6d703ef3) & 0xffffffff
+    d = ((t << 6 | t >> 26) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + ((d | ~e) ^ a) + x6 + 0x6d703ef3) & 0xffffffff
+    c = ((t << 6 | t >> 26) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + ((c | ~d) ^ e) + x9 + 0x6d703ef3) & 0xffffffff
+    b = ((t << 14 | t >> 18) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + ((b | ~c) ^ d) + x11 + 0x6d703ef3) & 0xffffffff
+    a = ((t << 12 | t >> 20) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + ((a | ~b) ^ c) + x8 + 0x6d703ef3) & 0xffffffff
+    e = ((t << 13 | t >> 19) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + ((e | ~a) ^ b) + x12 + 0x6d703ef3) & 0xffffffff
+    d = ((t << 5 | t >> 27) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + ((d | ~e) ^ a) + x2 + 0x6d703ef3) & 0xffffffff
+    c = ((t << 14 | t >> 18) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + ((c | ~d) ^ e) + x10 + 0x6d703ef3) & 0xffffffff
+    b = ((t << 13 | t >> 19) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + ((b | ~c) ^ d) + x0 + 0x6d703ef3) & 0xffffffff
+    a = ((t << 13 | t >> 19) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + ((a | ~b) ^ c) + x4 + 0x6d703ef3) & 0xffffffff
+    e = ((t << 7 | t >> 25) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + ((e | ~a) ^ b) + x13 + 0x6d703ef3) & 0xffffffff
+    d = ((t << 5 | t >> 27) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    # Parallel round 4
+    t = (c + (a ^ (d & (e ^ a))) + x8 + 0x7a6d76e9) & 0xffffffff
+    c = ((t << 15 | t >> 17) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (e ^ (c & (d ^ e))) + x6 + 0x7a6d76e9) & 0xffffffff
+    b = ((t << 5 | t >> 27) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (d ^ (b & (c ^ d))) + x4 + 0x7a6d76e9) & 0xffffffff
+    a = ((t << 8 | t >> 24) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (c ^ (a & (b ^ c))) + x1 + 0x7a6d76e9) & 0xffffffff
+    e = ((t << 11 | t >> 21) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (b ^ (e & (a ^ b))) + x3 + 0x7a6d76e9) & 0xffffffff
+    d = ((t << 14 | t >> 18) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (a ^ (d & (e ^ a))) + x11 + 0x7a6d76e9) & 0xffffffff
+    c = ((t << 14 | t >> 18) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (e ^ (c & (d ^ e))) + x15 + 0x7a6d76e9) & 0xffffffff
+    b = ((t << 6 | t >> 26) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (d ^ (b & (c ^ d))) + x0 + 0x7a6d76e9) & 0xffffffff
+    a = ((t << 14 | t >> 18) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (c ^ (a & (b ^ c))) + x5 + 0x7a6d76e9) & 0xffffffff
+    e = ((t << 6 | t >> 26) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (b ^ (e & (a ^ b))) + x12 + 0x7a6d76e9) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (a ^ (d & (e ^ a))) + x2 + 0x7a6d76e9) & 0xffffffff
+    c = ((t << 12 | t >> 20) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (e ^ (c & (d ^ e))) + x13 + 0x7a6d76e9) & 0xffffffff
+    b = ((t << 9 | t >> 23) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (d ^ (b & (c ^ d))) + x9 + 0x7a6d76e9) & 0xffffffff
+    a = ((t << 12 | t >> 20) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (c ^ (a & (b ^ c))) + x7 + 0x7a6d76e9) & 0xffffffff
+    e = ((t << 5 | t >> 27) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (b ^ (e & (a ^ b))) + x10 + 0x7a6d76e9) & 0xffffffff
+    d = ((t << 15 | t >> 17) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (a ^ (d & (e ^ a))) + x14 + 0x7a6d76e9) & 0xffffffff
+    c = ((t << 8 | t >> 24) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    # Parallel round 5
+    t = (b + (c ^ d ^ e) + x12) & 0xffffffff
+    b = ((t << 8 | t >> 24) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ c ^ d) + x15) & 0xffffffff
+    a = ((t << 5 | t >> 27) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ b ^ c) + x10) & 0xffffffff
+    e = ((t << 12 | t >> 20) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ a ^ b) + x4) & 0xffffffff
+    d = ((t << 9 | t >> 23) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ e ^ a) + x1) & 0xffffffff
+    c = ((t << 12 | t >> 20) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ d ^ e) + x5) & 0xffffffff
+    b = ((t << 5 | t >> 27) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ c ^ d) + x8) & 0xffffffff
+    a = ((t << 14 | t >> 18) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ b ^ c) + x7) & 0xffffffff
+    e = ((t << 6 | t >> 26) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ a ^ b) + x6) & 0xffffffff
+    d = ((t << 8 | t >> 24) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ e ^ a) + x2) & 0xffffffff
+    c = ((t << 13 | t >> 19) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ d ^ e) + x13) & 0xffffffff
+    b = ((t << 6 | t >> 26) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+    t = (a + (b ^ c ^ d) + x14) & 0xffffffff
+    a = ((t << 5 | t >> 27) + e) & 0xffffffff
+    c = (c << 10 | c >> 22) & 0xffffffff
+    t = (e + (a ^ b ^ c) + x0) & 0xffffffff
+    e = ((t << 15 | t >> 17) + d) & 0xffffffff
+    b = (b << 10 | b >> 22) & 0xffffffff
+    t = (d + (e ^ a ^ b) + x3) & 0xffffffff
+    d = ((t << 13 | t >> 19) + c) & 0xffffffff
+    a = (a << 10 | a >> 22) & 0xffffffff
+    t = (c + (d ^ e ^ a) + x9) & 0xffffffff
+    c = ((t << 11 | t >> 21) + b) & 0xffffffff
+    e = (e << 10 | e >> 22) & 0xffffffff
+    t = (b + (c ^ d ^ e) + x11) & 0xffffffff
+    b = ((t << 11 | t >> 21) + a) & 0xffffffff
+    d = (d << 10 | d >> 22) & 0xffffffff
+
+
+    return ((state[1] + cc + d) & 0xffffffff,
+            (state[2] + dd + e) & 0xffffffff,
+            (state[3] + ee + a) & 0xffffffff,
+            (state[4] + aa + b) & 0xffffffff,
+            (state[0] + bb + c) & 0xffffffff)
+
@@ -0,0 +1,40 @@
+## Lane-parallel RIPEMD-160 over NumPy arrays.
+##
+## Every message of a batch occupies one uint32 lane; the unrolled
+## compression function of bitcoin.ripemd is run once per block with arrays
+## in place of integers, so each step hashes the whole batch. uint32
+## arithmetic wraps modulo 2**32, which makes the masks of the scalar code
+## no-ops. NumPy is optional: without it, available() is False and the
+## callers fall back to the scalar implementation.
+
+import struct
+
+from bitcoin.ripemd import _IV, _compress
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def available():
+    return numpy is not None
+
+
+def rmd160_many(messages):
+    """Return the RIPEMD-160 digests of a list of equal-length byte
+    strings."""
+    if not messages:
+        return []
+    length = len(messages[0])
+    if any(len(m) != length for m in messages):
+        raise ValueError("Messages must have equal length")
+    padding = b'\x80' + b'\x00' * ((55 - length) % 64) + struct.pack('<Q', 8 * length)
+    words = numpy.frombuffer(b''.join([m + padding for m in messages]), dtype='<u4')
+    # Word-major layout: row i holds message word i of every lane
+    words = numpy.ascontiguousarray(words.reshape(len(messages), -1).T)
+    state = tuple(numpy.full(len(messages), h, dtype=numpy.uint32) for h in _IV)
+    for off in range(0, words.shape[0], 16):
+        state = _compress(state, words[off:off + 16])
+    out = numpy.stack(state, axis=1).astype('<u4').tobytes()
+    return [out[i:i + 20] for i in range(0, len(out), 20)]
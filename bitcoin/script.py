@@ -0,0 +1,601 @@
+#!/usr/bin/python
+import binascii
+import hashlib
+from collections import namedtuple
+
+from bitcoin.main import *
+from bitcoin.transaction import Transaction, LegacySighashContext, deserialize_script, \
+    serialize_script, parse_der_sig, iter_script
+from bitcoin.segwit import BIP143Context
+from bitcoin.signing import lookup_input
+
+# Script interpreter
+#
+# verify_transaction runs every input's scriptSig, the scriptPubKey of the
+# output it spends, and any P2SH redeem script or segwit v0 program
+# (P2WPKH, P2WSH, native or nested in P2SH), following the consensus rules
+# (P2SH, BIP66 strict DER, BIP65/BIP112 lock times, BIP141/143 segwit,
+# BIP147 NULLDUMMY). Policy rules such as low-S or minimal pushes are not
+# enforced. Spends of witness versions 1 and up, Taproot included, are not
+# interpreted and come out invalid with an "Unsupported witness version"
+# error. Scripts are run on the tokens of deserialize_script: None is
+# OP_0, byte strings are pushes, -1 and 1-16 are OP_1NEGATE and OP_1-OP_16,
+# 0 is OP_RESERVED and larger numbers are the other opcodes.
+#
+# All inputs share one LegacySighashContext and one BIP143Context. Given a
+# verifier, such as ecdsa_batch_verify, signature checks are collected and
+# handed to it in one call: scripts first run assuming every signature is
+# valid, and any input whose script failed or whose signatures turned out
+# invalid is run again checking each signature as it goes. DER signatures
+# carry no recovery id, so the checks are (r, s) pairs, which
+# ecdsa_batch_verify verifies one by one. Successful checks land in the
+# signature cache either way.
+
+InputResult = namedtuple('InputResult', ['index', 'valid', 'kind', 'error'])
+
+
+class ScriptError(Exception):
+    pass
+
+
+OP_0 = 0x00
+OP_PUSHDATA4 = 0x4e
+OP_1NEGATE = 0x4f
+OP_RESERVED = 0x50
+OP_16 = 0x60
+OP_NOP = 0x61
+OP_VER = 0x62
+OP_IF = 0x63
+OP_NOTIF = 0x64
+OP_VERIF = 0x65
+OP_VERNOTIF = 0x66
+OP_ELSE = 0x67
+OP_ENDIF = 0x68
+OP_VERIFY = 0x69
+OP_RETURN = 0x6a
+OP_TOALTSTACK = 0x6b
+OP_FROMALTSTACK = 0x6c
+OP_2DROP = 0x6d
+OP_2DUP = 0x6e
+OP_3DUP = 0x6f
+OP_2OVER = 0x70
+OP_2ROT = 0x71
+OP_2SWAP = 0x72
+OP_IFDUP = 0x73
+OP_DEPTH = 0x74
+OP_DROP = 0x75
+OP_DUP = 0x76
+OP_NIP = 0x77
+OP_OVER = 0x78
+OP_PICK = 0x79
+OP_ROLL = 0x7a
+OP_ROT = 0x7b
+OP_SWAP = 0x7c
+OP_TUCK = 0x7d
+OP_SIZE = 0x82
+OP_EQUAL = 0x87
+OP_EQUALVERIFY = 0x88
+OP_1ADD = 0x8b
+OP_1SUB = 0x8c
+OP_NEGATE = 0x8f
+OP_ABS = 0x90
+OP_NOT = 0x91
+OP_0NOTEQUAL = 0x92
+OP_ADD = 0x93
+OP_SUB = 0x94
+OP_BOOLAND = 0x9a
+OP_BOOLOR = 0x9b
+OP_NUMEQUAL = 0x9c
+OP_NUMEQUALVERIFY = 0x9d
+OP_NUMNOTEQUAL = 0x9e
+OP_LESSTHAN = 0x9f
+OP_GREATERTHAN = 0xa0
+OP_LESSTHANOREQUAL = 0xa1
+OP_GREATERTHANOREQUAL = 0xa2
+OP_MIN = 0xa3
+OP_MAX = 0xa4
+OP_WITHIN = 0xa5
+OP_RIPEMD160 = 0xa6
+OP_SHA1 = 0xa7
+OP_SHA256 = 0xa8
+OP_HASH160 = 0xa9
+OP_HASH256 = 0xaa
+OP_CODESEPARATOR = 0xab
+OP_CHECKSIG = 0xac
+OP_CHECKSIGVERIFY = 0xad
+OP_CHECKMULTISIG = 0xae
+OP_CHECKMULTISIGVERIFY = 0xaf
+OP_NOP1 = 0xb0
+OP_CHECKLOCKTIMEVERIFY = 0xb1
+OP_CHECKSEQUENCEVERIFY = 0xb2
+OP_NOP10 = 0xb9
+
+# Disabled everywhere, even in unexecuted branches
+_DISABLED = set([0x7e, 0x7f, 0x80, 0x81, 0x83, 0x84, 0x85, 0x86, 0x8d, 0x8e,
+                 0x95, 0x96, 0x97, 0x98, 0x99])
+
+MAX_SCRIPT_SIZE = 10000
+MAX_ELEMENT_SIZE = 520
+MAX_OPS_PER_SCRIPT = 201
+MAX_STACK_SIZE = 1000
+MAX_PUBKEYS_PER_MULTISIG = 20
+LOCKTIME_THRESHOLD = 500000000
+SEQUENCE_DISABLE_FLAG = 1 << 31
+SEQUENCE_TYPE_FLAG = 1 << 22
+SEQUENCE_MASK = 0x0000ffff
+
+_TRUE = b'\x01'
+_FALSE = b''
+
+
+def decode_script_num(data, max_size=4):
+    if len(data) > max_size:
+        raise ScriptError("Script number overflow")
+    if not data:
+        return 0
+    data = bytearray(data)
+    n = decode(bytes(data[::-1]), 256)
+    if data[-1] & 0x80:
+        return -(n & ~(0x80 << (8 * (len(data) - 1))))
+    return n
+
+
+def encode_script_num(n):
+    if n == 0:
+        return _FALSE
+    out = bytearray()
+    neg, n = n < 0, abs(n)
+    while n:
+        out.append(n & 0xff)
+        n >>= 8
+    if out[-1] & 0x80:
+        out.append(0x80 if neg else 0)
+    elif neg:
+        out[-1] |= 0x80
+    return bytes(out)
+
+
+def cast_to_bool(data):
+    data = bytearray(data)
+    for i, byte in enumerate(data):
+        if byte:
+            # Negative zero is false
+            return not (i == len(data) - 1 and byte == 0x80)
+    return False
+
+
+def _script_bytes(tokens):
+    script = serialize_script(tokens)
+    # A script without pushes serializes to hex
+    return binascii.unhexlify(script) if not isinstance(script, bytes) else script
+
+
+class _SignatureChecker(object):
+    # Signature checks of one input. With deferred set, checks are recorded
+    # there and assumed to succeed
+
+    def __init__(self, tx, i, amount, contexts, deferred=None):
+        self.tx, self.i, self.amount = tx, i, amount
+        self.contexts = contexts
+        self.deferred = deferred
+
+    def _context(self, kind):
+        if kind not in self.contexts:
+            self.contexts[kind] = (LegacySighashContext if kind == 'legacy'
+                                   else BIP143Context)(self.tx)
+        return self.contexts[kind]
+
+    def check(self, sig, pub, script_code, witness):
+        if not sig:
+            return False
+        parsed = parse_der_sig(sig)
+        if parsed is None:
+            raise ScriptError("Non-DER signature")
+        r, s, hashcode = parsed
+        # 02/03 and 33 bytes or 04 and 65 bytes; the batch verifier cannot
+        # decode anything else
+        prefix = from_byte_to_int(pub[0]) if pub else None
+        if not (len(pub) == 33 and prefix in (2, 3) or len(pub) == 65 and prefix == 4):
+            return False
+        if witness:
+            digest = self._context('bip143').digest(self.i, script_code, self.amount, hashcode)
+        else:
+            digest = self._context('legacy').digest(self.i, script_code, hashcode)
+        # A DER signature has no recovery id, so the parity of R is unknown
+        vrs = (r, s)
+        if self.deferred is not None:
+            self.deferred.append((digest, vrs, pub))
+            return True
+        try:
+            return ecdsa_raw_verify(digest, vrs, pub)
+        except Exception:
+            # Public keys that are not on the curve
+            return False
+
+
+def eval_script(stack, script, checker, witness=False):
+    """Run script (bytes) on stack (a list of byte strings, modified in
+    place). Raises ScriptError when the script fails."""
+    if len(script) > MAX_SCRIPT_SIZE:
+        raise ScriptError("Script too large")
+    try:
+        tokens = deserialize_script(script)
+    except ValueError as e:
+        raise ScriptError(str(e))
+    altstack, conditions = [], []
+    ops = 0
+    codesep = None
+
+    def pop():
+        if not stack:
+            raise ScriptError("Stack underflow")
+        return stack.pop()
+
+    def top(n=1):
+        if len(stack) < n:
+            raise ScriptError("Stack underflow")
+        return stack[-n]
+
+    def num(data, max_size=4):
+        return decode_script_num(data, max_size)
+
+    def script_code(sigs=()):
+        # The script from the last executed OP_CODESEPARATOR, and for
+        # legacy scripts without the signatures being checked
+        if codesep is None and (witness or not any(t in sigs for t in tokens)):
+            return script
+        code = tokens[codesep or 0:]
+        if not witness:
+            code = [t for t in code if t not in sigs]
+        return _script_bytes(code)
+
+    for pc, token in enumerate(tokens):
+        executing = all(conditions)
+        if isinstance(token, bytes):
+            if len(token) > MAX_ELEMENT_SIZE:
+                raise ScriptError("Push too large")
+            if executing:
+                stack.append(token)
+        elif token is None:
+            if executing:
+                stack.append(_FALSE)
+        elif token == -1 or 1 <= token <= 16:
+            if executing:
+                stack.append(encode_script_num(token))
+        else:
+            op = OP_RESERVED if token == 0 else token
+            if op > OP_16:
+                ops += 1
+                if ops > MAX_OPS_PER_SCRIPT:
+                    raise ScriptError("Too many operations")
+            if op in _DISABLED or op in (OP_VERIF, OP_VERNOTIF):
+                raise ScriptError("Disabled opcode %02x" % op)
+            if op in (OP_IF, OP_NOTIF):
+                value = False
+                if executing:
+                    value = cast_to_bool(pop())
+                    if op == OP_NOTIF:
+                        value = not value
+                conditions.append(value)
+            elif op == OP_ELSE:
+                if not conditions:
+                    raise ScriptError("Unbalanced conditional")
+                conditions[-1] = not conditions[-1]
+            elif op == OP_ENDIF:
+                if not conditions:
+                    raise ScriptError("Unbalanced conditional")
+                conditions.pop()
+            elif not executing:
+                pass
+            elif op == OP_NOP or OP_NOP1 <= op <= OP_NOP10 and op not in (
+                    OP_CHECKLOCKTIMEVERIFY, OP_CHECKSEQUENCEVERIFY):
+                pass
+            elif op == OP_CHECKLOCKTIMEVERIFY:
+                _check_locktime(num(top(), 5), checker)
+            elif op == OP_CHECKSEQUENCEVERIFY:
+                _check_sequence(num(top(), 5), checker)
+            elif op == OP_VERIFY:
+                if not cast_to_bool(pop()):
+                    raise ScriptError("OP_VERIFY failed")
+            elif op == OP_RETURN:
+                raise ScriptError("OP_RETURN")
+            elif op == OP_TOALTSTACK:
+                altstack.append(pop())
+            elif op == OP_FROMALTSTACK:
+                if not altstack:
+                    raise ScriptError("Alt stack underflow")
+                stack.append(altstack.pop())
+            elif op == OP_2DROP:
+                top(2)
+                del stack[-2:]
+            elif op == OP_2DUP:
+                stack.extend([top(2), top(1)])
+            elif op == OP_3DUP:
+                stack.extend([top(3), top(2), top(1)])
+            elif op == OP_2OVER:
+                stack.extend([top(4), top(3)])
+            elif op == OP_2ROT:
+                top(6)
+                stack.extend(stack[-6:-4])
+                del stack[-8:-6]
+            elif op == OP_2SWAP:
+                top(4)
+                stack[-4:] = stack[-2:] + stack[-4:-2]
+            elif op == OP_IFDUP:
+                if cast_to_bool(top()):
+                    stack.append(top())
+            elif op == OP_DEPTH:
+                stack.append(encode_script_num(len(stack)))
+            elif op == OP_DROP:
+                pop()
+            elif op == OP_DUP:
+                stack.append(top())
+            elif op == OP_NIP:
+                top(2)
+                del stack[-2]
+            elif op == OP_OVER:
+                stack.append(top(2))
+            elif op in (OP_PICK, OP_ROLL):
+                n = num(pop())
+                if n < 0 or n >= len(stack):
+                    raise ScriptError("Invalid stack index")
+                item = stack[-n - 1]
+                if op == OP_ROLL:
+                    del stack[-n - 1]
+                stack.append(item)
+            elif op == OP_ROT:
+                top(3)
+                stack.append(stack.pop(-3))
+            elif op == OP_SWAP:
+                top(2)
+                stack[-2:] = [stack[-1], stack[-2]]
+            elif op == OP_TUCK:
+                top(2)
+                stack.insert(-2, stack[-1])
+            elif op == OP_SIZE:
+                stack.append(encode_script_num(len(top())))
+            elif op in (OP_EQUAL, OP_EQUALVERIFY):
+                equal = pop() == pop()
+                if op == OP_EQUALVERIFY:
+                    if not equal:
+                        raise ScriptError("OP_EQUALVERIFY failed")
+                else:
+                    stack.append(_TRUE if equal else _FALSE)
+            elif OP_1ADD <= op <= OP_0NOTEQUAL:
+                a = num(pop())
+                stack.append(encode_script_num({
+                    OP_1ADD: lambda: a + 1,
+                    OP_1SUB: lambda: a - 1,
+                    OP_NEGATE: lambda: -a,
+                    OP_ABS: lambda: abs(a),
+                    OP_NOT: lambda: int(a == 0),
+                    OP_0NOTEQUAL: lambda: int(a != 0)}[op]()))
+            elif OP_ADD <= op <= OP_MAX:
+                b, a = num(pop()), num(pop())
+                result = {
+                    OP_ADD: lambda: a + b,
+                    OP_SUB: lambda: a - b,
+                    OP_BOOLAND: lambda: int(a != 0 and b != 0),
+                    OP_BOOLOR: lambda: int(a != 0 or b != 0),
+                    OP_NUMEQUAL: lambda: int(a == b),
+                    OP_NUMEQUALVERIFY: lambda: int(a == b),
+                    OP_NUMNOTEQUAL: lambda: int(a != b),
+                    OP_LESSTHAN: lambda: int(a < b),
+                    OP_GREATERTHAN: lambda: int(a > b),
+                    OP_LESSTHANOREQUAL: lambda: int(a <= b),
+                    OP_GREATERTHANOREQUAL: lambda: int(a >= b),
+                    OP_MIN: lambda: min(a, b),
+                    OP_MAX: lambda: max(a, b)}[op]()
+                if op == OP_NUMEQUALVERIFY:
+                    if not result:
+                        raise ScriptError("OP_NUMEQUALVERIFY failed")
+                else:
+                    stack.append(encode_script_num(result))
+            elif op == OP_WITHIN:
+                hi, lo, x = num(pop()), num(pop()), num(pop())
+                stack.append(_TRUE if lo <= x < hi else _FALSE)
+            elif op == OP_RIPEMD160:
+                stack.append(bin_ripemd160(pop()))
+            elif op == OP_SHA1:
+                stack.append(hashlib.sha1(pop()).digest())
+            elif op == OP_SHA256:
+                stack.append(hashlib.sha256(pop()).digest())
+            elif op == OP_HASH160:
+                stack.append(bin_hash160(pop()))
+            elif op == OP_HASH256:
+                stack.append(bin_dbl_sha256(pop()))
+            elif op == OP_CODESEPARATOR:
+                codesep = pc + 1
+            elif op in (OP_CHECKSIG, OP_CHECKSIGVERIFY):
+                pub, sig = pop(), pop()
+                valid = checker.check(sig, pub, script_code([sig]), witness)
+                if op == OP_CHECKSIGVERIFY:
+                    if not valid:
+                        raise ScriptError("OP_CHECKSIGVERIFY failed")
+                else:
+                    stack.append(_TRUE if valid else _FALSE)
+            elif op in (OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY):
+                n = num(pop())
+                if not 0 <= n <= MAX_PUBKEYS_PER_MULTISIG:
+                    raise ScriptError("Invalid public key count")
+                ops += n
+                if ops > MAX_OPS_PER_SCRIPT:
+                    raise ScriptError("Too many operations")
+                # Keys and signatures in script order
+                pubs = [pop() for _ in range(n)][::-1]
+                m = num(pop())
+                if not 0 <= m <= n:
+                    raise ScriptError("Invalid signature count")
+                sigs = [pop() for _ in range(m)][::-1]
+                if pop() != _FALSE:
+                    raise ScriptError("Non-null dummy")
+                code = script_code(sigs)
+                valid = True
+                while sigs and valid:
+                    if len(pubs) < len(sigs):
+                        valid = False
+                    elif checker.check(sigs[0], pubs[0], code, witness):
+                        sigs.pop(0)
+                        pubs.pop(0)
+                    else:
+                        pubs.pop(0)
+                if op == OP_CHECKMULTISIGVERIFY:
+                    if not valid:
+                        raise ScriptError("OP_CHECKMULTISIGVERIFY failed")
+                else:
+                    stack.append(_TRUE if valid else _FALSE)
+            else:
+                raise ScriptError("Bad opcode %02x" % op)
+        if len(stack) + len(altstack) > MAX_STACK_SIZE:
+            raise ScriptError("Stack too large")
+    if conditions:
+        raise ScriptError("Unbalanced conditional")
+    return stack
+
+
+def _check_locktime(locktime, checker):
+    tx, inp = checker.tx, checker.tx.ins[checker.i]
+    if locktime < 0:
+        raise ScriptError("Negative locktime")
+    if (locktime < LOCKTIME_THRESHOLD) != (tx.locktime < LOCKTIME_THRESHOLD) or \
+            locktime > tx.locktime or inp.sequence == 0xffffffff:
+        raise ScriptError("Locktime requirement not satisfied")
+
+
+def _check_sequence(sequence, checker):
+    tx, inp = checker.tx, checker.tx.ins[checker.i]
+    if sequence < 0:
+        raise ScriptError("Negative sequence")
+    if sequence & SEQUENCE_DISABLE_FLAG:
+        return
+    mask = SEQUENCE_TYPE_FLAG | SEQUENCE_MASK
+    if tx.version < 2 or inp.sequence & SEQUENCE_DISABLE_FLAG or \
+            (sequence & SEQUENCE_TYPE_FLAG) != (inp.sequence & SEQUENCE_TYPE_FLAG) or \
+            sequence & mask > inp.sequence & mask:
+        raise ScriptError("Sequence requirement not satisfied")
+
+
+def _is_push_only(script):
+    return all(code <= OP_16 for code, _ in iter_script(script))
+
+
+def _witness_program(script):
+    # (version, program) of a segwit output script, or None
+    if 4 <= len(script) <= 42 and from_byte_to_int(script[1]) == len(script) - 2:
+        version = from_byte_to_int(script[0])
+        if version == 0 or 0x51 <= version <= 0x60:
+            return (version - 0x50 if version else 0), script[2:]
+    return None
+
+
+def _verify_witness(version, program, witness, checker):
+    if version != 0:
+        # Taproot (v1) and later versions are not interpreted, so such a
+        # spend cannot be reported as verified
+        raise ScriptError("Unsupported witness version %d" % version)
+    if len(program) == 32:
+        if not witness:
+            raise ScriptError("Empty witness")
+        script, stack = witness[-1], list(witness[:-1])
+        if hashlib.sha256(script).digest() != program:
+            raise ScriptError("Witness script mismatch")
+        kind = 'p2wsh'
+    elif len(program) == 20:
+        if len(witness) != 2:
+            raise ScriptError("Witness length mismatch")
+        script, stack = b'\x76\xa9\x14' + program + b'\x88\xac', list(witness)
+        kind = 'p2wpkh'
+    else:
+        raise ScriptError("Wrong witness program length")
+    if any(len(item) > MAX_ELEMENT_SIZE for item in stack):
+        raise ScriptError("Push too large")
+    eval_script(stack, script, checker, witness=True)
+    if len(stack) != 1 or not cast_to_bool(stack[0]):
+        raise ScriptError("Witness script failed")
+    return kind
+
+
+def verify_input(tx, i, script_pubkey, amount, contexts=None, deferred=None):
+    """Verify input i of a Transaction against the output it spends.
+    Returns the kind of input; raises ScriptError when it is invalid."""
+    inp = tx.ins[i]
+    witness = inp.witness if isinstance(inp.witness, tuple) else ()
+    checker = _SignatureChecker(tx, i, amount, {} if contexts is None else contexts, deferred)
+    script_sig = inp.script or b''
+    stack = eval_script([], script_sig, checker)
+    copy = list(stack)
+    eval_script(stack, script_pubkey, checker)
+    if not stack or not cast_to_bool(stack[-1]):
+        raise ScriptError("Script evaluated to false")
+    kind = 'legacy'
+    program = _witness_program(script_pubkey)
+    if program is not None:
+        if script_sig:
+            raise ScriptError("Native witness input with a scriptSig")
+        kind = _verify_witness(program[0], program[1], witness, checker)
+    elif len(script_pubkey) == 23 and script_pubkey[:2] == b'\xa9\x14' and \
+            script_pubkey[-1:] == b'\x87':
+        # P2SH
+        if not _is_push_only(script_sig):
+            raise ScriptError("P2SH scriptSig is not push only")
+        stack = copy
+        redeem = stack.pop()
+        eval_script(stack, redeem, checker)
+        if not stack or not cast_to_bool(stack[-1]):
+            raise ScriptError("P2SH script evaluated to false")
+        kind = 'p2sh'
+        program = _witness_program(redeem)
+        if program is not None:
+            if script_sig != _script_bytes([redeem]):
+                raise ScriptError("P2SH witness scriptSig is not a single push")
+            kind = 'p2sh-' + _verify_witness(program[0], program[1], witness, checker)
+    if witness and program is None:
+        raise ScriptError("Unexpected witness")
+    return kind
+
+
+def verify_transaction(tx, prevouts, verifier=None):
+    """Verify every input of tx against the outputs it spends.
+
+    prevouts gives each input's prevout, a dict with 'script' (hex or
+    bytes) and 'value': a list in input order or a dict keyed by
+    'txid:index'. verifier, e.g. ecdsa_batch_verify, takes a list of
+    (msghash, vrs, pub) and returns a list of booleans; without one each
+    signature is checked as it is met.
+
+    Returns one InputResult(index, valid, kind, error) per input. Inputs
+    spending witness version 1 and up (Taproot) are not verified and come
+    out invalid, with an "Unsupported witness version" error."""
+    txobj = tx if isinstance(tx, Transaction) else Transaction(tx)
+    contexts = {}
+    spent = []
+    for i, inp in enumerate(txobj.ins):
+        prevout = lookup_input(prevouts, inp, i)
+        script = prevout['script']
+        if not isinstance(script, bytes):
+            script = binascii.unhexlify(script)
+        spent.append((script, prevout['value']))
+
+    def run(i, deferred=None):
+        try:
+            kind = verify_input(txobj, i, spent[i][0], spent[i][1], contexts, deferred)
+            return InputResult(i, True, kind, None)
+        except ScriptError as e:
+            return InputResult(i, False, None, str(e))
+
+    if verifier is None:
+        return [run(i) for i in range(len(txobj.ins))]
+
+    results, checks, owners = [], [], []
+    for i in range(len(txobj.ins)):
+        deferred = []
+        results.append(run(i, deferred))
+        checks.extend(deferred)
+        owners.extend([i] * len(deferred))
+    rerun = set(r.index for r in results if not r.valid)
+    for i, ok in zip(owners, verifier(checks) if checks else []):
+        if not ok:
+            rerun.add(i)
+    for i in sorted(rerun):
+        results[i] = run(i)
+    return results
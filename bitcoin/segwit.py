@@ -5,11 +5,17 @@ import struct
 from bitcoin import changebase, is_python2, privkey_to_pubkey, pubkey_to_address, ecdsa_raw_sign, encode, \
     SIGHASH_ALL, SIGHASH_ANYONECANPAY, SIGHASH_SINGLE, SIGHASH_NONE, \
     deserialize, txhash, serialize, sign, mk_pubkey_script, der_encode_sig, serialize_script, \
-    deserialize_script, decode, ecdsa_raw_verify, der_decode_sig
+    deserialize_script, decode, ecdsa_raw_verify, der_decode_sig, PrivateKey, Transaction, \
+    num_to_var_int, bin_dbl_sha256
 
 
 def get_hashcode_strategy(hashcode):
-    return _STRATEGIES[hashcode]
+    # Every hash type is valid: the low five bits select NONE or SINGLE,
+    # any other value signs like ALL, and 0x80 adds ANYONECANPAY
+    base = hashcode & 0x1f
+    if base not in (SIGHASH_NONE, SIGHASH_SINGLE):
+        base = SIGHASH_ALL
+    return _STRATEGIES[base | (hashcode & SIGHASH_ANYONECANPAY)]
 
 
 class HashcodeStrategy():
@@ -81,49 +87,83 @@ _STRATEGIES = {
 
 
 def is_segwit(tx, hashcode=None):
+    if isinstance(tx, Transaction):
+        tx = tx.serialize('bin')
     if isinstance(tx, str) and re.match('^[0-9a-fA-F]*$', tx):
         tx = changebase(tx, 16, 256)
     return tx[4:6] == b'\x00\x01'
 
 
-def segwit_signature_form(tx, i, script, amount, hashcode=SIGHASH_ALL):
-    d = deserialize(tx)
-
-    def parse_vout(o):
-        return b''.join([struct.pack('<Q', o['value']),
-                         struct.pack('B', len(o['script']) // 2),
-                         binascii.unhexlify(o['script'])])
-    def parse_vin(inp):
-        return b''.join([binascii.unhexlify(inp['outpoint']['hash'])[::-1],
-                         struct.pack('<I', (inp['outpoint']['index']))])
-
-    vin_outpoint = [binascii.unhexlify(d['ins'][i]['outpoint']['hash'])[::-1],
-                    struct.pack('<I', (d['ins'][i]['outpoint']['index']))]
-    hashcode_strategy = get_hashcode_strategy(hashcode)
-    outpoints = [parse_vin(inp) for inp in hashcode_strategy.get_inputs_for_sequences(d, i)]
-    sequences = hashcode_strategy.get_sequences(d, i)
-    outputs_to_sign = hashcode_strategy.get_outputs(d, i)
-    outputs = [parse_vout(out) for out in outputs_to_sign]
-
-    hash_outputs = hashlib.sha256(hashlib.sha256(b''.join(outputs)).digest()).digest() if outputs_to_sign else b'\x00'*32
-    hash_sequences = hashlib.sha256(hashlib.sha256(b''.join(sequences)).digest()).digest() if sequences else b'\x00'*32
-    hash_outpoints = hashlib.sha256(hashlib.sha256(b''.join(outpoints)).digest()).digest() if outpoints else b'\x00'*32
-
-    preimage = [struct.pack('<I', d['version']),
-                hash_outpoints,
-                hash_sequences,
-                b''.join(vin_outpoint),
-                struct.pack('B', len(script) // 2),
-                binascii.unhexlify(script),
-                struct.pack('<Q', amount),
-                struct.pack('<I', d['ins'][i]['sequence']),
-                hash_outputs,
-                struct.pack('<I', d['locktime']),
-                struct.pack('<I', hashcode)]
-    return binascii.hexlify(b''.join(preimage)).decode('ascii')
+class BIP143Context(object):
+    """BIP143 signature hashes of the inputs of one transaction.
+    hashPrevouts and hashSequence are computed once per hash type strategy,
+    as is hashOutputs when a strategy signs all outputs, so each input's
+    digest takes a constant amount of extra hashing."""
+
+    def __init__(self, tx):
+        if not isinstance(tx, Transaction):
+            tx = Transaction(tx)
+        self.tx = tx
+        self._txobj = tx.to_dict('bin')
+        self._version = struct.pack('<I', tx.version)
+        self._locktime = struct.pack('<I', tx.locktime)
+        self._hashes = {}
+
+    def _hash(self, strategy, name, i):
+        key = (strategy, name)
+        try:
+            return self._hashes[key]
+        except KeyError:
+            pass
+        d = self._txobj
+        if name == 'prevouts':
+            items = [inp['outpoint']['hash'][::-1] + struct.pack('<I', inp['outpoint']['index'])
+                     for inp in strategy.get_inputs_for_sequences(d, i)]
+        elif name == 'sequences':
+            items = strategy.get_sequences(d, i)
+        else:
+            outs = strategy.get_outputs(d, i)
+            items = [struct.pack('<Q', o['value']) + num_to_var_int(len(o['script'])) + o['script']
+                     for o in outs]
+            if outs is not d['outs']:
+                # Depends on the input
+                key = None
+        h = bin_dbl_sha256(b''.join(items)) if items else b'\x00' * 32
+        if key is not None:
+            self._hashes[key] = h
+        return h
+
+    def preimage(self, i, script, amount, hashcode=SIGHASH_ALL):
+        i, hashcode = int(i), int(hashcode)
+        if isinstance(script, str) and re.match('^[0-9a-fA-F]*$', script):
+            script = binascii.unhexlify(script)
+        strategy = get_hashcode_strategy(hashcode)
+        inp = self.tx.ins[i]
+        return b''.join([self._version,
+                         self._hash(strategy, 'prevouts', i),
+                         self._hash(strategy, 'sequences', i),
+                         inp.hash[::-1],
+                         struct.pack('<I', inp.index),
+                         num_to_var_int(len(script)),
+                         script,
+                         struct.pack('<Q', amount),
+                         struct.pack('<I', inp.sequence),
+                         self._hash(strategy, 'outputs', i),
+                         self._locktime,
+                         struct.pack('<I', hashcode)])
+
+    def digest(self, i, script, amount, hashcode=SIGHASH_ALL):
+        return bin_dbl_sha256(self.preimage(i, script, amount, hashcode))
+
+
+def segwit_signature_form(tx, i, script, amount, hashcode=SIGHASH_ALL, context=None):
+    context = context or BIP143Context(tx)
+    return binascii.hexlify(context.preimage(i, script, amount, hashcode)).decode('ascii')
 
 
 def segwit_txhash(tx):
+    if isinstance(tx, Transaction):
+        return {'hash': tx.wtxid(), 'txid': tx.txid()}
     if isinstance(tx, str) and re.match('^[0-9a-fA-F]*$', tx):
         tx = changebase(tx, 16, 256)
     tx_hash = txhash(tx)
@@ -133,6 +173,8 @@ def segwit_txhash(tx):
 
 
 def strip_witness_data(tx):
+    if isinstance(tx, Transaction):
+        return tx.legacy_serialize()
     tx = deserialize(tx)
     tx.pop('segwit', '')
     for inp in tx['ins']:
@@ -140,21 +182,29 @@ def strip_witness_data(tx):
     return serialize(tx)
 
 
-def segwit_sign(tx, i, priv, amount, hashcode=SIGHASH_ALL, script=None, separator_index=None):
+def segwit_sign(tx, i, priv, amount, hashcode=SIGHASH_ALL, script=None, separator_index=None,
+                context=None):
     i = int(i)
-    txobj = tx if isinstance(tx, dict) else deserialize(tx)
-    if not isinstance(tx, dict) and ((not is_python2 and isinstance(re, bytes)) or not re.match('^[0-9a-fA-F]*$', tx)):
+    txobj = tx if isinstance(tx, (dict, Transaction)) else deserialize(tx)
+    if not isinstance(tx, (dict, Transaction)) and ((not is_python2 and isinstance(re, bytes)) or not re.match('^[0-9a-fA-F]*$', tx)):
         return binascii.unhexlify(sign(binascii.hexlify(tx), i, priv))
-    if len(priv) <= 33:
-        priv = binascii.hexlify(priv)
-    pub = privkey_to_pubkey(priv)
+    if isinstance(priv, PrivateKey):
+        pub = priv.public_key().encode()
+    else:
+        if len(priv) <= 33:
+            priv = binascii.hexlify(priv)
+        pub = privkey_to_pubkey(priv)
     address = pubkey_to_address(pub)
     wscript = mk_pubkey_script(address) if not script else script
     stripped_script = segwit_strip_script_separator(wscript, separator_index)
-    signing_tx = segwit_signature_form(tx, i, stripped_script, amount, hashcode=hashcode)
-    rawsig = ecdsa_raw_sign(hashlib.sha256(hashlib.sha256(binascii.unhexlify(signing_tx)).digest()).hexdigest(), priv)
+    context = context or BIP143Context(txobj)
+    rawsig = ecdsa_raw_sign(context.digest(i, stripped_script, amount, hashcode), priv)
     sig = der_encode_sig(*rawsig)+encode(hashcode, 16, 2)
-    txobj['ins'][i]['txinwitness'] = [sig, pub if not script else script]
+    witness = [sig, pub if not script else script]
+    if isinstance(txobj, Transaction):
+        txobj.ins[i].witness = [binascii.unhexlify(x) for x in witness]
+    else:
+        txobj['ins'][i]['txinwitness'] = witness
     return serialize(txobj)
 
 
@@ -211,17 +261,16 @@ def segwit_strip_script_separator(script, index=0):
     return serialize_script(deserialized_script[pos:])
 
 
-def segwit_multisign(tx, i, script, pk, amount, hashcode=SIGHASH_ALL, separator_index=None):
+def segwit_multisign(tx, i, script, pk, amount, hashcode=SIGHASH_ALL, separator_index=None,
+                     context=None):
     wscript = segwit_strip_script_separator(script, index=separator_index)
-    signing_tx = segwit_signature_form(tx, i, wscript, amount, hashcode=hashcode)
-    rawsig = ecdsa_raw_sign(hashlib.sha256(hashlib.sha256(
-        binascii.unhexlify(signing_tx)).digest()).hexdigest(), pk)
+    context = context or BIP143Context(tx)
+    rawsig = ecdsa_raw_sign(context.digest(i, wscript, amount, hashcode), pk)
     sig = der_encode_sig(*rawsig)+encode(hashcode, 16, 2)
     return sig
 
 
-def segwit_verify_tx_input(tx, i, script, sig, pub, amount):
+def segwit_verify_tx_input(tx, i, script, sig, pub, amount, context=None):
     hashcode = decode(sig[-2:], 16)
-    signing_tx = segwit_signature_form(tx, int(i), script, amount, hashcode=hashcode)
-    hashed_signing_tx = hashlib.sha256(hashlib.sha256(binascii.unhexlify(signing_tx)).digest()).hexdigest()
-    return ecdsa_raw_verify(hashed_signing_tx, der_decode_sig(sig), pub)
+    context = context or BIP143Context(tx)
+    return ecdsa_raw_verify(context.digest(i, script, amount, hashcode), der_decode_sig(sig), pub)
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+import binascii
+import hashlib
+
+from bitcoin.main import *
+from bitcoin.transaction import Transaction, LegacySighashContext, ecdsa_digest_sign, \
+    serialize, serialize_script, deserialize_script, classify_script
+from bitcoin.segwit import BIP143Context
+
+# Bulk transaction signing
+#
+# sign_transaction signs every input of a transaction in three steps: the
+# transaction is parsed once and every input's signature hash is computed
+# up front (sharing one legacy and one BIP143 context), the ECDSA
+# signatures are computed, optionally on a pool of workers, and the
+# scriptSigs and witnesses are written to the transaction, which is
+# serialized once at the end.
+#
+# The type of each input comes from the script of the output it spends:
+#
+#   P2PK         21<pubkey>ac / 41<pubkey>ac    scriptSig <sig>
+#   P2PKH        76a914<hash160>88ac           scriptSig <sig> <pubkey>
+#   P2WPKH       0014<hash160>                 witness <sig> <pubkey>
+#   P2SH-P2WPKH  a914<hash160>87               as P2WPKH, plus the redeem script
+#   P2SH-P2WSH   a914<hash160>87               witness '' <sigs...> <witness script>,
+#                                              with 'witness_script' in the prevout
+
+
+def _prevout_key(inp):
+    return "%s:%d" % (safe_hexlify(inp.hash), inp.index)
+
+
+def lookup_input(table, inp, i):
+    """The entry of table for input inp, the i-th input: table is a list
+    in input order, a dict keyed by 'txid:index', or a single value (such
+    as one prevout dict) used for every input"""
+    if isinstance(table, list):
+        return table[i]
+    if isinstance(table, dict) and not ('script' in table and 'value' in table):
+        return table[_prevout_key(inp)]
+    return table
+
+
+def _sign_job(job):
+    digest, priv, hashcode = job
+    return ecdsa_digest_sign(digest, priv, hashcode)
+
+
+def _map(executor, workers, jobs):
+    if executor is None or executor == 'serial':
+        return list(map(_sign_job, jobs))
+    if hasattr(executor, 'map'):
+        return list(executor.map(_sign_job, jobs))
+    import concurrent.futures
+    if executor == 'thread':
+        pool = concurrent.futures.ThreadPoolExecutor(workers or 4)
+    elif executor == 'process':
+        pool = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        raise ValueError("Unknown executor: %r" % executor)
+    with pool:
+        # Batches of jobs per task, to keep the pickling overhead down
+        chunksize = max(1, len(jobs) // (4 * (workers or 4)))
+        return list(pool.map(_sign_job, jobs, chunksize=chunksize))
+
+
+def sign_transaction(tx, keymap, prevouts, hashcode=SIGHASH_ALL, executor=None, workers=None):
+    """Sign all inputs of tx and return it serialized.
+
+    keymap gives the private key(s) of each input and prevouts the output
+    it spends, a dict with 'script' (hex) and 'value', plus
+    'witness_script' for P2SH-P2WSH. Both are lists in input order, dicts
+    keyed by 'txid:index', or a single value used for every input; a
+    P2SH-P2WSH input takes a list of keys.
+
+    executor is None (sign in this thread), 'thread' or 'process' (a
+    concurrent.futures pool of the given number of workers) or an object
+    with a map method, such as an existing pool. The signing is pure
+    Python, so only processes sign in parallel.
+
+    A Transaction is signed in place, as sign does."""
+    txobj = tx if isinstance(tx, Transaction) else Transaction(tx)
+    keys = {}
+
+    def private_key(k):
+        if isinstance(k, PrivateKey):
+            return k
+        if k not in keys:
+            keys[k] = PrivateKey(safe_hexlify(k) if len(k) <= 33 else k)
+        return keys[k]
+
+    # (kind, script code, redeem script, [(pubkey, job index)...]) per input
+    plans, jobs = [], []
+    contexts = {}
+
+    def context(kind):
+        if kind not in contexts:
+            contexts[kind] = (LegacySighashContext if kind == 'legacy' else BIP143Context)(txobj)
+        return contexts[kind]
+
+    for i, inp in enumerate(txobj.ins):
+        prevout = lookup_input(prevouts, inp, i)
+        script = binascii.unhexlify(prevout['script'])
+        privs = lookup_input(keymap, inp, i)
+        privs = [private_key(k) for k in (privs if isinstance(privs, list) else [privs])]
+        kind = classify_script(script)
+        if kind in ('p2pk', 'p2pkh'):
+            script_code = script
+        elif kind == 'p2wpkh':
+            script_code = b'\x76\xa9\x14' + script[2:] + b'\x88\xac'
+        elif kind == 'p2sh':
+            if prevout.get('witness_script'):
+                kind = 'p2sh-p2wsh'
+                script_code = binascii.unhexlify(prevout['witness_script'])
+                redeem = b'\x00\x20' + hashlib.sha256(script_code).digest()
+            else:
+                kind = 'p2sh-p2wpkh'
+                pkh = privs[0].public_key().bin_hash160()
+                script_code = b'\x76\xa9\x14' + pkh + b'\x88\xac'
+                redeem = b'\x00\x14' + pkh
+            if bin_hash160(redeem) != script[2:22]:
+                raise Exception("Redeem script does not match the prevout of input %d" % i)
+        else:
+            raise Exception("Unsupported prevout script for input %d" % i)
+        pubs = [priv.public_key().encode('bin_compressed' if priv.compressed else 'bin')
+                for priv in privs]
+        if kind in ('p2pkh', 'p2wpkh', 'p2sh-p2wpkh') and \
+                privs[0].public_key().bin_hash160() != script_code[3:23]:
+            raise Exception("Key does not match the prevout of input %d" % i)
+        if kind == 'p2pk' and pubs[0] != deserialize_script(script)[0]:
+            raise Exception("Key does not match the prevout of input %d" % i)
+        if kind == 'p2sh-p2wsh':
+            # Signatures go in the order of the keys in the witness script
+            script_keys = [t for t in deserialize_script(script_code) if isinstance(t, bytes)]
+            for pub in pubs:
+                if pub not in script_keys:
+                    raise Exception("Key is not in the witness script of input %d" % i)
+            privs, pubs = zip(*sorted(zip(privs, pubs), key=lambda p: script_keys.index(p[1])))
+        if kind in ('p2pk', 'p2pkh'):
+            digest = context('legacy').digest(i, script_code, hashcode)
+        else:
+            digest = context('bip143').digest(i, script_code, prevout['value'], hashcode)
+        signers = []
+        for priv, pub in zip(privs, pubs):
+            signers.append((pub, len(jobs)))
+            jobs.append((digest, priv.encode(), hashcode))
+        plans.append((kind, script_code, redeem if kind.startswith('p2sh') else None, signers))
+
+    sigs = [binascii.unhexlify(sig) for sig in _map(executor, workers, jobs)]
+    for inp, (kind, script_code, redeem, signers) in zip(txobj.ins, plans):
+        pub, job = signers[0]
+        if kind == 'p2pk':
+            inp.script = serialize_script([sigs[job]])
+        elif kind == 'p2pkh':
+            inp.script = serialize_script([sigs[job], pub])
+        elif kind == 'p2sh-p2wsh':
+            inp.witness = [b''] + [sigs[j] for _, j in signers] + [script_code]
+        else:
+            inp.witness = [sigs[job], pub]
+        if redeem is not None:
+            inp.script = serialize_script([redeem])
+    return serialize(txobj)
@@ -2,6 +2,7 @@
 from _functools import reduce
 
 import copy
+import struct
 from bitcoin.main import *
 ### Hex to bin converter and vice versa for objects
 
@@ -40,130 +41,448 @@ def json_changebase(obj, changer):
     return dict((x, json_changebase(obj[x], changer)) for x in obj)
 
 # Transaction serialization and deserialization
+#
+# Both directions work on one buffer: deserialize reads fixed-size fields
+# with struct.unpack_from at an offset into a memoryview, and serialize
+# sizes the transaction first and packs it into a single bytearray. The
+# format (hex or binary) is given by formt, or by the type of the input:
+# text is hex, bytes are binary.
 
-def deserialize(tx):
-    if is_hexilified(tx):
-        #tx = bytes(bytearray.fromhex(tx))
-        return json_changebase(deserialize(binascii.unhexlify(tx)),
-                              lambda x: safe_hexlify(x))
-    # http://stackoverflow.com/questions/4851463/python-closure-write-to-variable-in-parent-scope
-    # Python's scoping rules are demented, requiring me to make pos an object
-    # so that it is call-by-reference
-    pos = [0]
+_VAR_INT_FORMATS = {253: '<H', 254: '<I', 255: '<Q'}
 
-    def read_as_int(bytez):
-        pos[0] += bytez
-        return decode(tx[pos[0]-bytez:pos[0]][::-1], 256)
 
-    def read_var_int():
-        pos[0] += 1
+def _is_hex_tx(tx):
+    if is_python2:
+        return bool(is_hexilified(tx))
+    return isinstance(tx, str)
 
-        val = from_byte_to_int(tx[pos[0]-1])
-        if val < 253:
-            return val
-        return read_as_int(pow(2, val - 252))
 
-    def read_bytes(bytez):
-        pos[0] += bytez
-        return tx[pos[0]-bytez:pos[0]]
+def _is_hex_txobj(txobj):
+    if is_python2:
+        return json_is_base(txobj, 16)
+    # The first string field decides; an object without any is hex
+    for inp in txobj["ins"]:
+        return _is_hex_tx(inp["outpoint"]["hash"])
+    for out in txobj["outs"]:
+        return _is_hex_tx(out["script"])
+    return True
 
-    def read_var_string():
-        size = read_var_int()
-        return read_bytes(size)
+
+def _read_var_int(buf, pos):
+    val = struct.unpack_from('<B', buf, pos)[0]
+    if val < 253:
+        return val, pos + 1
+    return struct.unpack_from(_VAR_INT_FORMATS[val], buf, pos + 1)[0], pos + 1 + (1 << (val - 252))
+
+
+def _deserialize(buf, pos, hexfields):
+    # Parse the transaction starting at buf[pos]; returns (txobj, end)
+    unpack_from = struct.unpack_from
+    read_var_int = _read_var_int
+    if hexfields:
+        field = lambda a, b: safe_hexlify(buf[a:b])
+        reverse = lambda a, b: safe_hexlify(buf[a:b].tobytes()[::-1])
+    else:
+        field = lambda a, b: buf[a:b].tobytes()
+        reverse = lambda a, b: buf[a:b].tobytes()[::-1]
 
     obj = {"ins": [], "outs": []}
-    obj["version"] = read_as_int(4)
-    ins = read_var_int()
+    obj["version"] = unpack_from('<I', buf, pos)[0]
+    ins, pos = read_var_int(buf, pos + 4)
 
     " begin segwit "
     segwit_flag = False
     if not ins:
-        segwit_flag = read_var_int()
-        ins = read_var_int()
+        segwit_flag, pos = read_var_int(buf, pos)
+        ins, pos = read_var_int(buf, pos)
     " end segwit "
 
     for i in range(ins):
+        index = unpack_from('<I', buf, pos + 32)[0]
+        size, start = read_var_int(buf, pos + 36)
+        end = start + size
         obj["ins"].append({
             "outpoint": {
-                "hash": read_bytes(32)[::-1],
-                "index": read_as_int(4)
+                "hash": reverse(pos, pos + 32),
+                "index": index
             },
-            "script": read_var_string(),
-            "sequence": read_as_int(4)
+            "script": field(start, end),
+            "sequence": unpack_from('<I', buf, end)[0]
         })
-    outs = read_var_int()
+        pos = end + 4
+    outs, pos = read_var_int(buf, pos)
     for i in range(outs):
+        value = unpack_from('<Q', buf, pos)[0]
+        size, start = read_var_int(buf, pos + 8)
+        pos = start + size
         obj["outs"].append({
-            "value": read_as_int(8),
-            "script": read_var_string()
+            "value": value,
+            "script": field(start, pos)
         })
     if segwit_flag:
         obj["segwit"] = True
         for i in range(ins):
-            howmany = read_var_int()
+            howmany, pos = read_var_int(buf, pos)
             if howmany:
-                obj['ins'][i]['txinwitness'] = [read_var_string() for x in range(0, howmany)]
-
-    obj["locktime"] = read_as_int(4)
-    return obj
-
-
-def serialize(txobj):
-    SEGWIT_MARKER = b'\x00'
-    SEGWIT_FLAG = b'\x01'
-    o = []
-    if json_is_base(txobj, 16):
-        json_changedbase = json_changebase(txobj, lambda x: binascii.unhexlify(x))
-        return str(binascii.hexlify(serialize(json_changedbase)).decode())
-    o.append(encode(txobj["version"], 256, 4)[::-1])
+                witness = []
+                for x in range(howmany):
+                    size, start = read_var_int(buf, pos)
+                    pos = start + size
+                    witness.append(field(start, pos))
+                obj['ins'][i]['txinwitness'] = witness
+
+    obj["locktime"] = unpack_from('<I', buf, pos)[0]
+    return obj, pos + 4
+
+
+def _tx_extent(buf, pos):
+    # (end, witness) of the transaction starting at buf[pos], found without
+    # parsing it; witness is the offset of its witness data, or None
+    read_var_int = _read_var_int
+    ins, pos = read_var_int(buf, pos + 4)
+    witness = None
+    if not ins:
+        ins, pos = read_var_int(buf, pos + 1)
+        witness = True
+    for i in range(ins):
+        size, pos = read_var_int(buf, pos + 36)
+        pos += size + 4
+    outs, pos = read_var_int(buf, pos)
+    for i in range(outs):
+        size, pos = read_var_int(buf, pos + 8)
+        pos += size
+    if witness:
+        witness = pos
+        for i in range(ins):
+            items, pos = read_var_int(buf, pos)
+            for x in range(items):
+                size, pos = read_var_int(buf, pos)
+                pos += size
+    return pos + 4, witness
+
+
+def deserialize(tx, formt=None):
+    """Parse a serialized transaction into a dict. formt is 'hex' or 'bin';
+    by default hex strings give hex fields and bytes give bytes fields."""
+    if isinstance(tx, Transaction):
+        return tx.to_dict(formt)
+    if formt is None:
+        formt = 'hex' if _is_hex_tx(tx) else 'bin'
+    if formt == 'hex':
+        tx = binascii.unhexlify(tx)
+    return _deserialize(memoryview(tx), 0, formt == 'hex')[0]
+
+
+def _var_int_size(x):
+    if x < 253: return 1
+    elif x < 65536: return 3
+    elif x < 4294967296: return 5
+    else: return 9
+
+
+def _pack_var_int(buf, pos, x):
+    if x < 253:
+        buf[pos] = x
+        return pos + 1
+    elif x < 65536:
+        buf[pos] = 253
+        struct.pack_into('<H', buf, pos + 1, x)
+        return pos + 3
+    elif x < 4294967296:
+        buf[pos] = 254
+        struct.pack_into('<I', buf, pos + 1, x)
+        return pos + 5
+    buf[pos] = 255
+    struct.pack_into('<Q', buf, pos + 1, x)
+    return pos + 9
+
+
+def _serialize(txobj, hexfields):
+    # Pack txobj into a bytearray sized up front. With hexfields, the
+    # string fields are hex and are decoded as they are written.
+    if hexfields:
+        conv, length = binascii.unhexlify, lambda x: len(x) // 2
+    else:
+        conv, length = (lambda x: x), len
+    var_int_size, pack_var_int = _var_int_size, _pack_var_int
+    pack_into = struct.pack_into
+    ins, outs = txobj["ins"], txobj["outs"]
 
     " begin segwit "
     segwit = txobj.get('segwit', False)
+    for inp in ins:
+        if segwit:
+            break
+        segwit = inp.get("txinwitness") is not None
     " end segwit "
 
-    o.append(num_to_var_int(len(txobj["ins"])))
-    for inp in txobj["ins"]:
-        inp['script'] = inp.get('script', '')
-        " begin segwit "
-        segwit = bool(inp.get("txinwitness") != None) if not segwit else segwit
-        " end segwit "
-        o.append(inp["outpoint"]["hash"][::-1])
-        o.append(encode(inp["outpoint"]["index"], 256, 4)[::-1])
-        out_len = num_to_var_int(len(inp["script"]))
-        script = inp['script'] if inp.get('script') else b''
-        o.append(out_len + script)
-        o.append(encode(inp.get('sequence', 4294967295), 256, 4)[::-1])
-    o.append(num_to_var_int(len(txobj["outs"])))
-    for out in txobj["outs"]:
-        out['script'] = out['script']
-        o.append(encode(out["value"], 256, 8)[::-1])
-        o.append(num_to_var_int(len(out["script"]))+out["script"])
+    size = 8 + var_int_size(len(ins)) + var_int_size(len(outs))
+    for inp in ins:
+        n = length(inp.get("script") or b'')
+        size += length(inp["outpoint"]["hash"]) + 8 + var_int_size(n) + n
+    for out in outs:
+        n = length(out["script"])
+        size += 8 + var_int_size(n) + n
+    if segwit:
+        size += 2
+        for inp in ins:
+            witness = inp.get('txinwitness')
+            if not isinstance(witness, list):
+                size += 1
+            elif not witness:
+                size += 3
+            else:
+                size += var_int_size(len(witness))
+                for item in witness:
+                    n = length(item)
+                    size += var_int_size(n) + n
+
+    buf = bytearray(size)
+    pack_into('<I', buf, 0, txobj["version"])
+    pos = 4
+    if segwit:
+        buf[4:6] = b'\x00\x01'
+        pos = 6
+    pos = pack_var_int(buf, pos, len(ins))
+    for inp in ins:
+        h = conv(inp["outpoint"]["hash"])[::-1]
+        buf[pos:pos + len(h)] = h
+        pos += len(h)
+        pack_into('<I', buf, pos, inp["outpoint"]["index"])
+        script = conv(inp.get("script") or b'')
+        pos = pack_var_int(buf, pos + 4, len(script))
+        buf[pos:pos + len(script)] = script
+        pos += len(script)
+        pack_into('<I', buf, pos, inp.get('sequence', 4294967295))
+        pos += 4
+    pos = pack_var_int(buf, pos, len(outs))
+    for out in outs:
+        pack_into('<Q', buf, pos, out["value"])
+        script = conv(out["script"])
+        pos = pack_var_int(buf, pos + 8, len(script))
+        buf[pos:pos + len(script)] = script
+        pos += len(script)
 
     " begin segwit "
     if segwit:
-        o.insert(1, SEGWIT_MARKER + SEGWIT_FLAG)
-        for inp in txobj["ins"]:
-            if not isinstance(inp.get('txinwitness', None), list):
-                o.append(num_to_var_int(0))
+        for inp in ins:
+            witness = inp.get('txinwitness')
+            if not isinstance(witness, list):
+                pos = pack_var_int(buf, pos, 0)
+            elif not witness:
+                # An empty list is written as two empty items
+                buf[pos:pos + 3] = b'\x02\x00\x00'
+                pos += 3
             else:
-                if len(inp.get('txinwitness')):
-                    o.append(num_to_var_int(len(inp.get('txinwitness'))))
-                    for i in inp.get('txinwitness'):
-                        o.append(num_to_var_int(len(i)))
-                        if i:
-                            o.append(i)
-                else:
-                    o.append(num_to_var_int(2))
-                    o.append(num_to_var_int(0) * 2)
-
+                pos = pack_var_int(buf, pos, len(witness))
+                for item in witness:
+                    item = conv(item)
+                    pos = pack_var_int(buf, pos, len(item))
+                    buf[pos:pos + len(item)] = item
+                    pos += len(item)
     " end segwit "
 
-    o.append(encode(txobj["locktime"], 256, 4)[::-1])
-    return b''.join(o)
+    pack_into('<I', buf, pos, txobj["locktime"])
+    return buf
+
+
+def serialize(txobj, formt=None):
+    """Serialize a transaction dict. formt is 'hex' or 'bin', the format of
+    its string fields, which is also the format of the result; by default it
+    follows the type of those fields."""
+    if isinstance(txobj, Transaction):
+        return txobj.serialize(formt)
+    if formt is None:
+        formt = 'hex' if _is_hex_txobj(txobj) else 'bin'
+    if formt == 'hex':
+        return safe_hexlify(_serialize(txobj, True))
+    for inp in txobj["ins"]:
+        inp['script'] = inp.get('script', '')
+    return bytes(_serialize(txobj, False))
+
+
+# Transaction objects
+#
+# A Transaction is parsed once and keeps its fields in binary form. Its
+# serializations and hashes are memoized until a field changes: setting an
+# attribute of the transaction or of one of its inputs or outputs clears
+# the cache, and so does adding, removing or replacing items of ins/outs.
+# Witnesses are kept as tuples, so they too change only by assignment.
+# The functions of this module accept a Transaction wherever they take a
+# serialized or deserialized transaction.
+
+
+class TxIn(object):
+    __slots__ = ('hash', 'index', 'script', 'sequence', 'witness', '_owner')
+
+    def __init__(self, hash, index, script=b'', sequence=4294967295, witness=None):
+        object.__setattr__(self, '_owner', None)
+        self.hash = hash
+        self.index = index
+        self.script = script
+        self.sequence = sequence
+        self.witness = witness
+
+    def __setattr__(self, name, value):
+        if name == 'witness' and isinstance(value, list):
+            value = tuple(value)
+        object.__setattr__(self, name, value)
+        if self._owner is not None:
+            self._owner._cache.clear()
+
+    def __repr__(self):
+        return 'TxIn(%s:%d)' % (safe_hexlify(self.hash), self.index)
+
+
+class TxOut(object):
+    __slots__ = ('value', 'script', '_owner')
+
+    def __init__(self, value, script):
+        object.__setattr__(self, '_owner', None)
+        self.value = value
+        self.script = script
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if self._owner is not None:
+            self._owner._cache.clear()
+
+    def __repr__(self):
+        return 'TxOut(%d)' % self.value
+
+
+class Transaction(object):
+    __slots__ = ('version', 'ins', 'outs', 'locktime', 'segwit', 'formt',
+                 '_cache', '_members')
+
+    def __init__(self, tx=None, formt=None):
+        object.__setattr__(self, '_cache', {})
+        object.__setattr__(self, '_members', None)
+        conv = lambda x: x
+        if tx is None:
+            tx = {"ins": [], "outs": [], "version": 1, "locktime": 0}
+            formt = formt or 'hex'
+        elif not isinstance(tx, dict):
+            if formt is None:
+                formt = 'hex' if _is_hex_tx(tx) else 'bin'
+            if formt == 'hex':
+                tx = binascii.unhexlify(tx)
+            tx = _deserialize(memoryview(tx), 0, False)[0]
+        else:
+            if formt is None:
+                formt = 'hex' if _is_hex_txobj(tx) else 'bin'
+            if formt == 'hex':
+                conv = binascii.unhexlify
+        self.formt = formt
+        self.version = tx["version"]
+        self.locktime = tx["locktime"]
+        self.segwit = tx.get('segwit', False)
+        self.ins = [TxIn(conv(inp["outpoint"]["hash"]), inp["outpoint"]["index"],
+                         conv(inp.get("script") or b''),
+                         inp.get("sequence", 4294967295),
+                         _witness_from(inp.get("txinwitness"), conv))
+                    for inp in tx["ins"]]
+        self.outs = [TxOut(out["value"], conv(out["script"])) for out in tx["outs"]]
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name != 'formt':
+            self._cache.clear()
+
+    def _cached(self):
+        # The cache for the current ins and outs; rebuilt when their items
+        # have been changed since it was filled
+        members = (tuple(self.ins), tuple(self.outs))
+        if members != self._members:
+            for item in members[0] + members[1]:
+                object.__setattr__(item, '_owner', self)
+            object.__setattr__(self, '_members', members)
+            self._cache.clear()
+        return self._cache
+
+    def to_dict(self, formt=None):
+        """The transaction as deserialize would return it"""
+        formt = formt or self.formt
+        conv = safe_hexlify if formt == 'hex' else (lambda x: x)
+        obj = {"ins": [], "outs": [], "version": self.version}
+        for inp in self.ins:
+            d = {
+                "outpoint": {"hash": conv(inp.hash), "index": inp.index},
+                "script": conv(inp.script),
+                "sequence": inp.sequence
+            }
+            if inp.witness is not None:
+                d['txinwitness'] = _witness_from(inp.witness, conv)
+            obj["ins"].append(d)
+        for out in self.outs:
+            obj["outs"].append({"value": out.value, "script": conv(out.script)})
+        if self.segwit:
+            obj["segwit"] = True
+        obj["locktime"] = self.locktime
+        return obj
+
+    def _raw(self, witness):
+        cache = self._cached()
+        key = 'raw' if witness else 'legacy_raw'
+        try:
+            return cache[key]
+        except KeyError:
+            obj = self.to_dict('bin')
+            if not witness:
+                obj.pop('segwit', None)
+                for inp in obj["ins"]:
+                    inp.pop('txinwitness', None)
+            raw = cache[key] = bytes(_serialize(obj, False))
+            return raw
+
+    def _memo(self, key, fn):
+        cache = self._cached()
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = fn()
+            return value
+
+    def serialize(self, formt=None):
+        """The serialized transaction, witness data included"""
+        if (formt or self.formt) == 'hex':
+            return self._memo('hex', lambda: safe_hexlify(self._raw(True)))
+        return self._raw(True)
+
+    def legacy_serialize(self, formt=None):
+        """The serialized transaction without witness data"""
+        if (formt or self.formt) == 'hex':
+            return self._memo('legacy_hex', lambda: safe_hexlify(self._raw(False)))
+        return self._raw(False)
+
+    def txid(self):
+        return self._memo('txid', lambda: safe_hexlify(bin_dbl_sha256(self._raw(False))[::-1]))
+
+    def wtxid(self):
+        return self._memo('wtxid', lambda: safe_hexlify(bin_dbl_sha256(self._raw(True))[::-1]))
+
+    def weight(self):
+        return 3 * len(self._raw(False)) + len(self._raw(True))
+
+    def vsize(self):
+        return (self.weight() + 3) // 4
+
+    def __repr__(self):
+        return 'Transaction(%s)' % self.txid()
+
+
+def _witness_from(witness, conv):
+    # Convert the items of a witness list or tuple into a list; None and
+    # other values (which serialize as no witness items) are kept as they are
+    if isinstance(witness, (list, tuple)):
+        return [conv(item) for item in witness]
+    return witness
 
 
 def signature_form(tx, i, script, hashcode=SIGHASH_ALL):
     i, hashcode = int(i), int(hashcode)
+    if isinstance(tx, Transaction):
+        tx = tx.serialize()
     if isinstance(tx, string_or_bytes_types):
         sform = signature_form(deserialize(tx), i, script, hashcode)
         return serialize(sform)
@@ -187,6 +506,80 @@ def signature_form(tx, i, script, hashcode=SIGHASH_ALL):
     return newtx
 
 
+# Legacy (pre-segwit) signature hashes
+#
+# signature_form builds a modified copy of the whole transaction for every
+# input. LegacySighashContext serializes the parts shared by all inputs once
+# (the inputs with blank scripts, the outputs) and, for each input, feeds
+# sha256 the shared parts around that input's script, so nothing but the
+# script is serialized per input. The digests follow the consensus rules:
+# SIGHASH_NONE and SIGHASH_SINGLE blank the other inputs' sequences,
+# SIGHASH_SINGLE keeps the outputs up to the input's own, and
+# SIGHASH_ANYONECANPAY combines with each of the other types. Witness data
+# is never part of a legacy signature hash.
+
+_NULL_OUTPUT = b'\xff' * 8 + b'\x00'
+# The hash signed for SIGHASH_SINGLE inputs without a matching output
+_SIGHASH_SINGLE_BUG = b'\x01' + b'\x00' * 31
+
+
+class LegacySighashContext(object):
+    __slots__ = ('tx', '_version', '_n_ins', '_outpoints', '_sequences', '_blank',
+                 '_blank_sequences', '_outputs', '_all_outputs', '_locktime')
+
+    def __init__(self, tx):
+        # The transaction is taken as it is now; the context does not follow
+        # later changes, except to input scripts, which it does not use
+        if not isinstance(tx, Transaction):
+            tx = Transaction(tx)
+        self.tx = tx
+        self._version = struct.pack('<I', tx.version)
+        self._n_ins = num_to_var_int(len(tx.ins))
+        self._outpoints = [inp.hash[::-1] + struct.pack('<I', inp.index) for inp in tx.ins]
+        self._sequences = [struct.pack('<I', inp.sequence) for inp in tx.ins]
+        # 41 bytes per input: outpoint, empty script, sequence (or zero)
+        self._blank = memoryview(b''.join(
+            o + b'\x00' + seq for o, seq in zip(self._outpoints, self._sequences)))
+        self._blank_sequences = memoryview(b''.join(
+            o + b'\x00' * 5 for o in self._outpoints))
+        self._outputs = [struct.pack('<Q', out.value) + num_to_var_int(len(out.script)) + out.script
+                         for out in tx.outs]
+        self._all_outputs = num_to_var_int(len(self._outputs)) + b''.join(self._outputs)
+        self._locktime = struct.pack('<I', tx.locktime)
+
+    def digest(self, i, script, hashcode=SIGHASH_ALL):
+        """The double-SHA256 hash signed by input i, with script (hex or
+        bytes) in place of its scriptSig"""
+        i, hashcode = int(i), int(hashcode)
+        if _is_hex_tx(script):
+            script = binascii.unhexlify(script)
+        base = hashcode & 0x1f
+        if base == SIGHASH_SINGLE and i >= len(self._outputs):
+            return _SIGHASH_SINGLE_BUG
+        h = hashlib.sha256(self._version)
+        this = self._outpoints[i] + num_to_var_int(len(script)) + script
+        if hashcode & SIGHASH_ANYONECANPAY:
+            h.update(b'\x01' + this + self._sequences[i])
+        else:
+            h.update(self._n_ins)
+            # NONE and SINGLE blank the sequences of the other inputs only
+            if base == SIGHASH_NONE or base == SIGHASH_SINGLE:
+                blank = self._blank_sequences
+            else:
+                blank = self._blank
+            h.update(blank[:41 * i])
+            h.update(this + self._sequences[i])
+            h.update(blank[41 * (i + 1):])
+        if base == SIGHASH_NONE:
+            h.update(b'\x00')
+        elif base == SIGHASH_SINGLE:
+            h.update(num_to_var_int(i + 1) + _NULL_OUTPUT * i + self._outputs[i])
+        else:
+            h.update(self._all_outputs)
+        h.update(self._locktime + struct.pack('<I', hashcode & 0xffffffff))
+        return hashlib.sha256(h.digest()).digest()
+
+
 # Making the actual signatures
 
 
@@ -198,53 +591,90 @@ def encode_num(n):
     else:
         return '00' + h
 
+# DER signatures
+#
+#   0x30 [total-len] 0x02 [R-len] [R] 0x02 [S-len] [S] [sighash]
+#
+# The codec works on bytes; der_encode_sig and der_decode_sig are hex
+# wrappers. parse_der_sig checks strict BIP66 encoding (and optionally
+# low S) while it parses, so a script check touches the signature once.
+
+
+def _der_int(x):
+    b = encode(x, 256)
+    # A leading 0x00 keeps the integer positive
+    return b'\x00' + b if b[:1] >= b'\x80' else b
+
+
+def bin_der_encode_sig(v, r, s):
+    r, s = _der_int(r), _der_int(s)
+    sig = bytearray([0x30, len(r) + len(s) + 4, 0x02, len(r)])
+    sig += r
+    sig += bytearray([0x02, len(s)])
+    sig += s
+    return bytes(sig)
+
+
 def der_encode_sig(v, r, s):
-    b1, b2 = safe_hexlify(encode(r, 256)), safe_hexlify(encode(s, 256))
-    if len(b1) and b1[0] in '89abcdef':
-        b1 = '00' + b1
-    if len(b2) and b2[0] in '89abcdef':
-        b2 = '00' + b2
-    left = '02'+encode(len(b1)//2, 16, 2)+b1
-    right = '02'+encode(len(b2)//2, 16, 2)+b2
-    return '30'+encode(len(left+right)//2, 16, 2)+left+right
+    return safe_hexlify(bin_der_encode_sig(v, r, s))
+
+
+def bin_der_decode_sig(sig):
+    rlen = from_byte_to_int(sig[3])
+    slen = from_byte_to_int(sig[5+rlen])
+    r, s = sig[4:4+rlen], sig[6+rlen:6+rlen+slen]
+    return (rlen, decode(r, 256), slen, decode(s, 256))
+
 
 def der_decode_sig(sig):
-    leftlenbytes = decode(sig[6:8], 16)
-    leftlen = leftlenbytes*2
-    left = sig[8:8+leftlen]
-    rightlenbytes = decode(sig[10+leftlen:12+leftlen], 16)
-    rightlen = rightlenbytes*2
-    right = sig[12+leftlen:12+leftlen+rightlen]
-    return (leftlenbytes, decode(left, 16), rightlenbytes, decode(right, 16))
+    if _is_hex_tx(sig):
+        sig = binascii.unhexlify(sig)
+    return bin_der_decode_sig(sig)
+
+
+def _is_der_int(b):
+    # Not empty, not negative and without excess leading zeros
+    return b[:1] < b'\x80' and b != b'' and \
+        not (b[:1] == b'\x00' and len(b) > 1 and b[1:2] < b'\x80')
+
+
+def parse_der_sig(sig, low_s=False):
+    """Parses a binary DER signature followed by its sighash byte.
+
+    Returns (r, s, hashcode), or None if the signature is not strictly
+    BIP66 encoded, or, with low_s, if s is above N/2."""
+    n = len(sig)
+    if n < 9 or n > 73:
+        return None
+    head, total, rmark, rlen = struct.unpack_from('4B', sig)
+    if head != 0x30 or total != n - 3 or rmark != 0x02 or 5 + rlen >= n:
+        return None
+    smark, slen = struct.unpack_from('2B', sig, 4 + rlen)
+    if smark != 0x02 or rlen + slen + 7 != n:
+        return None
+    r, s = sig[4:4+rlen], sig[6+rlen:n-1]
+    if not (_is_der_int(r) and _is_der_int(s)):
+        return None
+    s = decode(s, 256)
+    if low_s and s > N // 2:
+        return None
+    return decode(r, 256), s, from_byte_to_int(sig[-1])
+
 
 def is_bip66(sig):
     """Checks hex DER sig for BIP66 consistency"""
     #https://raw.githubusercontent.com/bitcoin/bips/master/bip-0066.mediawiki
-    #0x30  [total-len]  0x02  [R-len]  [R]  0x02  [S-len]  [S]  [sighash]
-    sig = bytearray.fromhex(sig) if re.match('^[0-9a-fA-F]*$', sig) else bytearray(sig)
-    if (sig[0] == 0x30) and (sig[1] == len(sig)-2):     # check if sighash is missing
-            sig.extend(b"\1")		                   	# add SIGHASH_ALL for testing
-    #assert (sig[-1] & 124 == 0) and (not not sig[-1]), "Bad SIGHASH value"
-
-    if len(sig) < 9 or len(sig) > 73: return False
-    if (sig[0] != 0x30): return False
-    if (sig[1] != len(sig)-3): return False
-    rlen = sig[3]
-    if (5+rlen >= len(sig)): return False
-    slen = sig[5+rlen]
-    if (rlen + slen + 7 != len(sig)): return False
-    if (sig[2] != 0x02): return False
-    if (rlen == 0): return False
-    if (sig[4] & 0x80): return False
-    if (rlen > 1 and (sig[4] == 0x00) and not (sig[5] & 0x80)): return False
-    if (sig[4+rlen] != 0x02): return False
-    if (slen == 0): return False
-    if (sig[rlen+6] & 0x80): return False
-    if (slen > 1 and (sig[6+rlen] == 0x00) and not (sig[7+rlen] & 0x80)):
-        return False
-    return True
+    if _is_hex_tx(sig):
+        sig = binascii.unhexlify(sig)
+    if sig[:1] == b'\x30' and len(sig) > 1 and from_byte_to_int(sig[1]) == len(sig) - 2:
+        sig += b'\x01'         # add SIGHASH_ALL for testing
+    return parse_der_sig(sig) is not None
 
 def txhash(tx, hashcode=None):
+    if isinstance(tx, Transaction):
+        if hashcode is None:
+            return tx.wtxid()
+        tx = tx.serialize('bin')
     if isinstance(tx, str) and re.match('^[0-9a-fA-F]*$', tx):
         tx = changebase(tx, 16, 256)
     if hashcode is not None:
@@ -266,6 +696,10 @@ def ecdsa_tx_verify(tx, sig, pub, hashcode=SIGHASH_ALL):
     return ecdsa_raw_verify(bin_txhash(tx, hashcode), der_decode_sig(sig), pub)
 
 
+def ecdsa_digest_sign(digest, priv, hashcode=SIGHASH_ALL):
+    return safe_hexlify(bin_der_encode_sig(*ecdsa_raw_sign(digest, priv)) + from_int_to_byte(hashcode))
+
+
 def ecdsa_tx_recover(tx, sig, hashcode=SIGHASH_ALL):
     z = bin_txhash(tx, hashcode)
     rlen, r, slen, s = der_decode_sig(sig)
@@ -297,11 +731,12 @@ def address_to_script(addr):
 
 
 def script_to_address(script, vbyte=0):
-    if re.match('^[0-9a-fA-F]*$', script):
+    if _is_hex_tx(script):
         script = binascii.unhexlify(script)
-    if script[:3] == b'\x76\xa9\x14' and script[-2:] == b'\x88\xac' and len(script) == 25:
+    kind = classify_script(script)
+    if kind == 'p2pkh':
         return bin_to_b58check(script[3:-2], vbyte)  # pubkey hash addresses
-    else:
+    elif kind == 'p2sh':
         if vbyte in [111, 196]:
             # Testnet
             scripthash_byte = 196
@@ -312,6 +747,7 @@ def script_to_address(script, vbyte=0):
             scripthash_byte = vbyte
         # BIP0016 scripthash addresses
         return bin_to_b58check(script[2:-1], scripthash_byte)
+    raise Exception("No base58 address for a %s script" % kind)
 
 
 def p2sh_scriptaddr(script, magicbyte=5):
@@ -321,33 +757,106 @@ def p2sh_scriptaddr(script, magicbyte=5):
 scriptaddr = p2sh_scriptaddr
 
 
+# Script parsing
+#
+# iter_script walks a script without copying it: each operation comes out
+# as (opcode, data), data being a memoryview of the pushed bytes (empty for
+# OP_0) or None for opcodes that push nothing. A push running past the end
+# of the script, or a PUSHDATA length that does, raises ValueError.
+# classify_script matches the standard output templates on fixed byte
+# positions.
+
+
+def iter_script(script):
+    if _is_hex_tx(script):
+        script = binascii.unhexlify(script)
+    buf = memoryview(script)
+    pos, end = 0, len(script)
+    while pos < end:
+        start, code = pos, from_byte_to_int(script[pos])
+        pos += 1
+        if code > 78:
+            yield code, None
+            continue
+        if code > 75:
+            szsz = 1 << (code - 76)
+            if pos + szsz > end:
+                raise ValueError("Truncated push at offset %d" % start)
+            size = decode(script[pos:pos+szsz][::-1], 256)
+            pos += szsz
+        else:
+            size = code
+        if pos + size > end:
+            raise ValueError("Truncated push at offset %d" % start)
+        yield code, buf[pos:pos+size]
+        pos += size
+
+
 def deserialize_script(script):
-    if isinstance(script, str) and re.match('^[0-9a-fA-F]*$', script):
-       return json_changebase(deserialize_script(binascii.unhexlify(script)),
-                              lambda x: safe_hexlify(x))
-    out, pos = [], 0
-    while pos < len(script):
-        code = from_byte_to_int(script[pos])
+    if _is_hex_tx(script):
+        return [safe_hexlify(t) if isinstance(t, bytes) else t
+                for t in deserialize_script(binascii.unhexlify(script))]
+    out = []
+    for code, data in iter_script(script):
         if code == 0:
             out.append(None)
-            pos += 1
-        elif code <= 75:
-            out.append(script[pos+1:pos+1+code])
-            pos += 1 + code
-        elif code <= 78:
-            szsz = pow(2, code - 76)
-            sz = decode(script[pos+szsz: pos:-1], 256)
-            out.append(script[pos + 1 + szsz:pos + 1 + szsz + sz])
-            pos += 1 + szsz + sz
+        elif data is not None:
+            out.append(data.tobytes())
         elif code <= 96:
             out.append(code - 80)
-            pos += 1
         else:
             out.append(code)
-            pos += 1
     return out
 
 
+def _is_multisig(script):
+    # OP_m <pubkey>... OP_n OP_CHECKMULTISIG
+    n = len(script)
+    if n < 37 or script[-1:] != b'\xae':
+        return False
+    m, keys = from_byte_to_int(script[0]) - 80, from_byte_to_int(script[-2]) - 80
+    if not 1 <= m <= keys <= 16:
+        return False
+    pos = 1
+    for _ in range(keys):
+        size = from_byte_to_int(script[pos])
+        if size not in (33, 65):
+            return False
+        pos += 1 + size
+        if pos > n - 2:
+            return False
+    return pos == n - 2
+
+
+def classify_script(script):
+    """Returns the template of an output script (hex or bytes): 'p2pk',
+    'p2pkh', 'p2sh', 'p2wpkh', 'p2wsh', 'multisig', 'op_return' or
+    'nonstandard'."""
+    if _is_hex_tx(script):
+        script = binascii.unhexlify(script)
+    n = len(script)
+    if n == 25:
+        if script[:3] == b'\x76\xa9\x14' and script[23:] == b'\x88\xac':
+            return 'p2pkh'
+    elif n == 23:
+        if script[:2] == b'\xa9\x14' and script[22:] == b'\x87':
+            return 'p2sh'
+    elif n == 22:
+        if script[:2] == b'\x00\x14':
+            return 'p2wpkh'
+    elif n == 34:
+        if script[:2] == b'\x00\x20':
+            return 'p2wsh'
+    elif n in (35, 67):
+        if script[n-1:] == b'\xac' and from_byte_to_int(script[0]) == n - 2:
+            return 'p2pk'
+    if script[:1] == b'\x6a':
+        return 'op_return'
+    if _is_multisig(script):
+        return 'multisig'
+    return 'nonstandard'
+
+
 def serialize_script_unit(unit):
     if isinstance(unit, int):
         if unit < 16:
@@ -447,6 +956,8 @@ def mk_multisig_script(*args):  # [pubs],k or pub1,pub2...pub[n],k
 
 
 def verify_tx_input(tx, i, script, sig, pub):
+    if isinstance(tx, Transaction):
+        tx = tx.serialize('bin')
     if re.match('^[0-9a-fA-F]*$', tx):
         tx = binascii.unhexlify(tx)
     if re.match('^[0-9a-fA-F]*$', script):
@@ -454,58 +965,83 @@ def verify_tx_input(tx, i, script, sig, pub):
     if not re.match('^[0-9a-fA-F]*$', sig):
         sig = safe_hexlify(sig)
     hashcode = decode(sig[-2:], 16)
-    modtx = signature_form(tx, int(i), script, hashcode)
-    return ecdsa_tx_verify(modtx, sig, pub, hashcode)
+    digest = LegacySighashContext(tx).digest(i, script, hashcode)
+    return ecdsa_raw_verify(digest, der_decode_sig(sig), pub)
 
 
 def sign(tx, i, priv, hashcode=SIGHASH_ALL):
     i = int(i)
-    txobj = tx if isinstance(tx, dict) else deserialize(tx)
-    if not isinstance(tx, dict) and ((not is_python2 and isinstance(re, bytes)) or not re.match('^[0-9a-fA-F]*$', tx)):
+    txobj = tx if isinstance(tx, (dict, Transaction)) else deserialize(tx)
+    if not isinstance(tx, (dict, Transaction)) and ((not is_python2 and isinstance(re, bytes)) or not re.match('^[0-9a-fA-F]*$', tx)):
         return binascii.unhexlify(sign(safe_hexlify(tx), i, priv))
-    if len(priv) <= 33:
-        priv = safe_hexlify(priv)
-    pub = privkey_to_pubkey(priv)
-    address = pubkey_to_address(pub)
-    signing_tx = signature_form(tx, i, mk_pubkey_script(address), hashcode)
-    sig = ecdsa_tx_sign(signing_tx, priv, hashcode)
-    txobj["ins"][i]['script'] = serialize_script([sig, pub])
+    _sign_input(txobj, i, priv, hashcode, LegacySighashContext(txobj))
     return serialize(txobj)
 
+
+def _sign_input(txobj, i, priv, hashcode, context):
+    if isinstance(priv, PrivateKey):
+        pub = priv.public_key().encode()
+    else:
+        if len(priv) <= 33:
+            priv = safe_hexlify(priv)
+        pub = privkey_to_pubkey(priv)
+    address = pubkey_to_address(pub)
+    sig = ecdsa_digest_sign(context.digest(i, mk_pubkey_script(address), hashcode), priv, hashcode)
+    _set_script(txobj, i, serialize_script([sig, pub]))
+
 def p2pk_sign(tx, i, priv, hashcode=SIGHASH_ALL):
     i = int(i)
-    txobj = tx if isinstance(tx, dict) else deserialize(tx)
-    if not isinstance(tx, dict) and ((not is_python2 and isinstance(re, bytes)) or not re.match('^[0-9a-fA-F]*$', tx)):
+    txobj = tx if isinstance(tx, (dict, Transaction)) else deserialize(tx)
+    if not isinstance(tx, (dict, Transaction)) and ((not is_python2 and isinstance(re, bytes)) or not re.match('^[0-9a-fA-F]*$', tx)):
         return binascii.unhexlify(sign(safe_hexlify(tx), i, priv))
-    if len(priv) <= 33:
-        priv = safe_hexlify(priv)
-    pub = privkey_to_pubkey(priv)
-    signing_tx = signature_form(tx, i, '21' + pub + 'ac', hashcode)
-    sig = ecdsa_tx_sign(signing_tx, priv, hashcode)
-    txobj["ins"][i]['script'] = serialize_script([sig])
+    if isinstance(priv, PrivateKey):
+        pub = priv.public_key().encode()
+    else:
+        if len(priv) <= 33:
+            priv = safe_hexlify(priv)
+        pub = privkey_to_pubkey(priv)
+    digest = LegacySighashContext(txobj).digest(i, '21' + pub + 'ac', hashcode)
+    sig = ecdsa_digest_sign(digest, priv, hashcode)
+    _set_script(txobj, i, serialize_script([sig]))
     return serialize(txobj)
 
+def _set_script(txobj, i, script):
+    # Set the hex script of input i of a transaction dict or object
+    if isinstance(txobj, Transaction):
+        txobj.ins[i].script = binascii.unhexlify(script)
+    else:
+        txobj["ins"][i]['script'] = script
+
 
 def signall(tx, priv):
     # if priv is a dictionary, assume format is
     # { 'txinhash:txinidx' : privkey }
-    if isinstance(priv, dict):
-        for e, i in enumerate(deserialize(tx)["ins"]):
-            k = priv["%s:%d" % (i["outpoint"]["hash"], i["outpoint"]["index"])]
-            tx = sign(tx, e, k)
-    else:
-        for i in range(len(deserialize(tx)["ins"])):
-            tx = sign(tx, i, priv)
-    return tx
+    txobj = tx if isinstance(tx, Transaction) else Transaction(tx)
+    context = LegacySighashContext(txobj)
+    keys = {}
+    for e, inp in enumerate(txobj.ins):
+        if isinstance(priv, dict):
+            k = priv["%s:%d" % (safe_hexlify(inp.hash), inp.index)]
+        else:
+            k = priv
+        if not isinstance(k, PrivateKey):
+            # Derive each key's public key once
+            if k not in keys:
+                keys[k] = PrivateKey(safe_hexlify(k) if len(k) <= 33 else k)
+            k = keys[k]
+        _sign_input(txobj, e, k, SIGHASH_ALL, context)
+    return serialize(txobj)
 
 
 def multisign(tx, i, script, pk, hashcode=SIGHASH_ALL):
+    if isinstance(tx, Transaction):
+        tx = tx.serialize('bin')
     if re.match('^[0-9a-fA-F]*$', tx):
         tx = binascii.unhexlify(tx)
     if re.match('^[0-9a-fA-F]*$', script):
         script = binascii.unhexlify(script)
-    modtx = signature_form(tx, i, script, hashcode)
-    return ecdsa_tx_sign(modtx, pk, hashcode)
+    digest = LegacySighashContext(tx).digest(i, script, hashcode)
+    return ecdsa_digest_sign(digest, pk, hashcode)
 
 
 def is_inp(arg):
@@ -1,6 +1,10 @@
 from .test_ecc import *
 from .test_segwit import *
 from .test_stealth import *
+from .test_import import *
+from .test_script import *
+from .test_blocks import *
+from .test_blockfiles import *
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+import binascii
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from bitcoin import BlockFiles, BLOCKFILE_MAGIC, mktx, deserialize_header, Transaction, \
+    deserialize
+from .test_blocks import make_block, GENESIS_HEADER, GENESIS_COINBASE, GENESIS_HASH
+from .test_segwit import TEST_CASES
+
+
+def make_tx(n):
+    return mktx(['%064x:0' % (n + 1)], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:%d' % (n + 1)])
+
+
+def make_chain(start, length, prevhash, nonce=0):
+    # length blocks on top of prevhash, each with two transactions
+    blocks = []
+    for i in range(length):
+        block = make_block([make_tx(2 * (start + i)), make_tx(2 * (start + i) + 1)],
+                           prevhash, nonce=nonce)
+        blocks.append(block)
+        prevhash = deserialize_header(block[:80])['hash']
+    return blocks
+
+
+def records(blocks):
+    return b''.join(BLOCKFILE_MAGIC['btc'] + struct.pack('<I', len(block)) + block
+                    for block in blocks)
+
+
+def write_blocks(path, blocks, padding=0):
+    with open(path, 'ab') as f:
+        f.write(records(blocks) + b'\x00' * padding)
+
+
+def block_hash(block):
+    return deserialize_header(block[:80])['hash']
+
+
+class TestBlockFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.genesis = binascii.unhexlify(GENESIS_HEADER + '01' + GENESIS_COINBASE)
+        self.chain = make_chain(0, 6, GENESIS_HASH)
+        # Out of order and split over two files
+        write_blocks(self.path(0), [self.genesis] + self.chain[2:4] + [self.chain[0]])
+        write_blocks(self.path(1), [self.chain[5], self.chain[1], self.chain[4]])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, n):
+        return os.path.join(self.dir, 'blk%05d.dat' % n)
+
+    def test_index(self):
+        with BlockFiles(self.dir) as bf:
+            self.assertEqual(bf.last_block_height(), 6)
+            hashes = [GENESIS_HASH] + [block_hash(b) for b in self.chain]
+            for height, h in enumerate(hashes):
+                self.assertEqual(bf.get_block_hash(height), h)
+                self.assertEqual(bf.get_block_height(h), height)
+                self.assertEqual(bf.get_header(h)['hash'], h)
+                self.assertEqual(bf.get_header(height)['hash'], h)
+            self.assertEqual(bf.get_block(0), self.genesis)
+            self.assertEqual(bf.get_block(3, 'hex'), binascii.hexlify(self.chain[2]).decode())
+            header, txs = bf.read_block(hashes[2])
+            self.assertEqual(header['hash'], hashes[2])
+            self.assertEqual([tx.raw() for tx in txs], [binascii.unhexlify(make_tx(n)) for n in (2, 3)])
+            self.assertEqual(bf.get_txs_in_block(GENESIS_HASH), [deserialize_header(GENESIS_HEADER)['merkle_root']])
+            for n in range(12):
+                txid = Transaction(make_tx(n)).txid()
+                self.assertEqual(bf.fetchtx(txid), make_tx(n))
+                self.assertEqual(bf.get_transaction(txid).to_dict(), deserialize(make_tx(n)))
+            self.assertRaises(KeyError, bf.get_block_hash, 7)
+            self.assertRaises(KeyError, bf.get_block, '00' * 32)
+            self.assertRaises(KeyError, bf.get_transaction, '00' * 32)
+
+    def test_update(self):
+        # Blocks written later, and a fork that takes over
+        write_blocks(self.path(1), [], padding=100)
+        with BlockFiles(self.dir) as bf:
+            self.assertEqual(bf.update(), 0)
+            tip = bf.get_block_hash(6)
+        # New blocks are written over the preallocated zeros
+        fork = make_chain(100, 4, block_hash(self.chain[3]), nonce=1)
+        with open(self.path(1), 'r+b') as f:
+            f.seek(-100, os.SEEK_END)
+            f.write(records(fork[:2]))
+        with BlockFiles(self.dir) as bf:
+            # Reopening scans only the new blocks; the fork is not longer yet
+            self.assertEqual(bf.last_block_height(), 6)
+            self.assertEqual(bf.get_block_hash(6), tip)
+            self.assertEqual(bf.get_block_height(block_hash(fork[1])), 6)
+            write_blocks(self.path(2), [fork[3]])
+            self.assertEqual(bf.update(), 1)
+            self.assertEqual(bf.last_block_height(), 6)
+            write_blocks(self.path(1), [fork[2]])
+            self.assertEqual(bf.update(), 1)
+            self.assertEqual(bf.last_block_height(), 8)
+            self.assertEqual([bf.get_block_hash(h) for h in range(5, 9)], [block_hash(b) for b in fork])
+            self.assertEqual(bf.get_block_hash(4), block_hash(self.chain[3]))
+            self.assertEqual(bf.get_block_height(tip), 6)
+
+    def test_segwit(self):
+        txs = [case['signed'] for case in TEST_CASES]
+        block = make_block(txs, block_hash(self.chain[-1]))
+        write_blocks(self.path(1), [block])
+        with BlockFiles(self.dir, index=os.path.join(self.dir, 'other.sqlite'), update=False) as bf:
+            self.assertEqual(bf.last_block_height(), -1)
+            self.assertEqual(bf.update(), 8)
+            self.assertEqual(bf.last_block_height(), 7)
+            for tx in txs:
+                view = bf.get_transaction(Transaction(tx).txid())
+                self.assertEqual(view.raw(), binascii.unhexlify(tx))
+                self.assertEqual(view.wtxid(), Transaction(tx).wtxid())
+
+    def test_bad_magic(self):
+        with open(self.path(2), 'wb') as f:
+            f.write(b'\x01\x02\x03\x04' + b'\x00' * 100)
+        self.assertRaises(Exception, BlockFiles, self.dir)
+
+    def test_failed_update(self):
+        # A block, then bad magic: nothing of the update is kept
+        extra = make_chain(6, 1, block_hash(self.chain[-1]))
+        write_blocks(self.path(2), extra)
+        with open(self.path(2), 'ab') as f:
+            f.write(b'\x01\x02\x03\x04' + b'\x00' * 100)
+        with BlockFiles(self.dir, update=False) as bf:
+            self.assertRaises(Exception, bf.update)
+            self.assertEqual(bf.last_block_height(), -1)
+            self.assertRaises(KeyError, bf.get_block, GENESIS_HASH)
+            self.assertRaises(KeyError, bf.get_transaction, Transaction(make_tx(0)).txid())
+        with open(self.path(2), 'r+b') as f:
+            f.truncate(len(records(extra)))
+        with BlockFiles(self.dir, update=False) as bf:
+            self.assertEqual(bf.update(), 8)
+            self.assertEqual(bf.get_block_hash(7), block_hash(extra[0]))
+
+    def test_no_txindex(self):
+        with BlockFiles(self.dir, index=os.path.join(self.dir, 'other.sqlite'), txindex=False) as bf:
+            self.assertEqual(bf.last_block_height(), 6)
+            txid = Transaction(make_tx(0)).txid()
+            self.assertRaisesRegex(Exception, 'index disabled', bf.get_transaction, txid)
+            self.assertRaisesRegex(Exception, 'index disabled', bf.fetchtx, txid)
+            self.assertEqual(bf.get_txs_in_block(1), [txid, Transaction(make_tx(1)).txid()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import binascii
+import io
+import mmap
+import os
+import struct
+import tempfile
+import unittest
+
+import bitcoin.blocks
+from bitcoin import read_block, deserialize_header, serialize_header, mk_merkle_proof, \
+    Transaction, deserialize, num_to_var_int, bin_dbl_sha256, safe_hexlify
+from .test_segwit import TEST_CASES
+
+GENESIS_HEADER = '0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c'
+GENESIS_COINBASE = '01000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000'
+GENESIS_HASH = '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f'
+
+
+def merkle_root(txids):
+    nodes = [binascii.unhexlify(h)[::-1] for h in txids]
+    while len(nodes) > 1:
+        if len(nodes) % 2:
+            nodes.append(nodes[-1])
+        nodes = [bin_dbl_sha256(nodes[i] + nodes[i + 1]) for i in range(0, len(nodes), 2)]
+    return safe_hexlify(nodes[0][::-1])
+
+
+def make_block(txs, prevhash='00' * 32, timestamp=1231006505, nonce=0):
+    """A serialized block of the given hex transactions; only its header
+    fields and merkle root are meaningful"""
+    header = struct.pack('<I32s32sIII', 1, binascii.unhexlify(prevhash)[::-1],
+                         binascii.unhexlify(merkle_root([Transaction(tx).txid() for tx in txs]))[::-1],
+                         timestamp, 0x1d00ffff, nonce)
+    return header + num_to_var_int(len(txs)) + b''.join(binascii.unhexlify(tx) for tx in txs)
+
+
+class TestBlockHeader(unittest.TestCase):
+
+    def test_genesis(self):
+        header = deserialize_header(GENESIS_HEADER)
+        self.assertEqual(header['hash'], GENESIS_HASH)
+        self.assertEqual(header['nonce'], 2083236893)
+        self.assertEqual(header['bits'], 0x1d00ffff)
+        self.assertEqual(header, deserialize_header(binascii.unhexlify(GENESIS_HEADER)))
+        self.assertEqual(serialize_header(header), GENESIS_HEADER)
+        proof = mk_merkle_proof(header, [header['merkle_root']], 0)
+        self.assertEqual(proof['siblings'], [])
+
+
+class TestReadBlock(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.txs = [GENESIS_COINBASE] + [case['signed'] for case in TEST_CASES]
+        cls.block = make_block(cls.txs)
+
+    def check(self, header, views, offset=0):
+        self.assertEqual(header, deserialize_header(self.block[:80]))
+        views = list(views)
+        self.assertEqual(len(views), len(self.txs))
+        pos = offset + 80 + len(num_to_var_int(len(self.txs)))
+        for view, tx in zip(views, self.txs):
+            txobj = Transaction(tx)
+            self.assertEqual(view.offset, pos)
+            self.assertEqual(view.raw(), binascii.unhexlify(tx))
+            self.assertEqual(view.segwit, txobj.segwit)
+            self.assertEqual(view.txid(), txobj.txid())
+            self.assertEqual(view.wtxid(), txobj.wtxid())
+            self.assertEqual(view.weight(), txobj.weight())
+            self.assertEqual(view.to_dict(), deserialize(tx))
+            self.assertEqual(view.to_dict('bin'), deserialize(binascii.unhexlify(tx)))
+            pos += view.size
+        txids = [view.txid() for view in views]
+        self.assertEqual(merkle_root(txids), header['merkle_root'])
+        mk_merkle_proof(header, txids, 2)
+
+    def test_genesis(self):
+        header, txs = read_block(binascii.unhexlify(GENESIS_HEADER + '01' + GENESIS_COINBASE))
+        self.assertEqual(header['hash'], GENESIS_HASH)
+        self.assertEqual([tx.txid() for tx in txs], [header['merkle_root']])
+
+    def test_buffer(self):
+        self.check(*read_block(self.block))
+        self.check(*read_block(bytearray(self.block)))
+        padded = b'\xf9' * 13 + self.block + b'\x00' * 7
+        self.check(*read_block(memoryview(padded), 13), offset=13)
+
+    def test_file(self):
+        self.check(*read_block(io.BytesIO(self.block)))
+        stream = io.BytesIO(b'\xf9' * 13 + self.block)
+        self.check(*read_block(stream, 13), offset=13)
+        # Transactions straddling reads
+        read_size = bitcoin.blocks._READ_SIZE
+        bitcoin.blocks._READ_SIZE = 7
+        try:
+            self.check(*read_block(io.BytesIO(self.block)))
+        finally:
+            bitcoin.blocks._READ_SIZE = read_size
+
+    def test_mmap(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.block)
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                header, txs = read_block(mm)
+                self.check(header, txs)
+                del header, txs
+                mm.close()
+        finally:
+            os.remove(path)
+
+    def test_truncated(self):
+        for source in [self.block[:-1], io.BytesIO(self.block[:-1])]:
+            header, txs = read_block(source)
+            self.assertRaises(Exception, list, txs)
+
+
+if __name__ == '__main__':
+    unittest.main()
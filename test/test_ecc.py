@@ -1,5 +1,6 @@
 import unittest
 from bitcoin import *
+from bitcoin import ripemd_numpy
 
 class TestECCArithmetic(unittest.TestCase):
 
@@ -42,6 +43,325 @@ class TestECCArithmetic(unittest.TestCase):
             self.assertEqual(G[0], multiply(divide(G, x), x)[0])
 
 
+class TestFixedBaseMultiply(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting fixed-base multiplication tests')
+
+    def test_all(self):
+        # Same point as G but with z != 1, so it takes the generic path
+        z = 2
+        scaled_g = ((Gx * z ** 2) % P, (Gy * z ** 3) % P, z)
+        for n in [1, 2, 15, 16, 17, N - 1, N, N + 1, -5] + \
+                [random.randrange(2**256) for i in range(10)]:
+            self.assertEqual(
+                from_jacobian(fixed_base_multiply(n)),
+                from_jacobian(jacobian_multiply(scaled_g, n))
+            )
+        self.assertEqual(fast_multiply(G, 0), (0, 0))
+        self.assertEqual(fast_multiply(G, 1), G)
+
+
+def naive_multiply(a, n):
+    # Plain double-and-add reference for the optimized multipliers
+    o = (0, 0, 1)
+    for bit in bin(n % N)[2:]:
+        o = jacobian_add(jacobian_double(o), to_jacobian(a)) if bit == '1' \
+            else jacobian_double(o)
+    return from_jacobian(o)
+
+
+class TestWNAFMultiply(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting wNAF multiplication tests')
+
+    def test_wnaf(self):
+        for w in [2, 3, 4, 5, 6]:
+            for i in range(20):
+                n = random.randrange(2**256)
+                digits = wnaf(n, w)
+                self.assertEqual(sum(d * 2**j for j, d in enumerate(digits)), n)
+                for j, d in enumerate(digits):
+                    if d:
+                        self.assertTrue(d % 2 and abs(d) < 2**(w - 1))
+                        self.assertFalse(any(digits[j+1:j+w]))
+
+    def test_multiply(self):
+        point = fast_multiply(G, random.randrange(1, N))
+        for w in [2, 3, 4, 5]:
+            for n in [1, 2, 3, N - 1, N + 2, -3, random.randrange(2**256)]:
+                self.assertEqual(
+                    from_jacobian(jacobian_multiply(to_jacobian(point), n, w)),
+                    naive_multiply(point, n)
+                )
+
+
+class TestShamirMultiply(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting simultaneous multiplication tests')
+
+    def test_all(self):
+        for i in range(5):
+            a = fast_multiply(G, random.randrange(1, N))
+            b = random.choice([G, fast_multiply(G, random.randrange(1, N))])
+            n, m = random.randrange(2**256), random.randrange(2**256)
+            self.assertEqual(
+                shamir_multiply(a, n, b, m),
+                fast_add(naive_multiply(a, n), naive_multiply(b, m))
+            )
+        a = fast_multiply(G, 5)
+        self.assertEqual(shamir_multiply(a, 1, G, N - 5), (0, 0))
+        self.assertEqual(shamir_multiply(a, 0, G, 5), a)
+
+
+class TestGLV(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting GLV endomorphism tests')
+
+    def test_split(self):
+        self.assertEqual(fast_multiply(G, GLV_LAMBDA), ((GLV_BETA * Gx) % P, Gy))
+        for k in [0, 1, N - 1] + [random.randrange(N) for i in range(50)]:
+            k1, k2 = glv_split(k)
+            self.assertEqual((k1 + k2 * GLV_LAMBDA - k) % N, 0)
+            self.assertTrue(abs(k1) < 2**129 and abs(k2) < 2**129)
+
+    def test_against_naive(self):
+        import bitcoin.main
+        self.assertTrue(glv_active())
+        for i in range(5):
+            a = fast_multiply(G, random.randrange(1, N))
+            n, m = random.randrange(2**256), random.randrange(2**256)
+            expected = naive_multiply(a, n)
+            self.assertEqual(fast_multiply(a, n), expected)
+            self.assertEqual(shamir_multiply(a, n, G, m),
+                             fast_add(expected, naive_multiply(G, m)))
+            bitcoin.main.GLV_ENABLED = False
+            try:
+                self.assertFalse(glv_active())
+                self.assertEqual(fast_multiply(a, n), expected)
+            finally:
+                bitcoin.main.GLV_ENABLED = True
+
+    def test_other_curve(self):
+        # Same curve with another generator: the endomorphism must not be used
+        g2 = fast_multiply(G, 2)
+        a = fast_multiply(G, random.randrange(1, N))
+        n = random.randrange(N)
+        change_curve(P, N, A, B, g2[0], g2[1])
+        try:
+            self.assertFalse(glv_active())
+            self.assertEqual(fast_multiply(a, n), naive_multiply(a, n))
+        finally:
+            change_curve(P, N, A, B, Gx, Gy)
+        self.assertTrue(glv_active())
+
+
+class TestBatchNormalization(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting batch affine normalization tests')
+
+    def test_batch_from_jacobian(self):
+        points = [jacobian_multiply(to_jacobian(G), random.randrange(2, N)) for i in range(5)]
+        points.insert(2, (0, 0, 1))
+        points.append(jacobian_double((0, 0, 1)))
+        self.assertEqual(batch_from_jacobian(points), [from_jacobian(p) for p in points])
+        self.assertEqual(batch_from_jacobian([]), [])
+
+    def test_batch_keys(self):
+        privs = [random_key() for i in range(4)]
+        privs += [privs[0] + '01', encode_privkey(privs[1], 'wif'),
+                  encode_privkey(privs[2], 'wif_compressed'), decode_privkey(privs[3])]
+        self.assertEqual(batch_privkey_to_pubkey(privs), [privtopub(p) for p in privs])
+        self.assertEqual(batch_privkey_to_address(privs, 111), [privtoaddr(p, 111) for p in privs])
+        pubs = batch_privkey_to_pubkey(privs)
+        pubs += [decode_pubkey(pubs[0]), binascii.unhexlify(pubs[1]), PublicKey(pubs[2])]
+        self.assertEqual(batch_pubkey_to_address(pubs, 5), [pubtoaddr(p, 5) for p in pubs])
+        self.assertEqual(batch_pubkey_to_address([]), [])
+
+
+class TestKeyObjects(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting key object tests')
+
+    def test_privkey(self):
+        priv = random_key()
+        for p, formt in [(priv, 'hex'), (priv + '01', 'hex_compressed'),
+                         (encode_privkey(priv, 'wif_compressed', 111), 'wif_compressed')]:
+            key = PrivateKey(p)
+            self.assertEqual(get_privkey_format(key),
+                             'object_compressed' if 'compressed' in formt else 'object')
+            self.assertEqual(decode_privkey(key), decode_privkey(priv))
+            for f in ['bin', 'hex', 'hex_compressed', 'wif', 'wif_compressed']:
+                self.assertEqual(encode_privkey(key, f), encode_privkey(priv, f))
+                self.assertEqual(key.encode(f, 111), encode_privkey(priv, f, 111))
+            self.assertEqual(privtopub(key).encode(), privtopub(p))
+            self.assertEqual(privtoaddr(key), privtoaddr(p))
+            self.assertEqual(ecdsa_raw_sign('ab' * 32, key), ecdsa_raw_sign('ab' * 32, p))
+            self.assertTrue(privtopub(key) is key.public_key())
+        self.assertEqual(add_privkeys(PrivateKey(priv), 1), PrivateKey(add_privkeys(priv, 1)))
+        self.assertEqual(encode_privkey(priv, 'object_compressed'), PrivateKey(priv + '01'))
+        self.assertRaises(Exception, PrivateKey, 0)
+
+        # The network of a WIF key carries over to its encodings and addresses
+        wif = encode_privkey(priv, 'wif_compressed', 111)
+        key = PrivateKey(wif)
+        self.assertEqual(key.vbyte, 111)
+        self.assertEqual(key.wif(), wif)
+        self.assertEqual(key.address(), privtoaddr(priv + '01', 111))
+        self.assertEqual(key.address(0), privtoaddr(priv + '01'))
+        self.assertEqual(PrivateKey(key).vbyte, 111)
+        self.assertEqual(PrivateKey(wif, vbyte=111), key)
+        self.assertRaises(Exception, PrivateKey, wif, vbyte=0)
+        self.assertEqual(PrivateKey(priv, vbyte=111).wif(), encode_privkey(priv, 'wif', 111))
+        self.assertEqual(encode_privkey(priv, 'object', 111).vbyte, 111)
+        self.assertRaises(Exception, PrivateKey, N)
+
+    def test_pubkey(self):
+        pub = privtopub(random_key())
+        key = PublicKey(compress(pub))
+        self.assertTrue(key.compressed)
+        self.assertEqual(key.point, decode_pubkey(pub))
+        for f in ['bin', 'hex', 'bin_compressed', 'hex_compressed', 'hex_electrum']:
+            self.assertEqual(encode_pubkey(key, f), encode_pubkey(pub, f))
+        self.assertEqual(pubtoaddr(key), pubtoaddr(compress(pub)))
+        self.assertEqual(pubtoaddr(decompress(key), 111), pubtoaddr(pub, 111))
+        self.assertEqual(key.hash160(), hash160(binascii.unhexlify(compress(pub))))
+        self.assertTrue(compress(key) is key)
+        self.assertEqual(decompress(key), PublicKey(pub))
+        self.assertEqual(multiply(key, 3), PublicKey(multiply(compress(pub), 3)))
+        self.assertEqual(add_pubkeys(key, G), PublicKey(add_pubkeys(compress(pub), G), True))
+        self.assertRaises(Exception, PublicKey, (1, 1))
+
+    def test_sign(self):
+        priv = random_key()
+        addr = privtoaddr(priv)
+        tx = mktx(['%s:0' % ('11' * 32)], ['%s:50000' % addr])
+        self.assertEqual(sign(tx, 0, PrivateKey(priv)), sign(tx, 0, priv))
+        self.assertEqual(p2pk_sign(tx, 0, PrivateKey(priv)), p2pk_sign(tx, 0, priv))
+
+
+class TestLRUCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting LRU cache tests')
+
+    def test_all(self):
+        from bitcoin.cache import LRUCache
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.info(), (2, 1, 2, 2))
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue('c' in cache)
+        cache.resize(0)
+        cache.put('d', 4)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.info().hit_rate, 2.0 / 3)
+        cache.clear()
+        self.assertEqual(cache.info(), (0, 0, 0, 0))
+        self.assertEqual(cache.info().hit_rate, 0.0)
+
+    def test_decompression(self):
+        pub = compress(privtopub(random_key()))
+        before = decompression_cache_info()
+        self.assertEqual(decompress(pub), decompress(pub))
+        after = decompression_cache_info()
+        self.assertEqual((after.hits - before.hits, after.misses - before.misses), (1, 1))
+        self.assertEqual(decode_pubkey(safe_from_hex(pub)), decode_pubkey(pub))
+        set_decompression_cache_size(1)
+        try:
+            self.assertEqual(decompression_cache_info().currsize, 1)
+        finally:
+            set_decompression_cache_size(DECOMPRESSION_CACHE_SIZE)
+
+    def test_signatures(self):
+        priv = random_key()
+        pub = privtopub(priv)
+        msghash = sha256('cached signature')
+        vrs = ecdsa_raw_sign(msghash, priv)
+        before = signature_cache_info()
+        self.assertTrue(ecdsa_raw_verify(msghash, vrs, pub))
+        self.assertTrue(ecdsa_raw_verify(msghash, vrs, compress(pub)))
+        self.assertEqual(ecdsa_batch_verify([(msghash, vrs, pub)]), [True])
+        after = signature_cache_info()
+        self.assertEqual((after.hits - before.hits, after.misses - before.misses), (2, 1))
+        # Failures are not cached
+        self.assertFalse(ecdsa_raw_verify(sha256('other'), vrs, pub))
+        self.assertFalse(ecdsa_raw_verify(sha256('other'), vrs, pub))
+        self.assertEqual(signature_cache_info().misses - after.misses, 2)
+        set_signature_cache_size(0)
+        try:
+            self.assertEqual(signature_cache_info().currsize, 0)
+            self.assertTrue(ecdsa_raw_verify(msghash, vrs, pub))
+        finally:
+            set_signature_cache_size(SIGNATURE_CACHE_BYTES)
+
+
+class TestMultiScalarMultiply(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting multi-scalar multiplication tests')
+
+    def naive_sum(self, points, scalars):
+        o = (0, 0)
+        for a, n in zip(points, scalars):
+            o = fast_add(o, naive_multiply(a, n))
+        return o
+
+    def test_all(self):
+        import bitcoin.main
+        for count in [1, 3, PIPPENGER_THRESHOLD + 6]:
+            points = [fast_multiply(G, random.randrange(1, N)) for i in range(count)]
+            points[0] = G
+            scalars = [random.randrange(2**256) for i in range(count)]
+            scalars[-1] = 0
+            expected = self.naive_sum(points, scalars)
+            self.assertEqual(multi_scalar_multiply(points, scalars), expected)
+            bitcoin.main.GLV_ENABLED = False
+            try:
+                self.assertEqual(multi_scalar_multiply(points, scalars), expected)
+            finally:
+                bitcoin.main.GLV_ENABLED = True
+
+    def test_pippenger(self):
+        import bitcoin.main
+        points = [fast_multiply(G, random.randrange(1, N)) for i in range(20)]
+        points.append((0, 0))
+        scalars = [random.randrange(2**256) for i in range(21)]
+        scalars[3] = N - scalars[2]
+        points[3] = points[2]
+        self.assertEqual(
+            from_jacobian(bitcoin.main._jacobian_pippenger(points, scalars)),
+            self.naive_sum(points, scalars)
+        )
+
+    def test_edge_cases(self):
+        a = fast_multiply(G, 7)
+        self.assertEqual(multi_scalar_multiply([], []), (0, 0))
+        self.assertEqual(multi_scalar_multiply([a, G], [1, N - 7]), (0, 0))
+        self.assertEqual(multi_scalar_multiply([encode_pubkey(a, 'hex_compressed'), G], [2, 3]),
+                         fast_multiply(G, 17))
+        self.assertRaises(Exception, multi_scalar_multiply, [a, G], [1])
+
+
 class TestBases(unittest.TestCase):
 
     @classmethod
@@ -69,6 +389,56 @@ class TestBases(unittest.TestCase):
             self.assertEqual(changebase(encode(x, frm), frm, to), encode(x, to))
             self.assertEqual(decode(changebase(encode(x, frm), frm, to), to), x)
 
+    def test_long_values(self):
+        # Long enough to take the split path of bases 32 and 58 and to
+        # exceed the native int/str conversion limit for base 10
+        for bits in [1, 63, 64, 200, 4000, 20000]:
+            x = random.getrandbits(bits) | 1
+            for base in [2, 10, 16, 32, 58, 256]:
+                digits = encode(x, base)
+                self.assertEqual(decode(digits, base), x)
+                self.assertEqual(encode(x, base, len(digits) + 3)[3:], digits)
+            self.assertEqual(decode(encode(x, 58), 58), decode(encode(x, 256), 256))
+        self.assertEqual(encode(58 ** 600, 58), '2' + '1' * 600)
+        self.assertEqual(encode(0, 58, 3), '111')
+        self.assertEqual(encode(0, 256, 2), b'\x00\x00')
+        self.assertEqual(decode('', 58), 0)
+        self.assertEqual(decode('DEADBEEF', 16), 0xdeadbeef)
+        self.assertEqual(decode(b'ff', 16), 255)
+
+    def test_invalid_digits(self):
+        # Only digits of the base, whatever int() would take
+        for string, base in [('0x1f', 16), ('1_000', 10), (' 12', 10), ('12\n', 10), ('-1', 10),
+                             ('+1', 2), ('0b1', 2), ('12', 2), ('fg', 16), (b' ff', 16), ('0OI', 58),
+                             ('1', 32)]:
+            self.assertRaises(ValueError, decode, string, base)
+
+
+class TestB58Check(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting base58check tests')
+
+    def test_all(self):
+        payloads = [os.urandom(20) for i in range(20)] + \
+            [b'\x00' * 20, b'\x00\x00' + os.urandom(18), os.urandom(32), b'']
+        for magicbyte in [0, 5, 111, 128]:
+            addrs = b58check_encode_many(payloads, magicbyte)
+            self.assertEqual(addrs, [bin_to_b58check(p, magicbyte) for p in payloads])
+            self.assertEqual(b58check_decode_many(addrs), [(magicbyte, p) for p in payloads])
+            for a in addrs:
+                self.assertEqual(get_version_byte(a), magicbyte)
+        self.assertEqual(get_version_byte('1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2'), 0)
+
+    def test_invalid(self):
+        good = privtoaddr(random_key())
+        bad = [good[:-1] + ('2' if good[-1] != '2' else '3'), good + '0', '', '1']
+        self.assertEqual(b58check_decode_many([good] + bad, strict=False),
+                         [(0, b58check_to_bin(good))] + [None] * len(bad))
+        for b in bad:
+            self.assertRaises(Exception, b58check_decode_many, [good, b])
+
 
 class TestElectrumWalletInternalConsistency(unittest.TestCase):
 
@@ -109,6 +479,52 @@ class TestRawSignRecover(unittest.TestCase):
             )
 
 
+class TestBatchVerify(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print("Batch signature verification tests")
+
+    def test_all(self):
+        privs = [sha256(str(i)) for i in range(12)]
+        items = []
+        for i, priv in enumerate(privs):
+            msghash = sha256('batch %d' % i)
+            v, r, s = ecdsa_raw_sign(msghash, priv)
+            items.append((msghash, (v, r, s), privtopub(priv)))
+        self.assertEqual(ecdsa_batch_verify(items), [True] * len(items))
+
+        msghash, (v, r, s), pub = items[3]
+        items[3] = (msghash, (v, r, (s + 1) % N), pub)
+        msghash, (v, r, s), pub = items[5]
+        items[5] = (msghash, (v - 1 if v % 2 == 0 else v + 1, r, s), pub)   # wrong recovery id
+        items[7] = (items[7][0], items[7][1], items[8][2])
+        msghash, (v, r, s), pub = items[9]
+        items[9] = (msghash, der_decode_sig(der_encode_sig(v, r, s)), pub)
+        items[10] = (items[10][0], (0, 1, 1), items[10][2])
+        results = ecdsa_batch_verify(items)
+        self.assertEqual(results, [ecdsa_raw_verify(*item) for item in items])
+        self.assertEqual([i for i, ok in enumerate(results) if not ok], [3, 7, 10])
+        self.assertEqual(ecdsa_batch_verify([]), [])
+
+    def test_without_recovery_id(self):
+        # (r, s) pairs, as parsed from DER, whatever the parity of R
+        items = []
+        for i in range(6):
+            priv, msghash = sha256('pair %d' % i), sha256('pair message %d' % i)
+            v, r, s = ecdsa_raw_sign(msghash, priv)
+            items.append((msghash, (r, s), privtopub(priv)))
+        items.append((items[0][0], (items[0][1][0], items[0][1][1] + 1), items[0][2]))
+        self.assertEqual(ecdsa_batch_verify(items), [True] * 6 + [False])
+        self.assertEqual([ecdsa_raw_verify(*item) for item in items], [True] * 6 + [False])
+
+    def test_ecdsa_verify(self):
+        priv = sha256('message signing')
+        sig = ecdsa_sign('hello', priv)
+        self.assertTrue(ecdsa_verify('hello', sig, privtopub(priv)))
+        self.assertFalse(ecdsa_verify('hello!', sig, privtopub(priv)))
+
+
 class TestTransactionSignVerify(unittest.TestCase):
 
     @classmethod
@@ -145,6 +561,29 @@ class TestSerialize(unittest.TestCase):
             "Serialize roundtrip failed"
         )
 
+    def test_serialize_formats(self):
+        tx = mktx(['01'*32+':1', '23'*32+':2'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:20202'])
+        bintx = binascii.unhexlify(tx)
+        obj = deserialize(bintx)
+        self.assertEqual(obj['ins'][0]['outpoint']['hash'], b'\x01' * 32)
+        self.assertEqual(serialize(obj), bintx)
+        self.assertEqual(serialize(obj, 'bin'), bintx)
+        self.assertEqual(deserialize(memoryview(bintx)), obj)
+        self.assertEqual(deserialize(bytearray(bintx)), obj)
+        self.assertEqual(deserialize(bintx, 'bin'), obj)
+        self.assertEqual(deserialize(tx)['ins'][1]['outpoint']['hash'], '23' * 32)
+        self.assertEqual(serialize(deserialize(tx), 'hex'), tx)
+
+    def test_serialize_witness(self):
+        tx = deserialize(mktx(['01'*32+':1', '23'*32+':2'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:20202']))
+        tx['ins'][0]['txinwitness'] = ['', 'ab' * 300]
+        segwit_tx = serialize(tx)
+        self.assertEqual(segwit_tx[8:12], '0001')
+        self.assertEqual(deserialize(segwit_tx), dict(tx, segwit=True))
+        # An empty witness list is written as two empty items
+        tx['ins'][0]['txinwitness'] = []
+        self.assertEqual(serialize(tx)[-16:-8], '02000000')
+
     def test_serialize_script(self):
         script = '47304402200c40fa58d3f6d5537a343cf9c8d13bc7470baf1d13867e0de3e535cd6b4354c802200f2b48f67494835b060d0b2ff85657d2ba2d9ea4e697888c8cb580e8658183a801483045022056f488c59849a4259e7cef70fe5d6d53a4bd1c59a195b0577bd81cb76044beca022100a735b319fa66af7b178fc719b93f905961ef4d4446deca8757a90de2106dd98a014cc95241046c7d87fd72caeab48e937f2feca9e9a4bd77f0eff4ebb2dbbb9855c023e334e188d32aaec4632ea4cbc575c037d8101aec73d029236e7b1c2380f3e4ad7edced41046fd41cddf3bbda33a240b417a825cc46555949917c7ccf64c59f42fd8dfe95f34fae3b09ed279c8c5b3530510e8cca6230791102eef9961d895e8db54af0563c410488d618b988efd2511fc1f9c03f11c210808852b07fe46128c1a6b1155aa22cdf4b6802460ba593db2d11c7e6cbe19cedef76b7bcabd05d26fd97f4c5a59b225053ae'
         self.assertEqual(
@@ -154,6 +593,152 @@ class TestSerialize(unittest.TestCase):
         )
 
 
+class TestTransactionObject(unittest.TestCase):
+
+    def setUp(self):
+        self.privs = [sha256(str(i)) for i in range(3)]
+        addresses = [privtoaddr(priv) for priv in self.privs]
+        self.tx = mktx(['01'*32+':1', '23'*32+':2'], [addresses[2]+':20202'], locktime=1234)
+
+    def test_roundtrip(self):
+        txobj = Transaction(self.tx)
+        self.assertEqual(txobj.serialize(), self.tx)
+        self.assertEqual(serialize(txobj), self.tx)
+        self.assertEqual(deserialize(txobj), deserialize(self.tx))
+        self.assertEqual(Transaction(deserialize(self.tx)).serialize(), self.tx)
+        bintx = binascii.unhexlify(self.tx)
+        self.assertEqual(Transaction(bintx).serialize(), bintx)
+        self.assertEqual(Transaction(bintx).to_dict(), deserialize(bintx))
+        self.assertEqual(txhash(txobj), txhash(self.tx))
+        self.assertEqual(txobj.txid(), txhash(self.tx))
+        self.assertEqual(txobj.weight(), 4 * len(bintx))
+        self.assertEqual(txobj.vsize(), len(bintx))
+
+    def test_mutation(self):
+        txobj = Transaction(self.tx)
+        d = deserialize(self.tx)
+        self.assertEqual(txobj.txid(), txhash(serialize(d)))
+        txobj.ins[0].sequence = d['ins'][0]['sequence'] = 7
+        self.assertEqual(txobj.txid(), txhash(serialize(d)))
+        txobj.outs.append(TxOut(1000, b'\x51'))
+        d['outs'].append({'value': 1000, 'script': '51'})
+        self.assertEqual(txobj.serialize(), serialize(d))
+        txobj.outs[-1].value = d['outs'][-1]['value'] = 2000
+        self.assertEqual(txobj.serialize(), serialize(d))
+        txobj.locktime = d['locktime'] = 0
+        self.assertEqual(txobj.txid(), txhash(serialize(d)))
+        # Witnesses are tuples, they cannot change in place behind the cache
+        txobj.ins[0].witness = [b'\x01']
+        d['ins'][0]['txinwitness'] = ['01']
+        self.assertEqual(txobj.serialize(), serialize(d))
+        self.assertEqual(txobj.ins[0].witness, (b'\x01',))
+        txobj.ins[0].witness += (b'\x02',)
+        d['ins'][0]['txinwitness'].append('02')
+        self.assertEqual(txobj.serialize(), serialize(d))
+        self.assertEqual(txobj.to_dict(), d)
+
+    def test_sign(self):
+        txobj = Transaction(self.tx)
+        expected = signall(self.tx, self.privs[0])
+        self.assertEqual(signall(txobj, self.privs[0]), expected)
+        self.assertEqual(txobj.serialize(), expected)
+        txobj = Transaction(self.tx)
+        self.assertEqual(sign(txobj, 1, self.privs[1]), sign(self.tx, 1, self.privs[1]))
+
+
+class TestLegacySighash(unittest.TestCase):
+
+    def test_digest(self):
+        script = mk_pubkey_script('1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1')
+        tx = mktx(['%02x' % j * 32 + ':%d' % j for j in range(4)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:%d' % (j + 1000) for j in range(3)])
+        context = LegacySighashContext(tx)
+        for i in range(4):
+            for hashcode in [SIGHASH_ALL, SIGHASH_ANYONECANPAY]:
+                self.assertEqual(context.digest(i, script, hashcode),
+                                 bin_txhash(signature_form(tx, i, script, hashcode), hashcode))
+        # signature_form follows the consensus rules for every hash type
+        # when there is a single input
+        tx = mktx(['ab' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000'])
+        context = LegacySighashContext(deserialize(tx))
+        for hashcode in [SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ANYONECANPAY]:
+            self.assertEqual(context.digest(0, binascii.unhexlify(script), hashcode),
+                             bin_txhash(signature_form(tx, 0, script, hashcode), hashcode))
+
+    def test_sighash_types(self):
+        tx = mktx(['%02x' % j * 32 + ':0' for j in range(3)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000'])
+        context = LegacySighashContext(tx)
+        # Only the signed input's own output counts for SIGHASH_SINGLE, and
+        # inputs without one sign the hash 1
+        self.assertEqual(context.digest(1, '51', SIGHASH_SINGLE), b'\x01' + b'\x00' * 31)
+        txobj = Transaction(tx)
+        txobj.ins[1].sequence = 0
+        txobj.outs.append(TxOut(5, b''))
+        other = LegacySighashContext(txobj)
+        for hashcode in [SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY]:
+            self.assertEqual(context.digest(0, '51', hashcode), other.digest(0, '51', hashcode))
+        for hashcode in [SIGHASH_ALL, SIGHASH_ALL | SIGHASH_ANYONECANPAY]:
+            self.assertNotEqual(context.digest(0, '51', hashcode), other.digest(0, '51', hashcode))
+
+    def reference_digest(self, tx, i, script, hashcode):
+        # The signature hash built the way Bitcoin Core's SignatureHash
+        # serializes the modified transaction
+        d = deserialize(tx)
+        base = hashcode & 0x1f
+        if base == SIGHASH_SINGLE and i >= len(d['outs']):
+            return b'\x01' + b'\x00' * 31
+        for j, inp in enumerate(d['ins']):
+            inp['script'] = script if j == i else ''
+            if j != i and base in (SIGHASH_NONE, SIGHASH_SINGLE):
+                inp['sequence'] = 0
+        if base == SIGHASH_NONE:
+            d['outs'] = []
+        elif base == SIGHASH_SINGLE:
+            d['outs'] = [{'value': 2 ** 64 - 1, 'script': ''}] * i + [d['outs'][i]]
+        if hashcode & SIGHASH_ANYONECANPAY:
+            d['ins'] = [d['ins'][i]]
+        return bin_dbl_sha256(binascii.unhexlify(serialize(d)) + struct.pack('<I', hashcode))
+
+    def test_sequences(self):
+        # Nonzero sequences, the signing input's own kept by every hash type
+        txobj = deserialize(mktx(['%02x' % j * 32 + ':0' for j in range(3)],
+                                 ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:%d' % j for j in range(1000, 1003)]))
+        for inp, sequence in zip(txobj['ins'], [0xffffffff, 0xfffffffe, 5]):
+            inp['sequence'] = sequence
+        tx = serialize(txobj)
+        context = LegacySighashContext(tx)
+        for i in range(3):
+            for hashcode in [SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ALL | SIGHASH_ANYONECANPAY,
+                             SIGHASH_NONE | SIGHASH_ANYONECANPAY, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY]:
+                self.assertEqual(context.digest(i, '51', hashcode),
+                                 self.reference_digest(tx, i, '51', hashcode), (i, hashcode))
+        # sign with a single input of sequence 0xffffffff
+        priv = sha256('sequence')
+        script = mk_pubkey_script(privtoaddr(priv))
+        tx = mktx(['11' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000'])
+        txobj = deserialize(tx)
+        txobj['ins'][0]['sequence'] = 0xffffffff
+        tx = serialize(txobj)
+        for hashcode in [SIGHASH_NONE, SIGHASH_SINGLE]:
+            sig, pub = deserialize_script(deserialize(sign(tx, 0, priv, hashcode))['ins'][0]['script'])
+            r, s, code = parse_der_sig(binascii.unhexlify(sig))
+            self.assertEqual(code, hashcode)
+            self.assertTrue(ecdsa_raw_verify(self.reference_digest(tx, 0, script, hashcode), (r, s), pub))
+
+    def test_signall(self):
+        privs = [sha256(str(j)) for j in range(5)]
+        tx = mktx(['%02x' % j * 32 + ':0' for j in range(5)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000'])
+        signed = signall(tx, dict(('%02x' % j * 32 + ':0', privs[j]) for j in range(5)))
+        for j, inp in enumerate(deserialize(signed)['ins']):
+            sig, pub = deserialize_script(inp['script'])
+            self.assertEqual(pub, privtopub(privs[j]))
+            self.assertTrue(verify_tx_input(signed, j, mk_pubkey_script(privtoaddr(privs[j])), sig, pub))
+        self.assertEqual(signall(binascii.unhexlify(tx), privs[0]),
+                         binascii.unhexlify(signall(tx, privs[0])))
+
+
 class TestTransaction(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -377,6 +962,46 @@ class TestStartingAddressAndScriptGenerationConsistency(unittest.TestCase):
             self.assertEqual(b, script_to_address(address_to_script(b), 0xc4))
 
 
+# RIPEMD-160 test vectors shared by the scalar and NumPy implementations:
+# message, ripemd160(message), ripemd160(sha256(message))
+RIPEMD160_VECTORS = [
+    ('', '9c1185a5c5e9fc54612808977ee8f548b2258d31',
+     'b472a266d0bd89c13706a4132ccfb16f7c3b9fcb'),
+    ('The quick brown fox jumps over the lazy dog',
+     '37f332f68db77bd9d7edd4969571ad671cf9dd3b',
+     '0e3397b4abc7a382b3ea2365883c3c7ca5f07600'),
+    ('The quick brown fox jumps over the lazy cog',
+     '132072df690933835eb8b6ad0b77e7b6f14acad7',
+     '53e0dacac5249e46114f65cb1f30d156b14e0bdc'),
+    ('Nobody inspects the spammish repetition',
+     'cc4a5ce1b3df48aec5d22d1f16b894a0b894eccc',
+     '1c9b7b48049a8f98699bca22a5856c5ef571cd68'),
+]
+
+# The test vectors of the RIPEMD-160 reference, which cross the 55/56 and
+# 64 byte padding boundaries, with ripemd160(sha256(message))
+RIPEMD160_REFERENCE = [
+    ('', '9c1185a5c5e9fc54612808977ee8f548b2258d31',
+     'b472a266d0bd89c13706a4132ccfb16f7c3b9fcb'),
+    ('a', '0bdc9d2d256b3ee9daae347be6f4dc835a467ffe',
+     '994355199e516ff76c4fa4aab39337b9d84cf12b'),
+    ('abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc',
+     'bb1be98c142444d7a56aa3981c3942a978e4dc33'),
+    ('message digest', '5d0689ef49d2fae572b881b123a85ffa21595f36',
+     'c0f5356420849b03a32ddfa5f9204f41392bad94'),
+    ('abcdefghijklmnopqrstuvwxyz', 'f71c27109c692c1b56bbdceb5b9d2865b3708dbc',
+     'c286a1af0947f58d1ad787385b1c2c4a976f9e71'),
+    ('abcdbcdecdefdefgefghfghighijhijkijkljklmklmnlmnomnopnopq',
+     '12a053384a9c0c88e405a06c27dcf49ada62eb2b',
+     '69dda8a60e0cfc2353aa776864092c0e5ccb4834'),
+    ('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789',
+     'b0e20b6e3116640286ed3a87a5713079b21f5189',
+     '7aeed7ddde700075e4620e5ece9c50f1929b24c8'),
+    ('1234567890' * 8, '9b752e45573d4b39f4dbd3323cab82bf63326bfb',
+     '175a89feae4e48f03fbb2dd0878fb4944c55ef41'),
+]
+
+
 class TestRipeMD160PythonBackup(unittest.TestCase):
 
     @classmethod
@@ -384,27 +1009,7 @@ class TestRipeMD160PythonBackup(unittest.TestCase):
         print('Testing the pure python backup for ripemd160')
 
     def test_all(self):
-        strvec = [
-            '',
-            'The quick brown fox jumps over the lazy dog',
-            'The quick brown fox jumps over the lazy cog',
-            'Nobody inspects the spammish repetition'
-        ]
-
-        target = [
-            '9c1185a5c5e9fc54612808977ee8f548b2258d31',
-            '37f332f68db77bd9d7edd4969571ad671cf9dd3b',
-            '132072df690933835eb8b6ad0b77e7b6f14acad7',
-            'cc4a5ce1b3df48aec5d22d1f16b894a0b894eccc'
-        ]
-
-        hash160target = [
-            'b472a266d0bd89c13706a4132ccfb16f7c3b9fcb',
-            '0e3397b4abc7a382b3ea2365883c3c7ca5f07600',
-            '53e0dacac5249e46114f65cb1f30d156b14e0bdc',
-            '1c9b7b48049a8f98699bca22a5856c5ef571cd68'
-        ]
-
+        strvec, target, hash160target = [list(v) for v in zip(*RIPEMD160_VECTORS)]
         for i, s in enumerate(strvec):
             digest = ripemd.RIPEMD160(s).digest()
             hash160digest = ripemd.RIPEMD160(bin_sha256(s)).digest()
@@ -412,6 +1017,70 @@ class TestRipeMD160PythonBackup(unittest.TestCase):
             self.assertEqual(bytes_to_hex_string(hash160digest), hash160target[i])
             self.assertEqual(bytes_to_hex_string(bin_hash160(from_string_to_bytes(s))), hash160target[i])
             self.assertEqual(hash160(from_string_to_bytes(s)), hash160target[i])
+            self.assertEqual(bytes_to_hex_string(ripemd.rmd160(bin_sha256(s))), hash160target[i])
+
+        data = [from_string_to_bytes(s) for s in strvec]
+        self.assertEqual(hash160_many(data), hash160target)
+        self.assertEqual(bin_hash160_many(data), [bin_hash160(d) for d in data])
+
+    def test_fallback(self):
+        import bitcoin.main
+        data = [from_string_to_bytes(s) for s, _, _ in RIPEMD160_REFERENCE]
+        digests = [binascii.unhexlify(h) for _, h, _ in RIPEMD160_REFERENCE]
+        hash160s = [binascii.unhexlify(h) for _, _, h in RIPEMD160_REFERENCE]
+        native = bitcoin.main.HASHLIB_RIPEMD160
+        bitcoin.main.HASHLIB_RIPEMD160 = False
+        try:
+            self.assertEqual([bin_ripemd160(d) for d in data], digests)
+            self.assertEqual([bin_hash160(d) for d in data], hash160s)
+            self.assertEqual(bin_hash160_many(data), hash160s)
+        finally:
+            bitcoin.main.HASHLIB_RIPEMD160 = native
+
+    def test_incremental(self):
+        data = os.urandom(300)
+        h = ripemd.new()
+        for i in range(0, 300, 7):
+            h.update(data[i:i + 7])
+        self.assertEqual(h.digest(), ripemd.rmd160(data))
+        c = h.copy()
+        c.update(b'x')
+        self.assertEqual(h.hexdigest(), bytes_to_hex_string(ripemd.rmd160(data)))
+        self.assertEqual(c.digest(), ripemd.rmd160(data + b'x'))
+
+
+class TestRipeMD160NumPy(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Testing the NumPy lane-parallel ripemd160')
+
+    @unittest.skipIf(not ripemd_numpy.available(), 'NumPy is not installed')
+    def test_all(self):
+        for s, target, hash160target in RIPEMD160_VECTORS:
+            data = from_string_to_bytes(s)
+            self.assertEqual(ripemd_numpy.rmd160_many([data] * 3),
+                             [safe_from_hex(target)] * 3)
+            self.assertEqual(ripemd_numpy.rmd160_many([bin_sha256(s)]),
+                             [safe_from_hex(hash160target)])
+        for length in [20, 32, 55, 56, 64, 100]:
+            data = [os.urandom(length) for i in range(9)]
+            self.assertEqual(ripemd_numpy.rmd160_many(data),
+                             [ripemd.rmd160(d) for d in data])
+        self.assertEqual(ripemd_numpy.rmd160_many([]), [])
+        self.assertRaises(ValueError, ripemd_numpy.rmd160_many, [b'a', b'ab'])
+
+    @unittest.skipIf(not ripemd_numpy.available(), 'NumPy is not installed')
+    def test_hash160_many(self):
+        import bitcoin.main
+        data = [os.urandom(33) for i in range(NUMPY_HASH160_THRESHOLD + 1)]
+        expected = [bin_hash160(d) for d in data]
+        native = bitcoin.main.HASHLIB_RIPEMD160
+        bitcoin.main.HASHLIB_RIPEMD160 = False
+        try:
+            self.assertEqual(bin_hash160_many(data), expected)
+        finally:
+            bitcoin.main.HASHLIB_RIPEMD160 = native
 
 
 class TestScriptVsAddressOutputs(unittest.TestCase):
@@ -516,6 +1185,32 @@ class TestDerEncoding(unittest.TestCase):
         for n, sig in data:
             decoded = der_encode_sig(0, n, n)
             self.assertEqual(decoded, sig)
+            self.assertEqual(bin_der_encode_sig(0, n, n), binascii.unhexlify(sig))
+            self.assertEqual(der_decode_sig(sig)[1::2], (n, n))
+            self.assertEqual(der_decode_sig(binascii.unhexlify(sig + '01'))[1::2], (n, n))
+            self.assertEqual(parse_der_sig(binascii.unhexlify(sig + '03')), (n, n, 3))
+            self.assertTrue(is_bip66(sig))
+
+    def test_strict(self):
+        sig = binascii.unhexlify('3006020101020101' + '01')
+        self.assertEqual(parse_der_sig(sig), (1, 1, 1))
+        for bad in ['3007020101020101' + '01',        # wrong total length
+                    '3006030101020101' + '01',        # R not an integer
+                    '3006020201020101' + '01',        # R overruns
+                    '300602000201010101',             # empty R
+                    '3006020181020101' + '01',        # negative R
+                    '300702020001020101' + '01',      # R padded with a zero
+                    '3006020101020181' + '01',        # negative S
+                    '3006020101020101']:              # no sighash byte
+            self.assertIsNone(parse_der_sig(binascii.unhexlify(bad)), bad)
+        self.assertTrue(is_bip66('3006020101020101'))
+        self.assertFalse(is_bip66('3006020181020101'))
+
+        high = bin_der_encode_sig(0, 1, N - 1) + b'\x01'
+        self.assertEqual(parse_der_sig(high), (1, N - 1, 1))
+        self.assertIsNone(parse_der_sig(high, low_s=True))
+        low = bin_der_encode_sig(0, 1, N // 2) + b'\x01'
+        self.assertEqual(parse_der_sig(low, low_s=True), (1, N // 2, 1))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+import ast
+import os
+import subprocess
+import sys
+import unittest
+
+import bitcoin
+
+_EAGER = sys.version_info < (3, 7)
+
+
+def is_main_guard(node):
+    # if __name__ == "__main__":
+    return isinstance(node.test, ast.Compare) and \
+        isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__'
+
+
+def top_level_names(nodes):
+    names = []
+    for node in nodes:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.append(node.name)
+        elif isinstance(node, ast.Assign):
+            names.extend(t.id for t in node.targets if isinstance(t, ast.Name))
+        elif isinstance(node, ast.If) and not is_main_guard(node):
+            names.extend(top_level_names(node.body + node.orelse))
+    return names
+
+
+def loaded_modules(code):
+    # Names of the modules of interest loaded after running code in a fresh
+    # interpreter
+    check = code + '; import sys; print(" ".join(m for m in ' \
+        '["bitcoin.bci", "bitcoin.composite", "bitcoin.mnemonic", "bitcoin.blockfiles", ' \
+        '"requests"] ' \
+        'if m in sys.modules))'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, '-c', check], cwd=root)
+    return out.decode('utf-8').split()
+
+
+class TestLazyImport(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('Starting lazy import tests')
+
+    @unittest.skipIf(_EAGER, 'module __getattr__ needs Python 3.7')
+    def test_lazy(self):
+        self.assertEqual(loaded_modules('import bitcoin'), [])
+        self.assertEqual(loaded_modules('import bitcoin; bitcoin.entropy_to_words'),
+                         ['bitcoin.mnemonic'])
+        self.assertEqual(loaded_modules('import bitcoin; bitcoin.history'), ['bitcoin.bci'])
+        self.assertEqual(loaded_modules('import bitcoin; bitcoin.BlockFiles'), ['bitcoin.blockfiles'])
+        self.assertEqual(loaded_modules('from bitcoin import *'),
+                         ['bitcoin.bci', 'bitcoin.composite', 'bitcoin.mnemonic',
+                          'bitcoin.blockfiles'])
+
+    def test_star_import(self):
+        namespace = {}
+        exec('from bitcoin import *', namespace)
+        for name in ['privtopub', 'mktx', 'bip32_ckd', 'history', 'send',
+                     'uncover_pay_pubkey_sender', 'get_block_header_data',
+                     'entropy_to_words', 'segwit_sign']:
+            self.assertTrue(name in namespace, name)
+        self.assertEqual(len(namespace['wordlist_english']), 2048)
+        self.assertTrue(namespace['inspect'] is bitcoin.composite.inspect)
+        self.assertRaises(AttributeError, getattr, bitcoin, 'no_such_function')
+
+    def test_lazy_names(self):
+        # The static name table in bitcoin/__init__.py must list every public
+        # top-level name of the lazily loaded modules
+        for module, names in bitcoin._LAZY_NAMES.items():
+            path = os.path.join(os.path.dirname(bitcoin.__file__), module + '.py')
+            with open(path) as f:
+                defined = top_level_names(ast.parse(f.read()).body)
+            self.assertEqual(sorted(set(n for n in defined if not n.startswith('_'))),
+                             sorted(names))
+
+
+if __name__ == '__main__':
+    unittest.main()
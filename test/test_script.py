@@ -0,0 +1,270 @@
+import binascii
+import hashlib
+import os
+import unittest
+
+import bitcoin.main
+
+from bitcoin import eval_script, verify_transaction, ScriptError, encode_script_num, \
+    decode_script_num, mktx, sign_transaction, mk_pubkey_script, pubtoaddr, privtopub, \
+    mk_multisig_script, p2sh_scriptaddr, address_to_script, bin_hash160, multisign, \
+    apply_multisignatures, ecdsa_batch_verify, deserialize, serialize, Transaction, \
+    iter_script, classify_script, script_to_address, deserialize_script, compress, \
+    ecdsa_raw_sign, segwit_sign, der_encode_sig, serialize_script
+from .test_segwit import TEST_CASES
+
+
+class TestScriptNum(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for n in [0, 1, -1, 127, 128, -128, 255, 256, 32767, -32768, 2 ** 31 - 1, -(2 ** 31 - 1)]:
+            self.assertEqual(decode_script_num(encode_script_num(n)), n)
+        self.assertEqual(encode_script_num(0), b'')
+        self.assertEqual(encode_script_num(-1), b'\x81')
+        self.assertEqual(encode_script_num(128), b'\x80\x00')
+        # Minimal encoding is policy, not consensus
+        self.assertEqual(decode_script_num(b'\x01\x00'), 1)
+        self.assertEqual(decode_script_num(b'\x01\x80'), -1)
+        self.assertRaises(ScriptError, decode_script_num, b'\x01\x02\x03\x04\x05')
+
+
+class TestEvalScript(unittest.TestCase):
+
+    def run_script(self, script):
+        stack = []
+        eval_script(stack, binascii.unhexlify(script), None)
+        return stack
+
+    def test_arithmetic(self):
+        # 2 3 ADD 5 EQUAL
+        self.assertEqual(self.run_script('5253935587'), [b'\x01'])
+        # 1 IF 2 ELSE 3 ENDIF
+        self.assertEqual(self.run_script('516352675368'), [b'\x02'])
+        # 0 NOTIF 7 ENDIF DUP SIZE
+        self.assertEqual(self.run_script('006457687682'), [b'\x07', b'\x07', b'\x01'])
+
+    def test_failures(self):
+        self.assertEqual(self.run_script('5169'), [])
+        for script in ['6a',        # RETURN
+                       '0069',      # 0 VERIFY
+                       '7e',        # CAT is disabled
+                       '5163',      # unbalanced IF
+                       '75']:       # DROP on an empty stack
+            self.assertRaises(ScriptError, self.run_script, script)
+        # Pushes running past the end of the script
+        for script in ['0301', '4c', '4c0201', '4d0100', '4e01000000']:
+            self.assertRaises(ScriptError, self.run_script, script)
+
+
+class TestScriptTemplates(unittest.TestCase):
+
+    def test_iter_script(self):
+        script = binascii.unhexlify('00' + '4c03aabbcc' + '02ddee' + '51' + '4f' + 'ae' + '4d0200ffff')
+        ops = [(code, None if data is None else data.tobytes()) for code, data in iter_script(script)]
+        self.assertEqual(ops, [(0, b''), (0x4c, b'\xaa\xbb\xcc'), (2, b'\xdd\xee'), (0x51, None),
+                               (0x4f, None), (0xae, None), (0x4d, b'\xff\xff')])
+        self.assertEqual(deserialize_script(script), [None, b'\xaa\xbb\xcc', b'\xdd\xee', 1, -1, 0xae,
+                                                      b'\xff\xff'])
+        self.assertEqual(deserialize_script(binascii.hexlify(script).decode()),
+                         [None, 'aabbcc', 'ddee', 1, -1, 0xae, 'ffff'])
+        # Pushes are views into the script
+        self.assertIsInstance(list(iter_script(script))[1][1], memoryview)
+        # Pushes and PUSHDATA lengths running past the end
+        for truncated in ['05aabb', '4c', '4c02aa', '4d01', '4d0300aabb', '4e010000', '51' + '4e05000000aa']:
+            self.assertRaises(ValueError, list, iter_script(truncated))
+            self.assertRaises(ValueError, deserialize_script, truncated)
+
+    def test_classify(self):
+        pub = privtopub('%064x' % 1)
+        pubs = [privtopub('%064x' % (i + 1)) for i in range(3)]
+        h = '11' * 20
+        cases = [
+            ('76a914' + h + '88ac', 'p2pkh'),
+            ('a914' + h + '87', 'p2sh'),
+            ('0014' + h, 'p2wpkh'),
+            ('0020' + '22' * 32, 'p2wsh'),
+            ('41' + pub + 'ac', 'p2pk'),
+            ('21' + compress(pub) + 'ac', 'p2pk'),
+            (mk_multisig_script(pubs, 2), 'multisig'),
+            (mk_multisig_script(pubs[:1], 1), 'multisig'),
+            ('6a' + '0568656c6c6f', 'op_return'),
+            ('6a', 'op_return'),
+            ('', 'nonstandard'),
+            ('76a914' + h + '88ad', 'nonstandard'),
+            ('a914' + h + '88', 'nonstandard'),
+            ('0015' + h + '11', 'nonstandard'),
+            ('52' + mk_multisig_script(pubs, 2)[2:-4] + '51ae', 'nonstandard'),   # m > n
+            (mk_multisig_script(pubs, 2)[:-6] + '53ae', 'nonstandard'),           # truncated key
+        ]
+        for script, kind in cases:
+            self.assertEqual(classify_script(script), kind, script)
+            self.assertEqual(classify_script(binascii.unhexlify(script)), kind, script)
+
+    def test_script_to_address(self):
+        h = '11' * 20
+        self.assertEqual(script_to_address('76a914' + h + '88ac')[0], '1')
+        self.assertEqual(script_to_address('a914' + h + '87')[0], '3')
+        for script in ['0014' + h, '6a00', '0020' + '22' * 32]:
+            self.assertRaises(Exception, script_to_address, script)
+
+
+class TestVerifyTransaction(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.privs = ['%064x01' % (j + 1) for j in range(5)]
+        cls.pubs = [privtopub(p) for p in cls.privs]
+
+    def test_segwit_vector(self):
+        tx = TEST_CASES[0]
+        pub = binascii.unhexlify(tx['ins'][1]['pubkey'])
+        prevouts = [{'script': tx['ins'][0]['scriptSig'], 'value': 0},
+                    {'script': b'\x00\x14' + bin_hash160(pub),
+                     'value': int(tx['ins'][1]['amount'] * 10 ** 8)}]
+        for verifier in [None, ecdsa_batch_verify]:
+            results = verify_transaction(tx['signed'], prevouts, verifier)
+            self.assertEqual([(r.valid, r.kind) for r in results], [(True, 'legacy'), (True, 'p2wpkh')])
+        # The amount is committed to by the BIP143 signature only
+        prevouts[1]['value'] += 1
+        for verifier in [None, ecdsa_batch_verify]:
+            results = verify_transaction(tx['signed'], prevouts, verifier)
+            self.assertEqual([r.valid for r in results], [True, False])
+
+    def test_sign_transaction(self):
+        witness_script = mk_multisig_script(self.pubs[2:], 2)
+        redeem = '0020' + hashlib.sha256(binascii.unhexlify(witness_script)).hexdigest()
+        prevouts = [
+            {'script': mk_pubkey_script(pubtoaddr(self.pubs[0])), 'value': 10000},
+            {'script': '0014' + binascii.hexlify(bin_hash160(binascii.unhexlify(self.pubs[1]))).decode(),
+             'value': 20000},
+            {'script': address_to_script(p2sh_scriptaddr(redeem)), 'value': 30000,
+             'witness_script': witness_script}]
+        tx = mktx(['%02x' % j * 32 + ':%d' % j for j in range(3)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:50000'])
+        signed = sign_transaction(tx, [self.privs[0], self.privs[1], [self.privs[2], self.privs[4]]],
+                                  prevouts)
+        results = verify_transaction(Transaction(signed), prevouts, ecdsa_batch_verify)
+        self.assertEqual([(r.index, r.valid, r.kind) for r in results],
+                         [(0, True, 'legacy'), (1, True, 'p2wpkh'), (2, True, 'p2sh-p2wsh')])
+
+        # A changed output invalidates every SIGHASH_ALL signature
+        txobj = deserialize(signed)
+        txobj['outs'][0]['value'] -= 1
+        for verifier in [None, ecdsa_batch_verify]:
+            results = verify_transaction(serialize(txobj), prevouts, verifier)
+            self.assertFalse(any(r.valid for r in results))
+            self.assertTrue(all(r.error for r in results))
+
+    def test_truncated_push(self):
+        # 1 followed by a 3-byte push of one byte is invalid, not 1
+        tx = mktx(['aa' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000'])
+        for verifier in [None, ecdsa_batch_verify]:
+            result = verify_transaction(tx, [{'script': '510301', 'value': 2000}], verifier)[0]
+            self.assertFalse(result.valid)
+            self.assertTrue(result.error)
+        self.assertTrue(verify_transaction(tx, [{'script': '510101', 'value': 2000}])[0].valid)
+
+    def count_checks(self, fn, *args):
+        # fn(*args), the number of single verifications it made and whether
+        # each combined check it made passed
+        singles, combined = [], []
+        raw_verify = bitcoin.main.ecdsa_raw_verify
+        multiply = bitcoin.main.jacobian_multi_scalar_multiply
+
+        def counted_verify(*a):
+            singles.append(a)
+            return raw_verify(*a)
+
+        def counted_multiply(*a):
+            result = multiply(*a)
+            combined.append(not result[1])
+            return result
+
+        bitcoin.main.ecdsa_raw_verify = counted_verify
+        bitcoin.main.jacobian_multi_scalar_multiply = counted_multiply
+        try:
+            return fn(*args), len(singles), combined
+        finally:
+            bitcoin.main.ecdsa_raw_verify = raw_verify
+            bitcoin.main.jacobian_multi_scalar_multiply = multiply
+
+    def test_batch_without_fallback(self):
+        # Fresh keys and outputs, so nothing comes from the signature cache
+        privs = [binascii.hexlify(os.urandom(32)).decode() + '01' for j in range(6)]
+        prevouts = [{'script': mk_pubkey_script(pubtoaddr(privtopub(priv))), 'value': 1000}
+                    for priv in privs]
+        tx = mktx([binascii.hexlify(os.urandom(32)).decode() + ':%d' % j for j in range(6)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:5000'])
+        signed = sign_transaction(tx, privs, prevouts)
+        calls = []
+
+        def verifier(checks):
+            calls.append(len(checks))
+            return ecdsa_batch_verify(checks)
+
+        # DER signatures leave the parity of R open: each is checked once,
+        # with no combined check to fail and bisect, and no input runs again
+        results, singles, combined = self.count_checks(verify_transaction, signed, prevouts, verifier)
+        self.assertTrue(all(r.valid for r in results))
+        self.assertEqual((calls, singles, combined), ([6], 6, []))
+
+        # Signatures with a recovery id pass one combined check
+        items = []
+        for priv in privs:
+            digest = os.urandom(32)
+            items.append((digest, ecdsa_raw_sign(digest, priv), privtopub(priv)))
+        results, singles, combined = self.count_checks(ecdsa_batch_verify, items)
+        self.assertEqual(results, [True] * 6)
+        self.assertEqual((singles, combined), (0, [True]))
+
+    def test_witness_versions(self):
+        # A Taproot output spent with a garbage witness is not reported valid
+        txobj = Transaction(mktx(['ee' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000']))
+        txobj.ins[0].witness = [b'\x01' * 64]
+        txobj.segwit = True
+        for program in ['5120' + '33' * 32, '6002' + '4444']:
+            for verifier in [None, ecdsa_batch_verify]:
+                result = verify_transaction(txobj, [{'script': program, 'value': 2000}], verifier)[0]
+                self.assertEqual((result.valid, result.kind), (False, None))
+                self.assertIn('Unsupported witness version', result.error)
+
+    def test_malformed_pubkey(self):
+        # Key lengths that do not match their prefix fail the same way in
+        # both modes
+        sig = der_encode_sig(27, 5, 7) + '01'
+        tx = deserialize(mktx(['dd' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:1000']))
+        tx['ins'][0]['script'] = serialize_script([sig])
+        tx = serialize(tx)
+        for pub in ['04' + '11' * 32, '02' + '11' * 64, '06' + '11' * 64, '']:
+            prevouts = [{'script': serialize_script([pub, 0xac]), 'value': 2000}]
+            for verifier in [None, ecdsa_batch_verify]:
+                result = verify_transaction(tx, prevouts, verifier)[0]
+                self.assertFalse(result.valid, pub)
+                self.assertTrue(result.error)
+
+    def test_unknown_sighash(self):
+        # Witness signatures with undefined hash types verify
+        priv = self.privs[0]
+        prevout = {'script': '0014' + binascii.hexlify(bin_hash160(binascii.unhexlify(self.pubs[0]))).decode(),
+                   'value': 10000}
+        tx = mktx(['bb' * 32 + ':0', 'cc' * 32 + ':1'],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:5000', '1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:4000'])
+        for hashcode in [0, 4, 0x21, 0x84, 0x43, 0xc2]:
+            signed = segwit_sign(tx, 0, priv, 10000, hashcode)
+            result = verify_transaction(signed, [prevout, {'script': '51', 'value': 1}])[0]
+            self.assertEqual((result.valid, result.kind), (True, 'p2wpkh'), hex(hashcode))
+
+    def test_p2sh_multisig(self):
+        script = mk_multisig_script(self.pubs[:3], 2)
+        prevouts = {'aa' * 32 + ':0': {'script': address_to_script(p2sh_scriptaddr(script)), 'value': 1}}
+        tx = mktx(['aa' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:50000'])
+        sigs = [multisign(tx, 0, script, self.privs[0]), multisign(tx, 0, script, self.privs[2])]
+        signed = apply_multisignatures(tx, 0, script, sigs).decode()
+        self.assertEqual(verify_transaction(signed, prevouts)[0].kind, 'p2sh')
+        # CHECKMULTISIG wants the signatures in the order of the keys
+        signed = apply_multisignatures(tx, 0, script, sigs[::-1]).decode()
+        self.assertFalse(verify_transaction(signed, prevouts)[0].valid)
+
+
+if __name__ == '__main__':
+    unittest.main()
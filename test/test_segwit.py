@@ -2,8 +2,13 @@ import unittest
 from bitcoin import deserialize, segwit_sign, mktx, serialize, SIGHASH_ALL, p2pk_sign, \
     strip_witness_data, privtopub, segwit_multisign, \
     apply_segwit_multisignatures, SIGHASH_SINGLE, SIGHASH_ANYONECANPAY, mk_multisig_script, \
-    SIGHASH_NONE, mk_OPCS_multisig_script
+    SIGHASH_NONE, mk_OPCS_multisig_script, sign, Transaction, segwit_txhash, BIP143Context, \
+    segwit_signature_form, segwit_verify_tx_input, mk_pubkey_script, pubtoaddr, sign_transaction, \
+    p2sh_scriptaddr, address_to_script, bin_hash160, decompress
+import binascii
+import hashlib
 import os
+import struct
 
 TEST_CASES = [
     {
@@ -271,6 +276,48 @@ class Test_SegregatedWitness(unittest.TestCase):
         self.assertEqual(signed, tx['signed'])
         print('[Native P2WPKH] SIGHASH_ALL OK')
 
+    def test_native_P2WPKH_transaction_object(self):
+        tx = TEST_CASES[0]
+        txobj = Transaction(tx['unsigned'])
+        p2pk_sign(txobj, 0, self.append_compressed_flag_to_privkey(tx['ins'][0]['privkey']))
+        signed = segwit_sign(txobj, 1,
+                             self.append_compressed_flag_to_privkey(tx['ins'][1]['privkey']),
+                             tx['ins'][1]['amount'] * 10**8)
+        self.assertEqual(signed, tx['signed'])
+        self.assertEqual(txobj.serialize(), tx['signed'])
+        self.assertEqual(strip_witness_data(txobj), strip_witness_data(tx['signed']))
+        self.assertEqual(segwit_txhash(txobj), segwit_txhash(tx['signed']))
+        self.assertEqual(txobj.vsize(), (3 * len(strip_witness_data(tx['signed'])) // 2 +
+                                         len(tx['signed']) // 2 + 3) // 4)
+
+
+    def test_undefined_hashcodes(self):
+        # Any hash type signs like the defined one with the same low five
+        # bits (ALL unless NONE or SINGLE) and ANYONECANPAY bit, and is
+        # committed to as it is
+        context = BIP143Context(TEST_CASES[0]['unsigned'])
+        for hashcode, like in [(0, 1), (4, 1), (0x21, 1), (0x84, 0x81), (0x43, 3), (0xc2, 0x82)]:
+            preimage = context.preimage(0, '51', 1000, hashcode)
+            self.assertEqual(preimage[:-4], context.preimage(0, '51', 1000, like)[:-4])
+            self.assertEqual(preimage[-4:], struct.pack('<I', hashcode))
+
+    def test_shared_context(self):
+        tx = TEST_CASES[0]
+        context = BIP143Context(tx['unsigned'])
+        for i in range(2):
+            for hashcode in [SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE | SIGHASH_ANYONECANPAY]:
+                self.assertEqual(segwit_signature_form(tx['unsigned'], i, '51', 1000, hashcode),
+                                 segwit_signature_form(tx['unsigned'], i, '51', 1000, hashcode,
+                                                       context=context))
+        priv = self.append_compressed_flag_to_privkey(tx['ins'][1]['privkey'])
+        amount = tx['ins'][1]['amount'] * 10**8
+        txobj = deserialize(tx['unsigned'])
+        signed = segwit_sign(txobj, 1, priv, amount, context=context)
+        self.assertEqual(signed, segwit_sign(tx['unsigned'], 1, priv, amount))
+        sig, pub = txobj['ins'][1]['txinwitness']
+        script = mk_pubkey_script(pubtoaddr(pub))
+        self.assertTrue(segwit_verify_tx_input(signed, 1, script, sig, pub, amount, context=context))
+        self.assertFalse(segwit_verify_tx_input(signed, 1, script, sig, pub, amount + 1))
 
     def test_native_P2WSH_SIGHASH_SINGLE(self):
         tx = TEST_CASES[1]
@@ -424,5 +471,62 @@ class Test_SegregatedWitness(unittest.TestCase):
         self.assertEqual(signed, tx['signed'])
         print('[P2WSH 6-of-6 multisig NESTED in P2SH] SIGHASH_SINGLE\SIGHASH_ALL\SIGHASH_NONE & ANYONECANPAY')
 
+    def test_sign_transaction(self):
+        # The P2PK and P2WPKH inputs of the first test case
+        tx = TEST_CASES[0]
+        keys = [self.append_compressed_flag_to_privkey(inp['privkey']) for inp in tx['ins']]
+        prevouts = [{'script': tx['ins'][0]['scriptSig'], 'value': 0},
+                    {'script': '0014' + bin_hash160(binascii.unhexlify(tx['ins'][1]['pubkey'])).hex(),
+                     'value': tx['ins'][1]['amount'] * 10**8}]
+        self.assertEqual(sign_transaction(tx['unsigned'], keys, prevouts), tx['signed'])
+        self.assertEqual(sign_transaction(tx['unsigned'], keys, prevouts, executor='thread', workers=2),
+                         tx['signed'])
+
+    def test_sign_transaction_mixed(self):
+        privs = [self.append_compressed_flag_to_privkey('%064x' % (j + 1)) for j in range(5)]
+        pubs = [privtopub(priv) for priv in privs]
+        witness_script = mk_multisig_script(pubs[2:], 3)
+        redeem = '0020' + hashlib.sha256(binascii.unhexlify(witness_script)).hexdigest()
+        prevouts = [
+            {'script': mk_pubkey_script(pubtoaddr(pubs[0])), 'value': 10000},
+            {'script': '0014' + bin_hash160(binascii.unhexlify(pubs[1])).hex(), 'value': 20000},
+            {'script': address_to_script(p2sh_scriptaddr(redeem)), 'value': 30000,
+             'witness_script': witness_script}]
+        tx = mktx(['%02x' % j * 32 + ':%d' % j for j in range(3)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:50000'])
+        keymap = {'00' * 32 + ':0': privs[0], '01' * 32 + ':1': privs[1],
+                  '02' * 32 + ':2': [privs[4], privs[2], privs[3]]}
+        signed = sign_transaction(tx, keymap, prevouts)
+        expected = sign(tx, 0, privs[0])
+        expected = segwit_sign(expected, 1, privs[1], 20000)
+        sigs = [segwit_multisign(tx, 2, witness_script, priv, 30000) for priv in privs[2:]]
+        expected = apply_segwit_multisignatures(expected, 2, witness_script, sigs, nested=True)
+        self.assertEqual(signed, expected)
+        self.assertRaises(Exception, sign_transaction, tx, privs[0], prevouts)
+        # The P2SH-P2WSH input first, before keys for the others are loaded
+        tx = mktx(['%02x' % j * 32 + ':%d' % j for j in (2, 0, 1)],
+                  ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:50000'])
+        prevouts = [prevouts[2], prevouts[0], prevouts[1]]
+        signed = sign_transaction(tx, keymap, prevouts)
+        sigs = [segwit_multisign(tx, 0, witness_script, priv, 30000) for priv in privs[2:]]
+        expected = apply_segwit_multisignatures(tx, 0, witness_script, sigs, nested=True)
+        expected = sign(expected, 1, privs[0])
+        expected = segwit_sign(expected, 2, privs[1], 20000)
+        self.assertEqual(signed, expected)
+        # A key that is not in the witness script
+        keymap['02' * 32 + ':2'] = [privs[2], privs[0]]
+        self.assertRaises(Exception, sign_transaction, tx, keymap, prevouts)
+
+    def test_sign_transaction_p2pk(self):
+        priv = self.append_compressed_flag_to_privkey('%064x' % 1)
+        pub = privtopub(priv)
+        tx = mktx(['00' * 32 + ':0'], ['1HLoD9E4SDFFPDiYfNYnkBLQ85Y51J3Zb1:50000'])
+        prevout = {'script': '21' + pub + 'ac', 'value': 10000}
+        self.assertEqual(sign_transaction(tx, priv, prevout), p2pk_sign(tx, 0, priv))
+        # Another key, or the same key in the other encoding
+        for script in ['21' + privtopub('%064x01' % 2) + 'ac', '41' + decompress(pub) + 'ac']:
+            self.assertRaises(Exception, sign_transaction, tx, priv, {'script': script, 'value': 10000})
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file